@@ -10,14 +10,15 @@
 
 #include "bandpass.h"
 #include "gainbalance.h"
-#include "mixer.h"
-#include "splitter.h"
 #include "effect.h"
 #include "freqdomain.h"
+#include "params.h"
 
 
 static GHashTable* fgraph_db = NULL;
 static pthread_mutex_t fgraph_db_mutex;
+// destroyed graphs a channel still runs, freed by fg_reap
+static GList* fgraph_retired = NULL;
 
 
 static void
@@ -95,10 +96,96 @@ struct fgraph_base* lookup_fgraph_object(char* uuid, int expected_type)
 }
 
 
-void fg_create(char* uuid)
+void fg_retain(struct fgraph* fg)
 {
+    __atomic_add_fetch(&fg->users, 1, __ATOMIC_ACQ_REL);
+}
+
+void fg_release(struct fgraph* fg)
+{
+    __atomic_sub_fetch(&fg->users, 1, __ATOMIC_ACQ_REL);
+}
+
+static void fg_node_free(gpointer data)
+{
+    struct fgraph_node* node = (struct fgraph_node*) data;
+
+    if (node->base.type == FG_NODE_TYPE_EFFECT) {
+        gcsynth_filter_destroy(((struct fgraph_effect*) node)->filter);
+    }
+    g_list_free(node->in_ports);
+    g_list_free(node->out_ports);
+    free(node);
+}
+
+static void fg_free_node_entry(gpointer key, gpointer value, gpointer user_data)
+{
+    struct fgraph_node* node = (struct fgraph_node*) value;
+
+    switch(node->base.type) {
+        case FG_NODE_TYPE_LOWPASS:
+        case FG_NODE_TYPE_HIGHPASS:
+        case FG_NODE_TYPE_BANDPASS:
+            if (!node->using_fallback_method_for_freqdomain) {
+                midi_filter_decrement();
+            }
+            break;
+    }
+    fg_node_free(node);
+}
+
+static void fg_free_connection_entry(gpointer key, gpointer value, gpointer user_data)
+{
+    free(value);
+}
+
+static void fg_free(struct fgraph* fg)
+{
+    fg_plan_free(fg->plan);
+    g_list_free_full(fg->retired, (GDestroyNotify) fg_plan_free);
+    g_list_free_full(fg->deleted_nodes, fg_node_free);
+
+    // remove nodes and connections from graph.
+    if (fg->nodes != NULL) {
+        g_hash_table_foreach(fg->nodes, fg_free_node_entry, NULL);
+        g_hash_table_destroy(fg->nodes);
+    }
+    if (fg->connections != NULL) {
+        g_hash_table_foreach(fg->connections, fg_free_connection_entry, NULL);
+        g_hash_table_destroy(fg->connections);
+    }
+    free(fg);
+}
+
+// free the destroyed graphs no channel runs anymore
+static void fg_reap()
+{
+    GList* iter = fgraph_retired;
+
+    while (iter != NULL) {
+        GList* next = iter->next;
+        struct fgraph* fg = (struct fgraph*) iter->data;
+
+        if (__atomic_load_n(&fg->users, __ATOMIC_ACQUIRE) == 0) {
+            fgraph_retired = g_list_delete_link(fgraph_retired, iter);
+            fg_free(fg);
+        }
+        iter = next;
+    }
+}
+
+int fg_create(char* uuid)
+{
+    fg_reap();
     if (fgraph_db != NULL) {
-        struct fgraph* fg = malloc(sizeof(struct fgraph));
+        struct fgraph* fg;
+
+        if (g_hash_table_lookup(fgraph_db, uuid) != NULL) {
+            // replacing it would leak the graph and leave it playing
+            gcsynth_raise_exception("fg_create: a filter graph with this uuid exists\n");
+            return -1;
+        }
+        fg = malloc(sizeof(struct fgraph));
         memset(fg, 0, sizeof(struct fgraph));
         strncpy(fg->base.uuid, uuid, sizeof(fg->base.uuid)-1);
 
@@ -109,6 +196,7 @@ void fg_create(char* uuid)
         g_hash_table_insert(fgraph_db, fg->base.uuid, fg);
         //printf("Created node type %d with uuid = %s\n", fg->base.type, fg->base.uuid);
     }
+    return 0;
 }
 
 void fg_set_enable(char* uuid, int enabled)
@@ -119,6 +207,9 @@ void fg_set_enable(char* uuid, int enabled)
         return;
     }
 
+    if (enabled && fg->plan == NULL) {
+        fg_compile_graph(fg);
+    }
     fg->enabled = enabled;
 }
 
@@ -132,21 +223,17 @@ void fg_destroy(char* uuid)
             return;
         }
 
-        // detetach from channel.
-
-        // remove nodes and connections from graph.
-        if (fg->nodes != NULL) {
-            g_hash_table_destroy(fg->nodes);
-        }
-        if (fg->connections != NULL) {
-            g_hash_table_destroy(fg->connections);
-        }
-
         // remove entry.
         g_hash_table_remove(fgraph_db, uuid);
         //printf("Deleted node type %d with uuid = %s\n", fg->base.type, fg->base.uuid);
 
-        free(fg);
+        // a channel may still be running it or fading it out, the nodes 
+        // and connections go with it. Only a fade may still be heard.
+        if (!gcsynth_channel_fading_filter_graph(fg)) {
+            fg->enabled = 0;
+        }
+        fgraph_retired = g_list_append(fgraph_retired, fg);
+        fg_reap();
     }
 }
 
@@ -195,6 +282,7 @@ int fg_create_node(char* fg_uuid, char* node_uuid, int node_type)
     int ret = 0;
 
     if (fg != NULL) {
+        fg_invalidate(fg);
         switch(node_type) {
             // create a low pass filter
             case  FG_NODE_TYPE_LOWPASS: {
@@ -255,17 +343,11 @@ int fg_create_node(char* fg_uuid, char* node_uuid, int node_type)
                         case FG_NODE_TYPE_INPUT:
                             fg->input_node = node;
                             break;
-                        case FG_NODE_TYPE_SPLITTER:
-                            node->run = splitter_run;
-                            break;
 
                         // likewise the output is the same as a mixer with one input 
                         case FG_NODE_TYPE_OUTPUT:
                             fg->output_node = node;
                             break;
-                        case FG_NODE_TYPE_MIXER:
-                            node->run = mixer_run;
-                            break;        
                     }
 
                     g_hash_table_insert(fg->nodes, node->base.uuid, node);
@@ -289,9 +371,8 @@ int fg_create_node(char* fg_uuid, char* node_uuid, int node_type)
                 }
                 break;
             case FG_NODE_TYPE_EFFECT: {
-                    struct fgraph_effect* e = malloc(sizeof(struct fgraph_effect));
+                    struct fgraph_effect* e = calloc(1, sizeof(struct fgraph_effect));
                     struct fgraph_node* node = &e->node;
-                    memset(node, 0, sizeof(struct fgraph_node));
                     strncpy(node->base.uuid, node_uuid, sizeof(node->base.uuid)-1);
                     node->base.type = node_type;
                     node->enabled = 1; // not ready until effect initialization is called.
@@ -348,8 +429,9 @@ int fg_delete_node(char* fg_uuid, char* node_uuid)
      */
     
     //g_hash_table_destroy(fg->nodes);
+    fg_invalidate(fg);
     g_hash_table_remove(fg->nodes, node_uuid);
-    free(node);
+    fg->deleted_nodes = g_list_append(fg->deleted_nodes, node);
 
     return 0;
 }
@@ -377,10 +459,17 @@ int fg_set_effect_property(char* fg_uuid, char* node_uuid, char* property, float
         } else {
             struct fgraph_effect* e = (struct fgraph_effect *) node;
 
+            int idx;
+
             if (e->filter == NULL) {
                 sprintf(errmsg,"fg_set_effect_property null filter\n");
-            } else {
-                ret = gcsynth_filter_setbyname(e->filter, property, value);
+            } else if ((idx = gcsynth_filter_control_index(e->filter, property)) == -1) {
+                ret = -1;
+            } else if ((ret = gcsynth_filter_check_value(&e->filter->controls[idx], value)) == NOWARNING) {
+                // applied by the audio thread, see params.h
+                if (fg_param_set(fg, e, idx, value) == -1) {
+                    sprintf(errmsg,"fg_set_effect_property parameter queue full for graph %s\n", fg_uuid);
+                }
             }
         }
     }
@@ -409,6 +498,8 @@ int fg_set_node_attribute(char* graph_uuid, char* node_uuid, int type,
             fg_lookup_node(fg, node_uuid);
 
         if (node != NULL) {
+            // the value's type is passed in, the node knows its own
+            type = node->base.type;
             switch(att_id) {
                 // common attribuates for all nodes.
                 case AID_ENABLE:
@@ -470,6 +561,7 @@ printf("fg_connect_nodes %s, conn_uuid %s, input_uuid=%s output_port=%d output_u
     if (fg != NULL) {
         struct fgraph_connection* conn = malloc(sizeof(struct fgraph_connection));
         memset(conn, 0, sizeof(struct fgraph_connection));
+        conn->slot = -1;
         conn->base.type = FG_CONNECTION;
         strncpy(conn->base.uuid, conn_uuid, sizeof(conn->base.uuid)-1);
 
@@ -499,6 +591,7 @@ printf("fg_connect_nodes %s, conn_uuid %s, input_uuid=%s output_port=%d output_u
              
              */
             struct fgraph_node *left = conn->in_node;
+            fg_invalidate(fg);
             struct fgraph_node *right = conn->out_node;
 
             int left_out_port_idx = g_list_length(left->out_ports);
@@ -544,6 +637,7 @@ int fg_delete_connection(char* fg_uuid, char* conn_uuid)
             gcsynth_raise_exception("fg_delete_connection no match for uuid\n");
         } else {
             // remove port connects in connected notes 
+            fg_invalidate(fg);
             conn->in_node->out_ports = g_list_remove(conn->in_node->out_ports, conn);
             conn->out_node->in_ports = g_list_remove(conn->out_node->in_ports, conn);
 
@@ -580,6 +674,7 @@ int assign_fg_to_channel(char* fg_uuid, int channel)
     int ret = 0;
 
     errmsg[0] = '\0';
+    fg_reap();
 
     if (fg == NULL) {
         sprintf(errmsg,"assign_fg_to_channel no match for graph %s", fg_uuid);
@@ -588,7 +683,13 @@ int assign_fg_to_channel(char* fg_uuid, int channel)
             (struct fg_channel_data* ) malloc(sizeof(struct fg_channel_data));
         user_data->channel = channel;
         user_data->fg = fg;
+        // released by the audio thread when replaced on the channel
+        fg_retain(fg);
         ret = gcsynth_sf_extern_func(channel, do_assign_fg_to_channel, user_data);
+        if (ret == -1) {
+            fg_release(fg);
+            free(user_data);
+        }
     }
 
     if (errmsg[0] != '\0') {
@@ -604,7 +705,36 @@ int unassign_fg_to_channel(int channel)
 {
     struct fg_channel_data* user_data = 
         (struct fg_channel_data* ) malloc(sizeof(struct fg_channel_data));
+
+    fg_reap();
     user_data->channel = channel;
     user_data->fg = NULL;
     return gcsynth_sf_extern_func(channel, do_assign_fg_to_channel, user_data);
 }
+
+
+int install_fg_on_channel(char* fg_uuid, int channel)
+{
+    struct fgraph* fg = (struct fgraph*) lookup_fgraph_object(fg_uuid, FG_GRAPH);
+    char errmsg[256];
+
+    if (fg == NULL) {
+        sprintf(errmsg,"install_fg_on_channel no match for graph %s", fg_uuid);
+        gcsynth_raise_exception(errmsg);
+        return -1;
+    } 
+    if (channel < 0 || channel >= NUM_CHANNELS) {
+        sprintf(errmsg,"install_fg_on_channel channel %d out of range", channel);
+        gcsynth_raise_exception(errmsg);
+        return -1;
+    }
+
+    // built and compiled here, the audio thread only swaps pointers
+    if (fg->plan == NULL && fg_compile_graph(fg) == -1) {
+        return -1;
+    }
+    gcsynth_channel_install_filter_graph(channel, fg);
+    fg_reap();
+
+    return 0;
+}
@@ -2,6 +2,7 @@
 #define __FGRAPH_H__
 
 #include <glib.h>
+#include <stdint.h>
 
 #include "../gcsynth.h"
 #include "../gcsynth_filter.h"
@@ -85,12 +86,6 @@ struct fgraph_node
 
     int (*run)(struct fgraph_node* node, float* left, float* right);
 
-    // incremented every time an input/output port connection has had its
-    // left/right buffers populated. Using modulo math we can determine when 
-    // all ports are about to be filled.
-    unsigned long in_port_update_count; 
-    unsigned long out_port_update_count;
-
     // book keeping variables used for audio processing.
 
     int channel; // channel assigned to audio
@@ -131,6 +126,17 @@ struct fgraph_effect
     struct fgraph_node node;
 
     struct gcsynth_filter* filter;
+
+    // control values from python waiting for the audio thread, see params.h
+    float pending[MAX_LADSPA_CONTROLS];
+    int queued[MAX_LADSPA_CONTROLS];
+
+    // audio thread only, controls ramping towards a new value
+    float target[MAX_LADSPA_CONTROLS];
+    float step[MAX_LADSPA_CONTROLS];
+    int remaining[MAX_LADSPA_CONTROLS];
+    int ramping;
+    int running;
 };
 
 struct fgraph_gain_balance
@@ -151,11 +157,72 @@ struct fgraph_connection
     char uuid_out[UUID_LEN];
     int port_out;
 
-    float left[AUDIO_SAMPLES];
-    float right[AUDIO_SAMPLES];
-
     struct fgraph_node *in_node; 
     struct fgraph_node *out_node;
+
+    // the audio value it carries while fg_compile runs, -1 if not part 
+    // of the plan. Connections have no buffers of their own.
+    int slot;
+};
+
+
+/*
+ Execution plan of a filter graph, see fg_compile. The nodes reachable 
+ from the INPUT node in topological order, each reads and writes 
+ numbered buffer slots. Slot 0 is the channel audio passed to fg_run,
+ the other slots are shared by values that are not alive at once.
+ */
+enum {
+    FG_OP_RUN,   // node->run in place on slot 'in'
+    FG_OP_SPLIT, // 'in' scaled in place, the outputs all refer to it
+    FG_OP_COPY,  // 'in' copied to 'out' for a node that writes it
+    FG_OP_MIX    // sum of 'slots' into 'out', 'out' may be slots[0]
+};
+
+struct fgraph_op
+{
+    int type;
+    struct fgraph_node* node;
+
+    int in;
+    int out;
+    int num_slots; // mix inputs
+    int* slots;
+    float level;   // split
+};
+
+struct fgraph_plan
+{
+    int num_ops;
+    struct fgraph_op* ops;
+
+    int num_slots;
+    float** left;  // num_slots buffers of AUDIO_SAMPLES, [0] set by fg_run
+    float** right;
+    float* storage;
+    int* slot_storage; 
+
+    int output_slot; // the audio of the OUTPUT node
+};
+
+
+/*
+ Control changes for the effects of a graph, written by the python thread 
+ and read by the audio thread at the start of fg_run. See params.h
+ */
+#define FG_PARAM_QUEUE_SIZE 1024 // power of 2
+
+struct fg_param_update
+{
+    struct fgraph_effect* effect;
+    int control;
+};
+
+struct fg_param_queue
+{
+    struct fg_param_update items[FG_PARAM_QUEUE_SIZE];
+    unsigned int head; // written by the python thread
+    unsigned int tail; // written by the audio thread
 };
 
 
@@ -173,6 +240,31 @@ struct fgraph
     GHashTable* connections; // uuid -> struct fg_connection 
     int enabled;
 
+    // what fg_run executes, NULL until fg_compile and after any change
+    // to the nodes or connections. 
+    struct fgraph_plan* plan;
+    // the plan fg_run is executing, published by the audio thread. A 
+    // replaced plan is kept on the retired list until fg_run is no 
+    // longer running it.
+    struct fgraph_plan* running;
+    GList* retired;
+
+    struct fg_param_queue params;
+    // frame + 1 of the block the queue was last taken and the controls
+    // advanced in, 0 before the first.
+    uint64_t params_block;
+    // deleted nodes are freed with the graph, the audio thread or a 
+    // queued parameter update may still refer to them.
+    GList* deleted_nodes;
+
+    // channels using or about to use the graph, a destroyed graph is 
+    // freed once this drops to 0. See fg_retain
+    int users;
+
+    // set between fg_begin_edit/fg_end_edit, changes keep the current 
+    // plan running and mark it edited instead of dropping it.
+    int editing;
+    int edited;
 };
 
 // initialize global resources for supporting audio filter graphs.
@@ -182,7 +274,7 @@ struct fgraph_node* fg_lookup_node(struct fgraph* fg, char* uuid);
 struct fgraph_connection* fg_lookup_connection(struct fgraph* fg, char* uuid);
 
 // create and destroy a filter graph
-void fg_create(char* uuid);
+int fg_create(char* uuid);
 void fg_destroy(char* uuid);
 
 void fg_api_destroy(char* uuid);
@@ -205,6 +297,18 @@ int fg_delete_connection(char* fg_uuid, char* conn_uuid);
 int assign_fg_to_channel(char* fg_uuid, int channel);
 int unassign_fg_to_channel(int channel);
 
+// install a complete graph on a channel while it plays. The audio thread 
+// picks it up at the next block and crossfades from the channel's graph 
+// over FG_CROSSFADE_BLOCKS blocks.
+#define FG_CROSSFADE_BLOCKS 32 // ~46ms at 44100
+int install_fg_on_channel(char* fg_uuid, int channel);
+
+// count a channel using the graph, fg_release is safe in the audio 
+// thread, it never frees. Destroyed graphs are freed by the python 
+// thread once released.
+void fg_retain(struct fgraph* fg);
+void fg_release(struct fgraph* fg);
+
 
 
 // control ladspa ports
@@ -217,9 +321,29 @@ int fg_set_node_attribute(char* graph_uuid, char* node_uuid, int type,
     int att_id, int ival, float fval,  char* sval);
 
 
+// build the execution plan of a graph, called once the nodes and 
+// connections are set up. Returns -1 if the graph has a cycle.
+int fg_compile(char* uuid);
+int fg_compile_graph(struct fgraph* fg);
+// drop the plan of a graph that is being changed, fg_run passes the 
+// audio through until it is compiled again.
+void fg_invalidate(struct fgraph* fg);
+// apply a batch of changes as one, the plan the audio thread runs is 
+// replaced once by fg_end_edit instead of dropped by the first change.
+void fg_begin_edit(struct fgraph* fg);
+int fg_end_edit(struct fgraph* fg);
+void fg_plan_free(struct fgraph_plan* plan);
+
 // process a filter graph and overwrite the left/right buffers with the output.
-// both left and right buffers are AUDIO_SAMPLES (64) in length.    
-void fg_run(struct fgraph* fg, int channel, float* left, float* right);
+// both left and right buffers are AUDIO_SAMPLES (64) in length. 'frame' is 
+// the first sample frame of the block, a graph assigned to several channels
+// is run once per channel but takes its control changes once per block.
+//
+// A graph is run by one render thread at a time, the channels it is 
+// assigned to play one soundfont and so one audio thread (offline every
+// audio thread is rendered in the caller's thread). The plan's buffers and
+// the control queue have a single consumer.
+void fg_run(struct fgraph* fg, uint64_t frame, int channel, float* left, float* right);
 
 void fg_dump(struct fgraph* fg);
 char* node_type_to_str(struct fgraph_node* n);
@@ -1,85 +1,11 @@
 #include "fgraph.h"
+#include "params.h"
 
 #include <malloc.h>
 #include <stdio.h>
+#include <string.h>
 
 
-static void fg_iterate(int channel, struct fgraph_node* n, 
-    struct fgraph_connection* input_connection, float* left, float* right);
-static void input_op(int channel, struct fgraph_node* n, 
-    struct fgraph_connection* input_connection, float* left, float* right);
-static void splitter_op(int channel, struct fgraph_node* n, 
-    struct fgraph_connection* input_connection, float* left, float* right);
-static void mixer_op(int channel, struct fgraph_node* n, 
-    struct fgraph_connection* input_connection, float* left, float* right);
-static void single_input_output_node_op(int channel, struct fgraph_node* n, 
-    struct fgraph_connection* input_connection, float* left, float* right);
-
-/**
- * Note:
- * For nodes in the graph with a single input and output the buffers in the 
- * connection are not used. the run function overwrites the left/right array
- * content. The caveat is that if this function detects that node connected to 
- * output port is the OUTPUT node then it will update the left/right buffer on
- * the connection. 
- * 
- */
-static void single_input_output_node_op(int channel, struct fgraph_node* n, 
-    struct fgraph_connection* input_connection, float* left, float* right)
-{
-
-    char errmsg[256];
-    GList* p;
-    struct fgraph_connection* c;
-
-    errmsg[0] = '\0';
-    if (n == NULL) {
-        sprintf(errmsg,"single_input_output_node_op 'n' is null\n");
-    } else if ((p = g_list_first(n->out_ports)) == NULL) {
-        sprintf(errmsg,"single_input_output_node_op type=%d null output ports!\n", n->base.type);
-    }
-    else if ((c = (struct fgraph_connection*) p->data) == NULL) {
-        sprintf(errmsg,"single_input_output_node_op type=%d null output port!\n", n->base.type);
-    } else {
-        // outputs directly to left/right
-        struct fgraph_node* next = c->out_node;
-
-        // for nodes with one input and output the left/right
-        // buffers are populated in place.
-        n->channel = channel;
-        int run_result = n->run(n, left, right); 
-        ///////////////////////////////
-
-        if (run_result != 0) {
-            sprintf(errmsg,"single_input_output_node_op type=%d run failed!\n",
-                n->base.type);
-        } else {
-            // if the next node is the output node then copy to 
-            // connection buffer of the input port just like the mixer.
-            // so the logic is the same.
-            if (next->base.type == FG_NODE_TYPE_OUTPUT) {
-                GList* f = g_list_first(next->in_ports);
-                int i;
-                if (f == NULL) {
-                    sprintf(errmsg,"output node has no ports!\n");
-                }
-                struct fgraph_connection* next_c = (struct fgraph_connection*) f->data;
-                for(i = 0; i < AUDIO_SAMPLES; i++) {
-                    next_c->left[i] = left[i]; 
-                    next_c->right[i] = right[i];
-                }
-            }        
-
-            // follow connection to next node
-            fg_iterate(channel, next, c, left, right);
-        }
-    }
-
-    if (errmsg[0] != '\0') {
-        gcsynth_raise_exception(errmsg);
-    }
-}
-
 static const char* node_type_to_string(int type) {
     switch(type) {
         case FG_NODE_TYPE_LOWPASS: return "LOWPASS";
@@ -171,189 +97,579 @@ void fg_dump(struct fgraph* fg) {
     printf("=========================\n");
 }
 
-static void input_op(int channel, struct fgraph_node* n, struct fgraph_connection* input_connection,
-    float* left, float* right)
+
+
+
+/**
+ * Filter graph compiler.
+ *
+ *    The graph only changes when the python layer edits it, so rather than 
+ *    walking the ports from the INPUT node for every 64 samples the walk is 
+ *    done once here. The nodes reachable from INPUT are put in topological 
+ *    order and every connection is given the audio value it carries:
+ *
+ *    - the INPUT node's output is value 0, the channel's audio.
+ *    - nodes with a single input and output run in place, their output 
+ *      has the value of their input.
+ *    - a splitter scales its input in place and every output refers to it.
+ *    - a mixer sums into whichever input isn't read after it.
+ *
+ *    A value read by more than one node is copied before a node writes it
+ *    unless that node is the last reader. The values are then packed into 
+ *    as few buffers as their lifetimes allow, see plan_allocate.
+ *
+ *    As before only the first output of INPUT and of single input/output 
+ *    nodes is followed. fg_run is then a loop over the ops.
+ */
+struct fg_compiler
+{
+    struct fgraph_plan* plan;
+    int next_slot_idx; // into plan->slot_storage
+
+    struct fgraph_node** nodes; // reachable nodes
+    int* in_degree;
+    int num_nodes;
+
+    int num_values;
+    int* readers; // connections carrying a value not yet consumed
+};
+
+static void reset_connection_slot(gpointer key, gpointer value, gpointer user_data)
+{
+    ((struct fgraph_connection*) value)->slot = -1;
+}
+
+static int compiler_node_index(struct fg_compiler* fc, struct fgraph_node* n)
 {
-    if (g_list_length(n->out_ports) > 0) {
-        struct fgraph_connection* c = (struct fgraph_connection*) g_list_first(n->out_ports)->data;
-        // follow the connection from the output of the INPUT node.
-        fg_iterate(channel, c->out_node, c, left, right);
+    int i;
+    for (i = 0; i < fc->num_nodes; i++) {
+        if (fc->nodes[i] == n) {
+            return i;
+        }
     }
+    return -1;
+}
+
+// the connections audio flows through from node n
+static GList* followed_out_ports(struct fgraph_node* n)
+{
+    switch(n->base.type) {
+        case FG_NODE_TYPE_SPLITTER:
+            return n->out_ports;
+        case FG_NODE_TYPE_OUTPUT:
+            return NULL;
+        default:
+            // first output only
+            return (n->out_ports) ? g_list_first(n->out_ports) : NULL;
+    }
+}
+
+static int compiler_new_value(struct fg_compiler* fc)
+{
+    return fc->num_values++;
 }
 
-static void splitter_op(int channel, struct fgraph_node* n, 
-    struct fgraph_connection* input_connection, float* left, float* right)
+static struct fgraph_op* compiler_new_op(struct fg_compiler* fc, int type, struct fgraph_node* n)
+{
+    struct fgraph_op* op = &fc->plan->ops[fc->plan->num_ops++];
+    op->type = type;
+    op->node = n;
+    op->in = -1;
+    op->out = -1;
+    return op;
+}
+
+static int* compiler_slot_array(struct fg_compiler* fc, int count)
+{
+    int* slots = &fc->plan->slot_storage[fc->next_slot_idx];
+    fc->next_slot_idx += count;
+    return slots;
+}
+
+/**
+ * The value holding the input of n once every node before it ran, n is
+ * counted as having read it. Nodes other than a mixer with more than 
+ * one connected input get their inputs summed.
+ */
+static int compiler_input_value(struct fg_compiler* fc, struct fgraph_node* n, int mix)
 {
     GList* iter;
+    int count = 0;
+    int value = -1;
+    int i, acc = -1;
+    struct fgraph_op* op;
+
+    for (iter = g_list_first(n->in_ports); iter != NULL; iter = iter->next) {
+        struct fgraph_connection* c = (struct fgraph_connection*) iter->data;
+        if (c->slot >= 0) {
+            value = c->slot;
+            fc->readers[value]--;
+            count++;
+        }
+    }
+    if (count == 1 && !mix) {
+        return value;
+    }
 
-    n->run(n, left, right);
-    for(iter = g_list_first(n->out_ports);
-        iter != NULL;
-        iter = iter->next
-    ) {
-        struct fgraph_connection* conn = 
-            (struct fgraph_connection*) iter->data;
-        fg_iterate(channel, conn->out_node, conn, conn->left, conn->right );
+    op = compiler_new_op(fc, FG_OP_MIX, n);
+    op->slots = compiler_slot_array(fc, count);
+    op->num_slots = 0;
+    for (iter = g_list_first(n->in_ports); iter != NULL; iter = iter->next) {
+        struct fgraph_connection* c = (struct fgraph_connection*) iter->data;
+        if (c->slot >= 0) {
+            if (acc == -1 && fc->readers[c->slot] == 0) {
+                acc = op->num_slots;
+            }
+            op->slots[op->num_slots++] = c->slot;
+        }
     }
+    if (acc == -1) {
+        op->out = compiler_new_value(fc);
+    } else {
+        // sum into the input nothing else reads, it goes first
+        value = op->slots[acc];
+        for (i = acc; i > 0; i--) {
+            op->slots[i] = op->slots[i - 1];
+        }
+        op->slots[0] = value;
+        op->out = value;
+    }
+    return op->out;
 }
 
-static struct fgraph_connection* get_nth_connection(GList* l, int idx)
+// the input of n that it can overwrite
+static int compiler_writable_input(struct fg_compiler* fc, struct fgraph_node* n)
 {
-    GList* item;
-    struct fgraph_connection* result = NULL;
-    char errmsg[256];
+    int value = compiler_input_value(fc, n, 0);
+    struct fgraph_op* op;
 
-    errmsg[0] = '\0';
-    
-    if (l == NULL) {
-        sprintf(errmsg, "get_nth_connection null list!\n");
+    if (fc->readers[value] == 0) {
+        return value;
     }
-    else if ((item = g_list_nth(l, idx)) == NULL) {
-        sprintf(errmsg, "get_nth_connection no item at %d\n", idx);
+    op = compiler_new_op(fc, FG_OP_COPY, n);
+    op->in = value;
+    op->out = compiler_new_value(fc);
+    return op->out;
+}
+
+static void compiler_emit(struct fg_compiler* fc, struct fgraph_node* n)
+{
+    GList* iter;
+    struct fgraph_op* op;
+    int value, num_out;
+
+    switch(n->base.type) {
+        case FG_NODE_TYPE_INPUT:
+            value = 0;
+            break;
+        case FG_NODE_TYPE_OUTPUT:
+            fc->plan->output_slot = compiler_input_value(fc, n, 0);
+            return;
+        case FG_NODE_TYPE_MIXER:
+            value = compiler_input_value(fc, n, 1);
+            break;
+        case FG_NODE_TYPE_SPLITTER:
+            value = compiler_writable_input(fc, n);
+            num_out = g_list_length(n->out_ports);
+            if (num_out > 1) {
+                op = compiler_new_op(fc, FG_OP_SPLIT, n);
+                op->in = value;
+                op->level = 1.0 / num_out;
+            }
+            break;
+        default:
+            value = compiler_writable_input(fc, n);
+            op = compiler_new_op(fc, FG_OP_RUN, n);
+            op->in = value;
+            break;
     }
-    else {
-        result = (struct fgraph_connection* ) item->data;
-    } 
 
-    if (errmsg[0] != '\0') {
-        gcsynth_raise_exception(errmsg);
+    for (iter = followed_out_ports(n); iter != NULL; iter = iter->next) {
+        ((struct fgraph_connection*) iter->data)->slot = value;
+        fc->readers[value]++;
+        if (n->base.type != FG_NODE_TYPE_SPLITTER) {
+            break;
+        }
     }
-    
-    return result;
-} 
+}
 
-static struct fgraph_connection* get_first_connection(GList* l)
+static int plan_alloc_slot(int* free_slots, int* num_free, int* num_slots)
 {
-    GList* item;
-    struct fgraph_connection* result = NULL;
-    char errmsg[256];
+    return (*num_free > 0) ? free_slots[--(*num_free)] : (*num_slots)++;
+}
 
-    errmsg[0] = '\0';
-    
-    if (l == NULL) {
-        sprintf(errmsg, "get_first_connection null list!\n");
+/**
+ * Buffer allocation, values become slots. A value's slot is returned to 
+ * the free list after the last op reading it, so the plan needs as many 
+ * buffers as there are values alive at once rather than one per 
+ * connection. Ops writing in place keep the value of their input.
+ */
+static void plan_allocate(struct fg_compiler* fc)
+{
+    struct fgraph_plan* plan = fc->plan;
+    int* last_use = malloc(sizeof(int) * fc->num_values);
+    int* slot_of = malloc(sizeof(int) * fc->num_values);
+    int* free_slots = malloc(sizeof(int) * fc->num_values);
+    int num_free = 0;
+    int num_slots = 1;
+    int i, j, v;
+
+    for (v = 0; v < fc->num_values; v++) {
+        last_use[v] = -1;
+        slot_of[v] = -1;
     }
-    else if ((item = g_list_first(l)) == NULL) {
-        sprintf(errmsg, "get_first_connection failed\n");
+    for (i = 0; i < plan->num_ops; i++) {
+        struct fgraph_op* op = &plan->ops[i];
+        if (op->in >= 0) {
+            last_use[op->in] = i;
+        }
+        if (op->type == FG_OP_MIX) {
+            for (j = 0; j < op->num_slots; j++) {
+                last_use[op->slots[j]] = i;
+            }
+        }
     }
-    else {
-        result = (struct fgraph_connection* ) item->data;
-    } 
+    // never reused
+    last_use[plan->output_slot] = plan->num_ops;
+    slot_of[0] = 0;
 
-    if (errmsg[0] != '\0') {
-        gcsynth_raise_exception(errmsg);
+    for (i = 0; i < plan->num_ops; i++) {
+        struct fgraph_op* op = &plan->ops[i];
+
+        // written before the inputs are released, an op never writes to a
+        // slot it reads unless it is the same value.
+        if (op->out >= 0 && slot_of[op->out] == -1) {
+            slot_of[op->out] = plan_alloc_slot(free_slots, &num_free, &num_slots);
+        }
+
+        if (op->in >= 0 && last_use[op->in] == i && op->in != 0) {
+            free_slots[num_free++] = slot_of[op->in];
+            last_use[op->in] = -2;
+        }
+        if (op->type == FG_OP_MIX) {
+            for (j = 0; j < op->num_slots; j++) {
+                v = op->slots[j];
+                if (last_use[v] == i && v != 0) {
+                    free_slots[num_free++] = slot_of[v];
+                    last_use[v] = -2;
+                }
+                op->slots[j] = slot_of[v];
+            }
+        }
+        if (op->out >= 0 && last_use[op->out] == -1) {
+            // nothing reads it, a dead end in the graph
+            free_slots[num_free++] = slot_of[op->out];
+        }
+
+        if (op->in >= 0) {
+            op->in = slot_of[op->in];
+        }
+        if (op->out >= 0) {
+            op->out = slot_of[op->out];
+        }
+    }
+    plan->output_slot = slot_of[plan->output_slot];
+    plan->num_slots = num_slots;
+
+    free(last_use);
+    free(slot_of);
+    free(free_slots);
+}
+
+void fg_plan_free(struct fgraph_plan* plan)
+{
+    if (plan != NULL) {
+        free(plan->ops);
+        free(plan->left);
+        free(plan->right);
+        free(plan->storage);
+        free(plan->slot_storage);
+        free(plan);
+    }
+}
+
+// free the retired plans fg_run isn't running. It can't pick one of them
+// up again, fg_run_plan only runs a plan that is still fg->plan after it
+// was published.
+static void fg_reclaim_plans(struct fgraph* fg)
+{
+    struct fgraph_plan* running = __atomic_load_n(&fg->running, __ATOMIC_SEQ_CST);
+    GList* l = fg->retired;
+    GList* next;
+
+    while (l != NULL) {
+        next = l->next;
+        if (l->data != running) {
+            fg_plan_free(l->data);
+            fg->retired = g_list_delete_link(fg->retired, l);
+        }
+        l = next;
     }
-    
-    return result;
 }
 
+static void fg_swap_plan(struct fgraph* fg, struct fgraph_plan* plan)
+{
+    struct fgraph_plan* old = __atomic_exchange_n(&fg->plan, plan, __ATOMIC_SEQ_CST);
 
+    if (old != NULL) {
+        fg->retired = g_list_prepend(fg->retired, old);
+    }
+    fg_reclaim_plans(fg);
+}
 
-static void mixer_op(int channel, struct fgraph_node* n, 
-    struct fgraph_connection* input_connection, float* left, float* right)
+// the plan to run this block, published in fg->running so it isn't freed 
+// while it runs. 
+static struct fgraph_plan* fg_run_plan(struct fgraph* fg)
 {
-    int num_ports = g_list_length(n->in_ports);
-    int idx = n->in_port_update_count % num_ports;
-    int i;
-    struct fgraph_connection* c = get_nth_connection(n->in_ports, idx);
-    struct fgraph_connection* out_conn = get_first_connection(n->out_ports);
+    struct fgraph_plan* plan;
+
+    do {
+        plan = __atomic_load_n(&fg->plan, __ATOMIC_SEQ_CST);
+        __atomic_store_n(&fg->running, plan, __ATOMIC_SEQ_CST);
+    } while (plan != __atomic_load_n(&fg->plan, __ATOMIC_SEQ_CST));
+    return plan;
+}
 
-    if ((c == NULL) || (out_conn == NULL)) {
+void fg_invalidate(struct fgraph* fg)
+{
+    if (fg == NULL) {
         return;
     }
+    if (fg->editing) {
+        // the old plan only refers to nodes, deleted ones are freed with 
+        // the graph, so it keeps running until fg_end_edit.
+        fg->edited = 1;
+    } else {
+        fg_swap_plan(fg, NULL);
+    }
+}
+
+void fg_begin_edit(struct fgraph* fg)
+{
+    fg->editing = 1;
+    fg->edited = 0;
+}
 
-    for(i = 0; i < AUDIO_SAMPLES; i++) {
-        c->left[i] = left[i];
-        c->right[i] = right[i];        
+int fg_end_edit(struct fgraph* fg)
+{
+    int edited = fg->edited;
+
+    fg->editing = 0;
+    fg->edited = 0;
+    if (edited && fg_compile_graph(fg) == -1) {
+        // the old plan no longer matches the graph
+        fg_swap_plan(fg, NULL);
+        return -1;
     }
+    return 0;
+}
 
-    n->in_port_update_count++;
-    if ((n->in_port_update_count % num_ports) == 0) {
+int fg_compile_graph(struct fgraph* fg)
+{
+    struct fg_compiler fc;
+    struct fgraph_plan* plan;
+    int max_nodes = g_hash_table_size(fg->nodes) + 1;
+    int num_conns = g_hash_table_size(fg->connections);
+    int head = 0;
+    int i, ret = 0;
+    char errmsg[256];
 
-        // mix all inputs to the output connection.
-        n->channel = channel;
-        n->run(n, left, right);
+    errmsg[0] = '\0';
 
-        fg_iterate(channel, out_conn->out_node, 
-            out_conn, out_conn->left, out_conn->right); 
+    if (fg->input_node == NULL || fg->output_node == NULL) {
+        // nothing to run, fg_run passes the audio through
+        fg_invalidate(fg);
+        return 0;
     }
-    // until the last mixer input is set this is as far as processing goes for the rest.
-}
 
+    g_hash_table_foreach(fg->connections, reset_connection_slot, NULL);
+
+    // the nodes reachable from INPUT and how many of their connected
+    // inputs are reached.
+    memset(&fc, 0, sizeof(fc));
+    fc.nodes = malloc(sizeof(struct fgraph_node*) * max_nodes);
+    fc.in_degree = calloc(max_nodes, sizeof(int));
+    fc.nodes[fc.num_nodes++] = fg->input_node;
+    for (head = 0; head < fc.num_nodes; head++) {
+        GList* iter;
+        for (iter = followed_out_ports(fc.nodes[head]); iter != NULL; iter = iter->next) {
+            struct fgraph_node* next = ((struct fgraph_connection*) iter->data)->out_node;
+            int idx = compiler_node_index(&fc, next);
+            if (idx == -1) {
+                idx = fc.num_nodes++;
+                fc.nodes[idx] = next;
+            }
+            fc.in_degree[idx]++;
+            if (fc.nodes[head]->base.type != FG_NODE_TYPE_SPLITTER) {
+                break;
+            }
+        }
+    }
 
+    plan = calloc(1, sizeof(struct fgraph_plan));
+    fc.plan = plan;
+    // a node is at most a mix or copy of its input and a run, a connection
+    // is read by at most one mix. Each op makes at most one new value.
+    plan->ops = calloc(fc.num_nodes * 2, sizeof(struct fgraph_op));
+    plan->slot_storage = calloc(num_conns + 1, sizeof(int));
+    plan->output_slot = -1;
+    fc.readers = calloc(fc.num_nodes * 2 + 1, sizeof(int));
+    fc.num_values = 1;
+
+    // Kahn's algorithm, a node is emitted once all of its inputs are.
+    {
+        struct fgraph_node** ready = malloc(sizeof(struct fgraph_node*) * fc.num_nodes);
+        int num_ready = 0;
+        int emitted = 0;
+
+        ready[num_ready++] = fg->input_node;
+        for (head = 0; head < num_ready; head++) {
+            struct fgraph_node* n = ready[head];
+            GList* iter;
+
+            compiler_emit(&fc, n);
+            emitted++;
+            for (iter = followed_out_ports(n); iter != NULL; iter = iter->next) {
+                int idx = compiler_node_index(&fc, ((struct fgraph_connection*) iter->data)->out_node);
+                if (--fc.in_degree[idx] == 0) {
+                    ready[num_ready++] = fc.nodes[idx];
+                }
+                if (n->base.type != FG_NODE_TYPE_SPLITTER) {
+                    break;
+                }
+            }
+        }
+        free(ready);
 
-/**
- * Filter graph iterator.
- *    Recursively walk from the output port of the INPUT node till we reach the input port
- *    of the OUTPUT node. 
- * 
- */
-static void fg_iterate(int channel, struct fgraph_node* n, struct fgraph_connection* input_connection,
-    float* left, float* right)
-{    
-// printf("fg_iterate channel=%d %s(uuid=%s,type=%d) input_connection %s(uuid=%s)\n",
-//     channel, node_type_to_str(n), n->base.uuid, n->base.type,
-//         (input_connection) ? node_type_to_str(input_connection->out_node) : "null",
-//         (input_connection) ? input_connection->out_node->base.uuid: "null"
-//     );
-// fflush(stdout);
+        if (emitted < fc.num_nodes) {
+            sprintf(errmsg, "fg_compile: graph %s has a cycle\n", fg->base.uuid);
+        }
+    }
 
-    switch(n->base.type) {
-        case FG_NODE_TYPE_MIXER:
-            mixer_op(channel, n, input_connection, left, right);
-            break;
-        case FG_NODE_TYPE_SPLITTER:
-            splitter_op(channel, n, input_connection, left, right);
-            break;
-        case FG_NODE_TYPE_INPUT:
-            input_op(channel, n, input_connection, left, right);
-            break;
-        case FG_NODE_TYPE_OUTPUT:
-            // the data for the updated left, right audio is in the 
-            // output nodes's input port buffer. We are done!
-            break;
-        default:
-            single_input_output_node_op(channel, n, input_connection, left, right);
-            break;
+    if (errmsg[0] == '\0' && plan->output_slot == -1) {
+        // OUTPUT not connected yet, pass through like an empty graph
+        fg_plan_free(plan);
+        plan = NULL;
+    } else if (errmsg[0] == '\0') {
+        plan_allocate(&fc);
+        plan->left = calloc(plan->num_slots, sizeof(float*));
+        plan->right = calloc(plan->num_slots, sizeof(float*));
+        plan->storage = calloc(plan->num_slots * 2 * AUDIO_SAMPLES, sizeof(float));
+        // slot 0 is the buffers passed to fg_run
+        for (i = 1; i < plan->num_slots; i++) {
+            plan->left[i] = &plan->storage[(i * 2) * AUDIO_SAMPLES];
+            plan->right[i] = &plan->storage[(i * 2 + 1) * AUDIO_SAMPLES];
+        }
     }
+
+    free(fc.nodes);
+    free(fc.in_degree);
+    free(fc.readers);
+
+    if (errmsg[0] != '\0') {
+        fg_plan_free(plan);
+        fg_invalidate(fg);
+        gcsynth_raise_exception(errmsg);
+        ret = -1;
+    } else {
+        fg_swap_plan(fg, plan);
+    }
+
+    return ret;
 }
 
+int fg_compile(char* uuid)
+{
+    struct fgraph* fg = (struct fgraph*) lookup_fgraph_object(uuid, FG_GRAPH);
 
-void fg_run(struct fgraph* fg, int channel, float* left, float* right)
+    if (fg == NULL) {
+        gcsynth_raise_exception("fg_compile: uuid failed to map to a filter graph\n");
+        return -1;
+    }
+    return fg_compile_graph(fg);
+}
+
+
+void fg_run(struct fgraph* fg, uint64_t frame, int channel, float* left, float* right)
 {
+    struct fgraph_plan* plan;
+    struct fgraph_op* op;
+    float* l;
+    float* r;
+    float* in_l;
+    float* in_r;
+    int i, j;
+    int advance;
     char errmsg[256];
-    int i;
-    GList* f;
-    struct fgraph_connection* c;
 
-    if (fg->enabled == 0) {
+    if (fg->enabled == 0 || (plan = fg_run_plan(fg)) == NULL) {
+        __atomic_store_n(&fg->running, NULL, __ATOMIC_RELEASE);
         return;
     }
 
-    errmsg[0] = '\0';
+    // control changes from python land between blocks, taken and ramped
+    // once per block however many channels run the graph.
+    advance = (fg->params_block != frame + 1);
+    if (advance) {
+        fg->params_block = frame + 1;
+        fg_params_apply(fg);
+    }
 
-    if (fg->input_node == NULL) {
-        sprintf(errmsg,"fgraph for channel %d, no input node!\n", channel);
-    } else if (fg->output_node == NULL) {
-        sprintf(errmsg,"fgraph for channel %d, no output node!\n", channel);
-    } else if ((f = g_list_first(fg->output_node->in_ports)) == NULL) {
-        sprintf(errmsg,"fgraph output for channel %d has no connection for output\n", channel);
-    } else {
-        // start from the input node and walk all paths to reach the output    
-        fg_iterate(channel, fg->input_node, NULL, left, right);
+// slot 0 is the caller's audio, the plan is shared by every channel the 
+// graph is assigned to.
+#define SLOT_L(s) (((s) == 0) ? left : plan->left[s])
+#define SLOT_R(s) (((s) == 0) ? right : plan->right[s])
 
-        // copy the audio stored in the connection to the output node of the
-        // filter graph.
-    
-        c = (struct fgraph_connection*) f->data;
-        for(i = 0; i < AUDIO_SAMPLES; i++) {
-            left[i] = c->left[i];
-            right[i] = c->right[i];
+    for (op = plan->ops; op < plan->ops + plan->num_ops; op++) {
+        switch(op->type) {
+            case FG_OP_RUN:
+                if (advance && op->node->base.type == FG_NODE_TYPE_EFFECT) {
+                    fg_params_smooth((struct fgraph_effect*) op->node);
+                }
+                op->node->channel = channel;
+                if (op->node->run(op->node, SLOT_L(op->in), SLOT_R(op->in)) != 0) {
+                    sprintf(errmsg,"fg_run type=%d run failed!\n", op->node->base.type);
+                    gcsynth_raise_exception(errmsg);
+                }
+                break;
+            case FG_OP_SPLIT:
+                // every output refers to the scaled input
+                l = SLOT_L(op->in);
+                r = SLOT_R(op->in);
+                for (i = 0; i < AUDIO_SAMPLES; i++) {
+                    l[i] *= op->level;
+                    r[i] *= op->level;
+                }
+                break;
+            case FG_OP_COPY:
+                memcpy(SLOT_L(op->out), SLOT_L(op->in), sizeof(float) * AUDIO_SAMPLES);
+                memcpy(SLOT_R(op->out), SLOT_R(op->in), sizeof(float) * AUDIO_SAMPLES);
+                break;
+            case FG_OP_MIX:
+                l = SLOT_L(op->out);
+                r = SLOT_R(op->out);
+                if (op->out != op->slots[0]) {
+                    memcpy(l, SLOT_L(op->slots[0]), sizeof(float) * AUDIO_SAMPLES);
+                    memcpy(r, SLOT_R(op->slots[0]), sizeof(float) * AUDIO_SAMPLES);
+                }
+                for (j = 1; j < op->num_slots; j++) {
+                    in_l = SLOT_L(op->slots[j]);
+                    in_r = SLOT_R(op->slots[j]);
+                    for (i = 0; i < AUDIO_SAMPLES; i++) {
+                        l[i] += in_l[i];
+                        r[i] += in_r[i];
+                    }
+                }
+                break;
         }
     }
 
-    if (errmsg[0] != '\0') {
-        fg_dump(fg);
-        gcsynth_raise_exception(errmsg);
+    if (plan->output_slot != 0) {
+        memcpy(left, plan->left[plan->output_slot], sizeof(float) * AUDIO_SAMPLES);
+        memcpy(right, plan->right[plan->output_slot], sizeof(float) * AUDIO_SAMPLES);
     }
+    __atomic_store_n(&fg->running, NULL, __ATOMIC_RELEASE);
+
+#undef SLOT_L
+#undef SLOT_R
 }
@@ -0,0 +1,110 @@
+#include "params.h"
+
+#include <math.h>
+
+
+static int param_queue_push(struct fg_param_queue* q, struct fgraph_effect* e, int idx)
+{
+    unsigned int head = __atomic_load_n(&q->head, __ATOMIC_RELAXED);
+    unsigned int tail = __atomic_load_n(&q->tail, __ATOMIC_ACQUIRE);
+
+    if (head - tail == FG_PARAM_QUEUE_SIZE) {
+        return -1;
+    }
+    q->items[head & (FG_PARAM_QUEUE_SIZE - 1)].effect = e;
+    q->items[head & (FG_PARAM_QUEUE_SIZE - 1)].control = idx;
+    __atomic_store_n(&q->head, head + 1, __ATOMIC_RELEASE);
+    return 0;
+}
+
+static int param_queue_pop(struct fg_param_queue* q, struct fg_param_update* u)
+{
+    unsigned int tail = __atomic_load_n(&q->tail, __ATOMIC_RELAXED);
+    unsigned int head = __atomic_load_n(&q->head, __ATOMIC_ACQUIRE);
+
+    if (tail == head) {
+        return 0;
+    }
+    *u = q->items[tail & (FG_PARAM_QUEUE_SIZE - 1)];
+    __atomic_store_n(&q->tail, tail + 1, __ATOMIC_RELEASE);
+    return 1;
+}
+
+
+int fg_param_set(struct fgraph* fg, struct fgraph_effect* e, int idx, float value)
+{
+    __atomic_store(&e->pending[idx], &value, __ATOMIC_RELAXED);
+
+    // the audio thread clears 'queued' before reading 'pending', a value 
+    // stored after that is queued again.
+    if (__atomic_exchange_n(&e->queued[idx], 1, __ATOMIC_SEQ_CST) == 0) {
+        if (param_queue_push(&fg->params, e, idx) == -1) {
+            __atomic_store_n(&e->queued[idx], 0, __ATOMIC_SEQ_CST);
+            return -1;
+        }
+    }
+    return 0;
+}
+
+static void param_target(struct fgraph_effect* e, int idx, float value)
+{
+    struct gcsynth_filter_control* control = &e->filter->controls[idx];
+    float current = control->value;
+    int n = FG_PARAM_SMOOTH_BLOCKS;
+
+    if (control->is_toggled) {
+        value = (value != 0.0) ? 1.0 : 0.0;
+    } else if (control->is_integer) {
+        value = ceil(value);
+    }
+
+    if (control->is_toggled || control->is_integer || !e->running) {
+        // nothing to ramp, or nothing heard yet
+        control->value = value;
+        if (e->remaining[idx] > 0) {
+            e->remaining[idx] = 0;
+            e->ramping--;
+        }
+        return;
+    }
+
+    if (e->remaining[idx] == 0) {
+        e->ramping++;
+    }
+    e->target[idx] = value;
+    e->remaining[idx] = n;
+    e->step[idx] = (value - current) / n;
+}
+
+void fg_params_apply(struct fgraph* fg)
+{
+    struct fg_param_update u;
+    float value;
+
+    while (param_queue_pop(&fg->params, &u)) {
+        __atomic_store_n(&u.effect->queued[u.control], 0, __ATOMIC_SEQ_CST);
+        __atomic_load(&u.effect->pending[u.control], &value, __ATOMIC_RELAXED);
+        if (u.effect->filter != NULL) {
+            param_target(u.effect, u.control, value);
+        }
+    }
+}
+
+void fg_params_smooth(struct fgraph_effect* e)
+{
+    int i;
+
+    for (i = 0; e->ramping > 0 && i < e->filter->num_controls; i++) {
+        if (e->remaining[i] > 0) {
+            struct gcsynth_filter_control* control = &e->filter->controls[i];
+
+            if (--e->remaining[i] == 0) {
+                // land on the value asked for
+                control->value = e->target[i];
+                e->ramping--;
+            } else {
+                control->value += e->step[i];
+            }
+        }
+    }
+}
@@ -0,0 +1,34 @@
+#ifndef __PARAMS_H
+#define __PARAMS_H
+
+#include "fgraph.h"
+
+/*
+Effect control changes.
+
+The effects dialog sets a control on every slider tick. Instead of writing
+the control the plugin reads while it runs, the python thread stores the 
+value in the effect's pending slot and queues the control on the graph's 
+single producer/single consumer queue. The audio thread takes the queue at
+the start of each block's first fg_run, so it never waits on python.
+
+A control already queued isn't queued again, only its latest value is 
+applied. Continuous controls ramp to the new value over 
+FG_PARAM_SMOOTH_BLOCKS blocks rather than jumping, which is what made 
+dragging a knob crackle. Toggled and integer controls are set at once.
+*/
+
+// ~23ms at 44100
+#define FG_PARAM_SMOOTH_BLOCKS 16
+
+// python thread: set control 'idx' of an effect, returns -1 if the queue is full
+int fg_param_set(struct fgraph* fg, struct fgraph_effect* e, int idx, float value);
+
+// audio thread: apply the queued changes, called once per block by the 
+// thread that runs the graph (the only consumer, see fg_run)
+void fg_params_apply(struct fgraph* fg);
+
+// audio thread: advance the controls of e that are ramping, once per block
+void fg_params_smooth(struct fgraph_effect* e);
+
+#endif
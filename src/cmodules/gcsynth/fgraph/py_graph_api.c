@@ -27,6 +27,52 @@ static int get_command_id(PyObject* args)
     return cmd;
 }
 
+/*
+    Run a list of api commands on one graph and compile it once at the 
+    end, the audio thread keeps running the graph as it was until then. 
+    Stops at the first command that fails.
+ */
+static int fg_api_batch(PyObject* self, char* fg_uuid, PyObject* commands)
+{
+    struct fgraph* fg = (struct fgraph*) lookup_fgraph_object(fg_uuid, FG_GRAPH);
+    PyObject *ptype, *pvalue, *ptraceback;
+    PyObject* result;
+    Py_ssize_t i;
+    int ret = 0;
+
+    if (fg == NULL) {
+        gcsynth_raise_exception("fg_api_batch: uuid failed to map to a filter graph\n");
+        return -1;
+    }
+
+    fg_begin_edit(fg);
+    for (i = 0; i < PyList_GET_SIZE(commands); i++) {
+        PyObject* args = PyList_GET_ITEM(commands, i);
+
+        if (!PyTuple_Check(args) || get_command_id(args) == FG_API_BATCH) {
+            gcsynth_raise_exception("fg_api_batch: commands must be api argument tuples\n");
+            ret = -1;
+            break;
+        }
+        if ((result = py_fgraph_api(self, args)) == NULL) {
+            ret = -1;
+            break;
+        }
+        Py_DECREF(result);
+    }
+
+    if (ret == -1) {
+        // compile what was applied, the failed command's error is reported
+        PyErr_Fetch(&ptype, &pvalue, &ptraceback);
+        fg_end_edit(fg);
+        PyErr_Clear();
+        PyErr_Restore(ptype, pvalue, ptraceback);
+    } else {
+        ret = fg_end_edit(fg);
+    }
+    return ret;
+}
+
 PyObject* py_fgraph_api(PyObject* self, PyObject* args)
 {
     int cmd = get_command_id(args);
@@ -45,7 +91,9 @@ PyObject* py_fgraph_api(PyObject* self, PyObject* args)
                 if (!PyArg_ParseTuple(args,"is", &cmd, &uuid)) {
                     return NULL;
                 }
-                fg_create(uuid);
+                if (fg_create(uuid) == -1) {
+                    return NULL;
+                }
             }
             break;
         case FG_API_ENABLE:{
@@ -105,7 +153,7 @@ PyObject* py_fgraph_api(PyObject* self, PyObject* args)
                 int overflow;
 
                 
-                if (!PyArg_ParseTuple(args,"issiiO", &cmd, &graph_uuid, &node_uuid, &att_id, &val)) {
+                if (!PyArg_ParseTuple(args,"issiO", &cmd, &graph_uuid, &node_uuid, &att_id, &val)) {
                     return NULL;
                 }
 
@@ -122,9 +170,11 @@ PyObject* py_fgraph_api(PyObject* self, PyObject* args)
                     type = 's';  
                 }
 
-                fg_set_node_attribute(graph_uuid, node_uuid, type, 
-                    att_id, ival, fval,  sval);
-                
+                if (fg_set_node_attribute(graph_uuid, node_uuid, type, 
+                    att_id, ival, fval,  sval) == -1) {
+                    return NULL;
+                }
+
             }
             break;
         case FG_API_EFFECT_SET_PROPERTY: {
@@ -187,6 +237,40 @@ PyObject* py_fgraph_api(PyObject* self, PyObject* args)
 
             }
             break;
+        case FG_API_REMOVE_CONNECTION: {
+                char* fg_uuid;
+                char* conn_uuid;
+
+                if (!PyArg_ParseTuple(args,"iss", &cmd, &fg_uuid, &conn_uuid)) {
+                    return NULL;
+                }
+                if (fg_delete_connection(fg_uuid, conn_uuid) == -1) {
+                    return NULL;
+                }
+            }
+            break;
+        case FG_API_BATCH: {
+                char* fg_uuid;
+                PyObject* commands;
+
+                if (!PyArg_ParseTuple(args,"isO!", &cmd, &fg_uuid, &PyList_Type, &commands)) {
+                    return NULL;
+                }
+                if (fg_api_batch(self, fg_uuid, commands) == -1) {
+                    return NULL;
+                }
+            }
+            break;
+        case FG_API_COMPILE: {
+                char* uuid;
+                if (!PyArg_ParseTuple(args,"is", &cmd, &uuid)) {
+                    return NULL;
+                }
+                if (fg_compile(uuid) == -1) {
+                    return NULL;
+                }
+            }
+            break;
         case FG_API_ASSIGN_TO_CHANNEL: {
                 char* fg_uuid;
                 int channel;
@@ -200,6 +284,19 @@ PyObject* py_fgraph_api(PyObject* self, PyObject* args)
                 }
             }
             break;
+        case FG_API_INSTALL_ON_CHANNEL: {
+                char* fg_uuid;
+                int channel;
+
+                if (!PyArg_ParseTuple(args,"isi",&cmd,&fg_uuid,&channel)) {
+                    return NULL;
+                }
+
+                if (install_fg_on_channel(fg_uuid, channel) == -1) {
+                    return NULL;
+                }
+            }
+            break;
         case FG_API_UNASSIGN_TO_CHANNEL: {
                 int channel;
 
@@ -239,6 +336,10 @@ int init_filter_graph_subsys(PyObject *module)
     PyModule_AddIntConstant(module, "FG_API_ADD_CONNECTION", FG_API_ADD_CONNECTION);
     PyModule_AddIntConstant(module, "FG_API_REMOVE_CONNECTION", FG_API_REMOVE_CONNECTION);
     PyModule_AddIntConstant(module, "FG_API_EFFECT_SETUP", FG_API_EFFECT_SETUP);
+    PyModule_AddIntConstant(module, "FG_API_COMPILE", FG_API_COMPILE);
+    PyModule_AddIntConstant(module, "FG_API_INSTALL_ON_CHANNEL", FG_API_INSTALL_ON_CHANNEL);
+    PyModule_AddIntConstant(module, "FG_API_EFFECT_SET_PROPERTY", FG_API_EFFECT_SET_PROPERTY);
+    PyModule_AddIntConstant(module, "FG_API_BATCH", FG_API_BATCH);
 
     PyModule_AddIntConstant(module, "FG_NODE_TYPE_LOWPASS", FG_NODE_TYPE_LOWPASS);
     PyModule_AddIntConstant(module, "FG_NODE_TYPE_HIGHPASS", FG_NODE_TYPE_HIGHPASS);
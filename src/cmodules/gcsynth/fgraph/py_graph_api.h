@@ -24,6 +24,9 @@ enum
     FG_API_SET_ATTR,
     FG_API_EFFECT_SETUP,
     FG_API_EFFECT_SET_PROPERTY,
+    FG_API_COMPILE,
+    FG_API_INSTALL_ON_CHANNEL,
+    FG_API_BATCH,
 
 
     FGRAPH_PY_API_NUMCOMMANDS
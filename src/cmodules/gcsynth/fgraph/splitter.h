@@ -1,9 +0,0 @@
-#ifndef __SPLITTER_H
-#define __SPLITTER_H
-
-#include "fgraph.h"
-
-int splitter_run(struct fgraph_node* node, float* left, float* right);
-
-
-#endif
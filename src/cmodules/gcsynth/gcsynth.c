@@ -2,6 +2,8 @@
 #include <time.h>
 #include <stdlib.h>
 #include <errno.h>
+#include <fcntl.h>
+#include <unistd.h>
 
 #include <Python.h>
 #include <SDL2/SDL.h>
@@ -223,10 +225,16 @@ static PyObject* py_gcsynth_event(PyObject* self, PyObject* args) {
     PyObject* event_params;
     struct scheduled_event* s_event;
     PyObject* evt_id_list = NULL;
+    // time.monotonic() that 'when' is relative to, defaults to now.
+    double epoch = 0.0;
 
-    if (!PyArg_ParseTuple(args,"O",&event_params)) {
+    if (!PyArg_ParseTuple(args,"O|d",&event_params, &epoch)) {
         return NULL;
     }
+    if (epoch <= 0.0) {
+        // use a single reference time for all events in a list
+        epoch = gcsynth_monotonic();
+    }
 
     if (PyDict_Check(event_params)) {
         s_event = event_from_pydata(event_params);
@@ -243,6 +251,7 @@ static PyObject* py_gcsynth_event(PyObject* self, PyObject* args) {
 
             evt_id_list = PyList_New(1);
 
+            s_event->epoch = epoch;
             gcsynth_schedule(&GcSynth, s_event);
 
             PyObject *py_evt_id = PyLong_FromLong(s_event->event_id);
@@ -264,6 +273,7 @@ static PyObject* py_gcsynth_event(PyObject* self, PyObject* args) {
             PyObject *item = PyList_GetItem(list, i);  // Borrowed reference
             s_event = event_from_pydata(item);
             if (s_event) {
+                s_event->epoch = epoch;
                 gcsynth_schedule(&GcSynth, s_event);
                 PyObject *py_evt_id = PyLong_FromLong(s_event->event_id);
                 if (!py_evt_id) {
@@ -286,6 +296,202 @@ static PyObject* py_gcsynth_event(PyObject* self, PyObject* args) {
     return evt_id_list;
 }
 
+static PyObject* py_gcsynth_timer_cancel(PyObject* self, PyObject* args) {
+    int group = -1; // if not specified cancel all inflight events
+
+    if (!PyArg_ParseTuple(args, "|i", &group)) {
+        return NULL;
+    }
+
+    gcsynth_cancel_group(&GcSynth, group);
+    Py_RETURN_NONE;
+}
+
+static PyObject* ProgressCallback = NULL;
+
+/*
+    EV_PROGRESS events are passed through a pipe to a python thread blocked
+    in progress_dispatch, the dispatcher thread never waits on the GIL.
+    A record is smaller than PIPE_BUF so writes are atomic.
+*/
+struct progress_msg {
+    int stop;      // wakes up and ends progress_dispatch, see set_progress_callback
+    int group;
+    long token;
+};
+static int ProgressPipe[2] = {-1, -1};
+
+static int progress_pipe_open()
+{
+    if (ProgressPipe[0] != -1) {
+        return 0;
+    }
+    if (pipe(ProgressPipe) == -1) {
+        return -1;
+    }
+    fcntl(ProgressPipe[0], F_SETFD, FD_CLOEXEC);
+    fcntl(ProgressPipe[1], F_SETFD, FD_CLOEXEC);
+    // never block the dispatcher, the pipe holds thousands of records
+    fcntl(ProgressPipe[1], F_SETFL, O_NONBLOCK);
+    return 0;
+}
+
+/*
+    Called in the dispatcher thread for EV_PROGRESS events
+*/
+static void progress_handler(int group, long token)
+{
+    struct progress_msg msg = { 0, group, token };
+
+    if (write(ProgressPipe[1], &msg, sizeof(msg)) != sizeof(msg)) {
+        fprintf(stderr, "gcsynth: progress event (%d,%ld) dropped\n", group, token);
+    }
+}
+
+static PyObject* py_gcsynth_set_progress_callback(PyObject* self, PyObject* args) {
+    PyObject* callback;
+    struct progress_msg stop = { 1, -1, 0 };
+
+    if (!PyArg_ParseTuple(args, "O", &callback)) {
+        return NULL;
+    }
+
+    if (callback != Py_None && !PyCallable_Check(callback)) {
+        raise_value_error("set_progress_callback expects a callable or None");
+        return NULL;
+    }
+
+    if (progress_pipe_open() == -1) {
+        return PyErr_SetFromErrno(PyExc_OSError);
+    }
+
+    Py_XDECREF(ProgressCallback);
+    if (callback == Py_None) {
+        ProgressCallback = NULL;
+        if (write(ProgressPipe[1], &stop, sizeof(stop)) != sizeof(stop)) {
+            return PyErr_SetFromErrno(PyExc_OSError);
+        }
+    } else {
+        Py_INCREF(callback);
+        ProgressCallback = callback;
+    }
+    gcsynth_set_progress_handler(progress_handler);
+
+    Py_RETURN_NONE;
+}
+
+/*
+    Waits for the next EV_PROGRESS event and calls the progress callback
+    with it in the calling thread. Returns False once the callback is
+    set to None.
+*/
+static PyObject* py_gcsynth_progress_dispatch(PyObject* self, PyObject* args) {
+    struct progress_msg msg;
+    ssize_t n;
+    PyObject* result;
+
+    if (progress_pipe_open() == -1) {
+        return PyErr_SetFromErrno(PyExc_OSError);
+    }
+
+    Py_BEGIN_ALLOW_THREADS
+    do {
+        n = read(ProgressPipe[0], &msg, sizeof(msg));
+    } while (n == -1 && errno == EINTR);
+    Py_END_ALLOW_THREADS
+
+    if (n != sizeof(msg)) {
+        return PyErr_SetFromErrno(PyExc_OSError);
+    }
+    if (msg.stop) {
+        Py_RETURN_FALSE;
+    }
+
+    if (ProgressCallback != NULL) {
+        result = PyObject_CallFunction(ProgressCallback, "il", msg.group, msg.token);
+        if (result == NULL) {
+            PyErr_Print();
+        }
+        Py_XDECREF(result);
+    }
+    Py_RETURN_TRUE;
+}
+
+static PyObject* py_gcsynth_monotonic(PyObject* self, PyObject* args) {
+    return PyFloat_FromDouble(gcsynth_monotonic());
+}
+
+/*
+    passes each chunk of an offline render to a python callable as bytes
+*/
+static int offline_writer(void* user_data, const short* pcm, int frames)
+{
+    PyObject* writer = (PyObject*) user_data;
+    PyObject* data = PyBytes_FromStringAndSize((const char*) pcm, 
+        frames * 2 * sizeof(short));
+    PyObject* result;
+
+    if (data == NULL) {
+        return -1;
+    }
+    result = PyObject_CallFunctionObjArgs(writer, data, NULL);
+    Py_DECREF(data);
+    if (result == NULL) {
+        return -1;
+    }
+    Py_DECREF(result);
+    return 0;
+}
+
+static PyObject* py_gcsynth_render_offline(PyObject* self, PyObject* args) {
+    PyObject* ev_list;
+    PyObject* writer;
+    double until;
+    struct scheduled_event** events;
+    Py_ssize_t size, i;
+    int ret;
+
+    if (!PyArg_ParseTuple(args, "O!dO", &PyList_Type, &ev_list, &until, &writer)) {
+        return NULL;
+    }
+    if (!PyCallable_Check(writer)) {
+        raise_value_error("render_offline expects writer to be callable");
+        return NULL;
+    }
+
+    size = PyList_Size(ev_list);
+    events = (struct scheduled_event**) calloc(size + 1, sizeof(struct scheduled_event*));
+    if (events == NULL) {
+        return PyErr_NoMemory();
+    }
+    for (i = 0; i < size; i++) {
+        events[i] = event_from_pydata(PyList_GetItem(ev_list, i));
+        if (events[i] == NULL) {
+            break;
+        }
+    }
+
+    ret = (i < size) ? -1 :
+        gcsynth_sf_render_offline(events, (int) size, until, offline_writer, writer);
+
+    for (i = 0; i < size && events[i] != NULL; i++) {
+        scheduled_event_free(events[i]);
+    }
+    free(events);
+
+    if (ret == -1 || PyErr_Occurred()) {
+        return NULL;
+    }
+    Py_RETURN_NONE;
+}
+
+static PyObject* py_gcsynth_render_offline_reset(PyObject* self, PyObject* args) {
+    if (gcsynth_sf_render_offline_reset() == -1) {
+        return NULL;
+    }
+    Py_RETURN_NONE;
+}
+
 static PyObject* py_load_ladspa_filter(PyObject* self, PyObject* args) {
     int channel;
     const char* filepath;
@@ -550,6 +756,8 @@ static void gcsynth_start_args_init(
 
     // are we running in test mode?
     cfg->test = (PyDict_GetItemString(input_dict, "test") != NULL); 
+    cfg->offline = (int) PyDict_GetItemLong(input_dict,"offline",0);
+    cfg->sf_info = (int) PyDict_GetItemLong(input_dict,"sf_info",1);
     cfg->num_midi_channels = (int) PyDict_GetItemLong(input_dict,"num_channels",NUM_CHANNELS);
 
     PyObject* py_list = PyDict_GetItemString(input_dict, "sfpaths");
@@ -626,7 +834,19 @@ static PyMethodDef GCSynthMethods[] = {
     {"start_capture",py_start_capture,METH_VARARGS,"start_capture(device) -> lanches capture and audio thread"},
     {"list_capture_devices",py_list_capture_devices,METH_VARARGS,"list_capture_devices() -> List[str]"},
 
-    {"timer_event",py_gcsynth_event,METH_VARARGS,"send an event that gets executed in the future"},
+    {"timer_event",py_gcsynth_event,METH_VARARGS,
+        "timer_event(ev_or_ev_list [,epoch]) send events that get executed in the future"},
+    {"timer_cancel",py_gcsynth_timer_cancel,METH_VARARGS,
+        "timer_cancel([group]) cancel inflight timer events of a group, all if not specified"},
+    {"set_progress_callback",py_gcsynth_set_progress_callback,METH_VARARGS,
+        "set_progress_callback(callable(group,token)) called for EV_PROGRESS events"},
+    {"progress_dispatch",py_gcsynth_progress_dispatch,METH_NOARGS,
+        "progress_dispatch() waits for an EV_PROGRESS event and calls the progress callback, False once it is None"},
+    {"monotonic",py_gcsynth_monotonic,METH_NOARGS,"monotonic() -> clock used for timer events"},
+    {"render_offline",py_gcsynth_render_offline,METH_VARARGS,
+        "render_offline(ev_list, until, writer) render up to 'until' seconds, writer(bytes) gets 16 bit stereo pcm"},
+    {"render_offline_reset",py_gcsynth_render_offline_reset,METH_NOARGS,
+        "render_offline_reset() rewind the offline render to 0 and silence all voices"},
 
     {"filter_set_control_by_name", py_gcsynth_channel_set_control_by_name, 
         METH_VARARGS,"filter_set_control_by_name(chan,plugin_label,name,value)" },
@@ -720,8 +940,8 @@ PyMODINIT_FUNC PyInit_gcsynth(void) {
     char* timing_log_env = getenv(TIMING_LOG_ENV);
  
     if (SDL_Init(SDL_INIT_AUDIO) < 0) {
+        // offline rendering still works on a headless box.
         fprintf(stderr, "SDL_Init failed: %s\n", SDL_GetError());
-        return NULL;
     }
     
     // Create the custom exception
@@ -752,6 +972,9 @@ PyMODINIT_FUNC PyInit_gcsynth(void) {
     PyModule_AddIntConstant(module, "EV_FILTER_DISABLE", EV_FILTER_DISABLE);
     PyModule_AddIntConstant(module, "EV_FILTER_CONTROL", EV_FILTER_CONTROL);
     PyModule_AddIntConstant(module, "EV_PITCH_WHEEL", EV_PITCH_WHEEL);
+    PyModule_AddIntConstant(module, "EV_PITCH_RANGE", EV_PITCH_RANGE);
+    PyModule_AddIntConstant(module, "EV_PROGRESS", EV_PROGRESS);
+    PyModule_AddIntConstant(module, "SAMPLE_RATE", SAMPLE_RATE);
     PyModule_AddIntConstant(module, "NUM_CHANNELS", NUM_CHANNELS); // max user specified channels
     PyModule_AddIntConstant(module, "LIVE_CAPTURE_CHANNEL", LIVE_CAPTURE_CHANNEL); // reserved for live capture
 
@@ -34,6 +34,8 @@ enum {
 
 struct gcsynth_cfg {
     int test; // running in test only mode?
+    int offline; // no audio devices, render with gcsynth_sf_render_offline
+    int sf_info; // write data/sf_info/instruments.json, 0 when the caller has it cached
     int num_sfpaths;
     char* sfpaths[MAX_SOUNDFONTS]; // NULL sentinel value terminates list  
     int num_midi_channels;
@@ -13,6 +13,13 @@
 struct gcsynth_channel {
     struct fgraph *fg; // current filter graph assigned to channel
     
+    // hot swap, 'installed_fg' is set by the python thread and taken by 
+    // the audio thread which fades 'fading_fg' out over FG_CROSSFADE_BLOCKS.
+    struct fgraph *installed_fg;
+    struct fgraph *fading_fg;
+    int fading;
+    int fade_pos;
+    
 //    struct gcsynth_filter_graph fg;
 //    int filter_graph_enabled;
     int freq_domain_preproc_needed;
@@ -57,11 +64,46 @@ void gcsynth_channel_assign_filter_graph(int channel, struct fgraph* fg)
 {
     struct gcsynth_channel* c = lock_channel(channel);
     if (c != NULL) {
+        // retained by assign_fg_to_channel
+        if (c->fg != NULL) {
+            fg_release(c->fg);
+        }
         c->fg = fg;
         unlock_channel(channel);
     }
 }
 
+void gcsynth_channel_install_filter_graph(int channel, struct fgraph* fg)
+{
+    struct gcsynth_channel* c = &ChannelFilters[channel];
+    struct fgraph* replaced;
+
+    fg_retain(fg);
+    replaced = __atomic_exchange_n(&c->installed_fg, fg, __ATOMIC_ACQ_REL);
+    if (replaced != NULL) {
+        // installed twice before the audio thread got to it
+        fg_release(replaced);
+    }
+}
+
+int gcsynth_channel_fading_filter_graph(struct fgraph* fg)
+{
+    int channel;
+    int fading = 0;
+
+    for (channel = 0; channel < NUM_CHANNELS && !fading; channel++) {
+        struct gcsynth_channel* c = lock_channel(channel);
+        if (c != NULL) {
+            // fading out, or about to be when the audio thread takes the
+            // installed graph
+            fading = (c->fading_fg == fg) || 
+                ((c->fg == fg) && (__atomic_load_n(&c->installed_fg, __ATOMIC_ACQUIRE) != NULL));
+            unlock_channel(channel);
+        }
+    }
+    return fading;
+}
+
 
 void gcsynth_channel_gain(int channel, float gain)
 {
@@ -160,16 +202,65 @@ int gcsynth_channel_set_control_by_name(int channel, char* plugin_label,
     return ret;
 }    
 
-void synth_apply_filter_graph(int channel, float* left, float* right, int samples)
+// run the outgoing and incoming graphs on the same audio and ramp between them
+static void crossfade_filter_graph(struct gcsynth_channel* c, uint64_t frame, int channel, float* left, float* right)
+{
+    float old_left[AUDIO_SAMPLES];
+    float old_right[AUDIO_SAMPLES];
+    float g;
+    int i;
+
+    memcpy(old_left, left, sizeof(old_left));
+    memcpy(old_right, right, sizeof(old_right));
+    if ((c->fading_fg != NULL) && (c->fading_fg->enabled)) {
+        fg_run(c->fading_fg, frame, channel, old_left, old_right);
+    }
+    if ((c->fg != NULL) && (c->fg->enabled)) {
+        fg_run(c->fg, frame, channel, left, right);
+    }
+
+    for (i = 0; i < AUDIO_SAMPLES; i++) {
+        g = (float) (c->fade_pos * AUDIO_SAMPLES + i + 1) / (FG_CROSSFADE_BLOCKS * AUDIO_SAMPLES);
+        left[i] = left[i] * g + old_left[i] * (1.0 - g);
+        right[i] = right[i] * g + old_right[i] * (1.0 - g);
+    }
+
+    if (++c->fade_pos == FG_CROSSFADE_BLOCKS) {
+        if (c->fading_fg != NULL) {
+            // freed later by the python thread
+            fg_release(c->fading_fg);
+            c->fading_fg = NULL;
+        }
+        c->fading = 0;
+    }
+}
+
+void synth_apply_filter_graph(int channel, float* left, float* right, int samples, uint64_t frame)
 {
     struct gcsynth_channel *c = lock_channel(channel);
 
     if (c != NULL) {
+        struct fgraph* installed = __atomic_exchange_n(&c->installed_fg, NULL, __ATOMIC_ACQ_REL);
+
+        if (installed != NULL) {
+            // a graph still fading out is cut short by the next one
+            if (c->fading_fg != NULL) {
+                fg_release(c->fading_fg);
+            }
+            c->fading_fg = c->fg;
+            c->fg = installed;
+            c->fade_pos = 0;
+            c->fading = 1;
+        }
+
 //printf("synth_apply_filter_graph graph exists %s \n", (c->fg != NULL) ? "true" : "false");
-        if ((c->fg != NULL) && (c->fg->enabled)) {
+        if (c->fading) {
+            assert(samples == AUDIO_SAMPLES);
+            crossfade_filter_graph(c, frame, channel, left, right);
+        } else if ((c->fg != NULL) && (c->fg->enabled)) {
 //printf("synth_apply_filter_graph graph enabled\n");
             assert(samples == AUDIO_SAMPLES);
-            fg_run(c->fg, channel, left, right);
+            fg_run(c->fg, frame, channel, left, right);
         }
         unlock_channel(channel);
     }
@@ -45,6 +45,10 @@ int gcsynth_channel_set_control_by_name(int channel, char* plugin_label,
 /////////////////////////////////////////////////////////////////////////
 
 void gcsynth_channel_assign_filter_graph(int channel, struct fgraph* fg);
+// hand a retained graph to the audio thread, see install_fg_on_channel
+void gcsynth_channel_install_filter_graph(int channel, struct fgraph* fg);
+// true while a channel crossfades from 'fg' to an installed graph
+int gcsynth_channel_fading_filter_graph(struct fgraph* fg);
 
 
 /**
@@ -84,7 +88,8 @@ void gcsynth_incr_instance_id();  called by gcsynth_start()
 
 void synth_filter_router(int channel, float* left, float* right, int samples);
 
-void synth_apply_filter_graph(int channel, float* left, float* right, int samples);
+// frame is the first sample frame of the block, see fg_run
+void synth_apply_filter_graph(int channel, float* left, float* right, int samples, uint64_t frame);
 
 
 void synth_interleaved_filter_router(int chan, float* interleaved_audio, int samples);
@@ -3,6 +3,7 @@
 
 #include <pthread.h>
 #include <unistd.h> // For usleep()
+#include <time.h>
 
 #include "gcsynth.h"
 #include "gcsynth_event.h"
@@ -22,40 +23,78 @@ struct timer_event_data {
 struct gcsync_timer_dispatcher {
     GAsyncQueue *queue;
     struct ev_loop* loop;
+    // wakes the loop when messages are pushed onto the queue
+    ev_async wakeup;
+    // timer_event_data* -> timer_event_data*, timers that have not fired.
+    // Only accessed from the dispatcher thread.
+    GHashTable* inflight;
     pthread_t thread;
     pthread_attr_t attr;
 };
 
 
+// sample accurate events are handed to the audio threads this many seconds
+// early with their due time, the render thread places them at the exact 
+// sample frame so timer jitter smaller than this doesn't matter.
+#define DISPATCH_LEAD 0.010
+
 static struct gcsync_timer_dispatcher Dispatcher;
+static ProgressHandler OnProgress = NULL;
 
 static int dispatcher_send(struct scheduled_event* s_event);
 static void timer_callback(EV_P_ ev_timer *w, int revents);
+static void wakeup_callback(EV_P_ ev_async *w, int revents);
 static void *dispatcher_loop_thread(void *arg);
 static int dispatcher_init();
 
 
+double gcsynth_monotonic()
+{
+    struct timespec ts;
+    clock_gettime(CLOCK_MONOTONIC, &ts);
+    return ts.tv_sec + ts.tv_nsec * 1e-9;
+}
 
+void gcsynth_set_progress_handler(ProgressHandler handler)
+{
+    OnProgress = handler;
+}
 
+void scheduled_event_free(struct scheduled_event* s_event)
+{
+    free((void *) s_event->plugin_label);
+    free((void *) s_event->plugin_path);
+    free((void *) s_event->control_name);
+    free(s_event);
+}
 
-static void timer_callback(EV_P_ ev_timer *w, int revents)
+static void timer_event_data_free(struct timer_event_data* msg)
 {
-    struct timer_event_data* msg = (struct timer_event_data*) w->data;
-    struct scheduled_event* s_event = msg->s_event;
-    // switch on event
+    scheduled_event_free(msg->s_event);
+    free(msg);
+}
+
 
+static int is_sample_accurate(int ev_type)
+{
+    return ev_type == EV_NOTEON || ev_type == EV_NOTEOFF ||
+        ev_type == EV_PITCH_WHEEL || ev_type == EV_PITCH_RANGE;
+}
+
+void gcsynth_event_execute(struct scheduled_event* s_event, double due)
+{
     // process scheduled events.
     switch(s_event->ev_type) {
         case EV_NOTEON:
             timing_log("timer_callback","noteon");
-            gcsynth_sf_noteon(s_event->channel,
-             s_event->midi_code, s_event->velocity);
+            gcsynth_sf_noteon_at(s_event->channel,
+             s_event->midi_code, s_event->velocity, due);
             break;
 
         case EV_NOTEOFF:
             timing_log("timer_callback","noteoff");
-            gcsynth_sf_noteoff(s_event->channel,
-             s_event->midi_code);
+            gcsynth_sf_noteoff_at(s_event->channel,
+             s_event->midi_code, due);
             break;
 
         case EV_SELECT:
@@ -65,10 +104,20 @@ static void timer_callback(EV_P_ ev_timer *w, int revents)
 
         case EV_PITCH_WHEEL:
 //printf("gcsynth_sf_pitchrange(%d,%f)\n", s_event->channel, s_event->pitch_change);
-            gcsynth_sf_pitchwheel(s_event->channel, s_event->pitch_change);
+            gcsynth_sf_pitchwheel_at(s_event->channel, s_event->pitch_change, due);
             // todo
             break;
 
+        case EV_PITCH_RANGE:
+            gcsynth_sf_pitchrange_at(s_event->channel, s_event->pitch_range, due);
+            break;
+
+        case EV_PROGRESS:
+            if (OnProgress) {
+                OnProgress(s_event->group, s_event->token);
+            }
+            break;
+
         case EV_FILTER_ADD:
             gcsynth_channel_add_filter(
             s_event->channel, 
@@ -102,34 +151,85 @@ static void timer_callback(EV_P_ ev_timer *w, int revents)
                 (char *) s_event->plugin_label);
             break;        
     }
+}
+
+static void timer_callback(EV_P_ ev_timer *w, int revents)
+{
+    struct timer_event_data* msg = (struct timer_event_data*) w->data;
+    struct scheduled_event* s_event = msg->s_event;
+
+    // monotonic time the event is due.
+    gcsynth_event_execute(s_event, s_event->epoch + (s_event->when * 0.001));
 
     // cleanup
-    free(msg->s_event);
-    free(msg);
+    g_hash_table_remove(Dispatcher.inflight, msg);
+    timer_event_data_free(msg);
 }
 
 /*
-    service the libev loop for events.
+    stop and free all inflight timers for a group, -1 for all groups.
 */
-static void *dispatcher_loop_thread(void *arg)
+static void cancel_group(int group)
+{
+    GHashTableIter iter;
+    gpointer key, value;
+
+    g_hash_table_iter_init(&iter, Dispatcher.inflight);
+    while (g_hash_table_iter_next(&iter, &key, &value)) {
+        struct timer_event_data* msg = (struct timer_event_data*) key;
+        if (group == -1 || msg->s_event->group == group) {
+            ev_timer_stop(Dispatcher.loop, &msg->timer_watcher);
+            g_hash_table_iter_remove(&iter);
+            timer_event_data_free(msg);
+        }
+    }
+}
+
+/*
+    drain the queue, start a timer for each scheduled event.
+*/
+static void wakeup_callback(EV_P_ ev_async *w, int revents)
 {
     struct timer_event_data* msg;
-    int usec_timeout = 5000;
-
-    while (1) {
-        msg = g_async_queue_timeout_pop(Dispatcher.queue, usec_timeout);
-        if (msg) {
-            msg->timer_watcher.data = msg; // circular ref needed for cleanup
-            ev_timer_init(&msg->timer_watcher,timer_callback,
-                msg->s_event->when * 0.001, 0.0);
-            // call timer_callback in 'when' milliseconds.    
-            ev_timer_start(Dispatcher.loop, &msg->timer_watcher);    
-        } 
-
-        // process any libev events without waiting for future ones.
-        ev_loop(Dispatcher.loop, EVLOOP_NONBLOCK);
+
+    // the loop time may be stale if we were idle.
+    ev_now_update(Dispatcher.loop);
+
+    while ((msg = g_async_queue_try_pop(Dispatcher.queue)) != NULL) {
+        struct scheduled_event* s_event = msg->s_event;
+        double delay;
+
+        if (s_event->ev_type == EV_CANCEL_GROUP) {
+            cancel_group(s_event->group);
+            timer_event_data_free(msg);
+            continue;
+        }
+
+        // events are relative to a common epoch so a batch of events 
+        // does not drift by the time it took to enqueue them.
+        delay = s_event->epoch + (s_event->when * 0.001) - gcsynth_monotonic();
+        if (is_sample_accurate(s_event->ev_type)) {
+            delay -= DISPATCH_LEAD;
+        }
+        if (delay < 0.0) {
+            delay = 0.0;
+        }
+
+        msg->timer_watcher.data = msg; // circular ref needed for cleanup
+        ev_timer_init(&msg->timer_watcher,timer_callback, delay, 0.0);
+        // call timer_callback after 'delay' seconds.
+        ev_timer_start(Dispatcher.loop, &msg->timer_watcher);
+        g_hash_table_add(Dispatcher.inflight, msg);
     }
+}
 
+/*
+    service the libev loop for events, the loop sleeps until either 
+    the next timer is due or wakeup is signalled.
+*/
+static void *dispatcher_loop_thread(void *arg)
+{
+    ev_run(Dispatcher.loop, 0);
     ev_loop_destroy(Dispatcher.loop);
     return NULL;
 }
@@ -151,10 +251,14 @@ static int dispatcher_send(struct scheduled_event* s_event)
             "dispatcher_send: Unable to allocate memory\n");
         err = -1;
     } else {
+        if (s_event->epoch <= 0.0) {
+            s_event->epoch = gcsynth_monotonic();
+        }
         msg->s_event = s_event;
         msg->timer_watcher.data = msg;
         // enqueue
         g_async_queue_push(Dispatcher.queue, msg);
+        ev_async_send(Dispatcher.loop, &Dispatcher.wakeup);
     }
 
     return err;
@@ -193,6 +297,9 @@ static int dispatcher_init()
         fprintf(stderr,"gcsynth_event: ev_loop_new failed!\n");
         return -1;
     }
+    ev_async_init(&Dispatcher.wakeup, wakeup_callback);
+    ev_async_start(Dispatcher.loop, &Dispatcher.wakeup);
+    Dispatcher.inflight = g_hash_table_new(g_direct_hash, g_direct_equal);
 
     pthread_attr_init(&Dispatcher.attr);
     pthread_attr_setdetachstate(&Dispatcher.attr, PTHREAD_CREATE_DETACHED); // Daemon thread
@@ -244,6 +351,24 @@ void gcsynth_schedule(struct gcsynth* gcs, struct scheduled_event* s_event)
 }
 
 
+void gcsynth_cancel_group(struct gcsynth* gcs, int group)
+{
+    struct scheduled_event* s_event = (struct scheduled_event*)
+        calloc(1, sizeof(struct scheduled_event));
+
+    if (s_event == NULL) {
+        gcsynth_raise_exception("gcsynth_cancel_group");
+        return;
+    }
+    s_event->ev_type = EV_CANCEL_GROUP;
+    s_event->group = group;
+    if (dispatcher_send(s_event) == -1) {
+        free(s_event);
+        gcsynth_raise_exception("gcsynth_cancel_group");
+    }
+}
+
+
 void gcsynth_sequencer_remove_channel_events(struct gcsynth* gcs, int chan)
 {
     // todo?
@@ -19,6 +19,10 @@ enum GCSYNTH_EVENT {
     EV_SELECT,
     EV_PITCH_WHEEL,
     EV_RESET_CHANNEL,
+    EV_PITCH_RANGE,
+
+    EV_PROGRESS,     // calls the registered progress handler 
+    EV_CANCEL_GROUP, // internal, cancels inflight events of a group
 
 
     EV_NUM_EVENTS
@@ -27,7 +31,14 @@ enum GCSYNTH_EVENT {
 #define EV_NULL_EVENT -1
 
 struct scheduled_event {
-    unsigned int when;
+    double when; // milliseconds after epoch
+    // CLOCK_MONOTONIC time in seconds that 'when' is relative to, if 0 
+    // then the time the event was submitted.
+    double epoch;
+    // events submitted together can be cancelled as a group.
+    int group;
+    // passed to the progress handler for EV_PROGRESS events
+    long token;
     int channel;
     int ev_type;
     
@@ -46,6 +57,7 @@ struct scheduled_event {
     float control_value;
 
     float pitch_change; // in half steps
+    float pitch_range;  // in semitones
  
     int event_id;
     struct gcsynth* gcs;
@@ -57,6 +69,22 @@ struct scheduled_event {
 // scheduled event execution
 void gcsynth_schedule(struct gcsynth* gcs, struct scheduled_event* event);
 
+// execute an event now, 'due' is the time sample accurate events take 
+// effect, see gcsynth_sf_noteon_at.
+void gcsynth_event_execute(struct scheduled_event* s_event, double due);
+
+// cancel all inflight events of a group, group -1 cancels everything.
+void gcsynth_cancel_group(struct gcsynth* gcs, int group);
+
+// called from the dispatcher thread when an EV_PROGRESS event fires.
+typedef void (*ProgressHandler)(int group, long token);
+void gcsynth_set_progress_handler(ProgressHandler handler);
+
+// CLOCK_MONOTONIC in seconds, same clock as python's time.monotonic()
+double gcsynth_monotonic();
+
+void scheduled_event_free(struct scheduled_event* s_event);
+
 // immediate execution of synth events
 void gcsynth_noteon(struct gcsynth* gcs, int chan, int midicode, int velocity, int gstring);
 void gcsynth_noteoff(struct gcsynth* gcs, int chan, int midicode, int gstring);
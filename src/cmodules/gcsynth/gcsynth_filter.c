@@ -21,25 +21,34 @@ static int update_ctrl_val(struct gcsynth_filter_control* control, float value);
 
 
 
-static int update_ctrl_val(struct gcsynth_filter_control* control, float value)
+int gcsynth_filter_check_value(struct gcsynth_filter_control* control, float value)
 {
     int ret = NOWARNING;
 
-    if (control->is_toggled) {
-        control->value = (value != 0.0) ? 1.0: 0.0; 
-    } else {
+    if (!control->is_toggled) {
         if (control->is_bounded_above && value > control->upper) {
             ret = FILTER_CONTROL_VALUE_ABOVE_BOUNDS; // failed upper bounds check
         }
         else if (control->is_bounded_below && value < control->lower) {
             ret = FILTER_CONTROL_VALUE_BELOW_BOUNDS; // failed lower bounds check
+        }
+    }
+
+    return ret;
+}
+
+static int update_ctrl_val(struct gcsynth_filter_control* control, float value)
+{
+    int ret = gcsynth_filter_check_value(control, value);
+
+    if (control->is_toggled) {
+        control->value = (value != 0.0) ? 1.0: 0.0; 
+    } else if (ret == NOWARNING) {
+        // value is is in range
+        if (control->is_integer) {
+            control->value = ceil(value);
         } else {
-            // value is is in range
-            if (control->is_integer) {
-                control->value = ceil(value);
-            } else {
-                control->value = value;
-            }
+            control->value = value;
         }
     }
 
@@ -78,6 +87,18 @@ void gcsynth_filter_destroy(struct gcsynth_filter* gc_filter)
 }
 
 // sets the value of a control
+int gcsynth_filter_control_index(struct gcsynth_filter* gc_filter, char* name)
+{
+    int i;
+
+    for(i = 0; i < gc_filter->num_controls; i++) {
+        if (strcmp(gc_filter->controls[i].name,name) == 0) {
+            return i;
+        }
+    } 
+    return -1;
+}
+
 int gcsynth_filter_setbyname(struct gcsynth_filter* gc_filter, char* name, LADSPA_Data value)
 {
     int i;
@@ -81,6 +81,11 @@ void gcsynth_filter_destroy(struct gcsynth_filter* gc_filter);
 int gcsynth_filter_setbyname(struct gcsynth_filter* gc_filter, char* name, LADSPA_Data value);
 int gcsynth_filter_setbyindex(struct gcsynth_filter* gc_filter, int, LADSPA_Data value);
 
+// index of a control, -1 if there is no control with that name
+int gcsynth_filter_control_index(struct gcsynth_filter* gc_filter, char* name);
+// NOWARNING if the value is in the control's bounds, the control is unchanged
+int gcsynth_filter_check_value(struct gcsynth_filter_control* control, float value);
+
 int gcsynth_filter_run_sterio(
     struct gcsynth_filter* gc_filter, float* left, float* right, int samples);
     
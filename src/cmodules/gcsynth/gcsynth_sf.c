@@ -15,7 +15,16 @@ Also based on tsf's design one sound font is allowed on one audio client.
 #include <assert.h>
 #include <time.h>
 #define TSF_IMPLEMENTATION
+// the converted samples are mapped from the sample cache, see gcsynth_sfcache.h
+struct tsf_riffchunk;
+struct tsf_stream;
+static int sf_load_samples(void** pRawBuffer, float** pFloatBuffer, unsigned int* pSmplCount, 
+    struct tsf_riffchunk* chunkSmpl, struct tsf_stream* stream);
+static void sf_free_samples(float* samples);
+#define TSF_LOAD_SAMPLES sf_load_samples
+#define TSF_FREE_SAMPLES sf_free_samples
 #include "tsf.h"
+#include "gcsynth_sfcache.h"
 
 
 #include <SDL2/SDL.h>
@@ -28,6 +37,7 @@ Also based on tsf's design one sound font is allowed on one audio client.
 
 #include "gcsynth.h"
 #include "gcsynth_sf.h"
+#include "gcsynth_event.h"
 #include "gcsynth_channel.h"
 #include "gcsynth_sf.h"
 #include "ringbuffer.h"
@@ -38,6 +48,11 @@ Also based on tsf's design one sound font is allowed on one audio client.
 #define BUFSIZE      0xFFFF
 #define MAX_ATHREADS 13 
 
+// timestamped events are placed this many frames after the frame that 
+// is being played at their due time so they land ahead of the render 
+// cursor. 
+#define SCHEDULE_LATENCY_FRAMES (AUDIO_SAMPLES * 2)
+
 
 struct audio_thread {
     SDL_AudioSpec spec;
@@ -73,6 +88,17 @@ struct audio_thread {
     */
     GAsyncQueue *request_frames; 
 
+    // sample frames rendered since the stream started, only used by the
+    // render thread.
+    uint64_t frames_rendered;
+    // timestamped messages waiting for their frame sorted by frame, 
+    // only used by the render thread.
+    GList* pending;
+
+    // frames handed to SDL and the CLOCK_MONOTONIC time that happened,
+    // maps a time to a frame. guarded by state_mutex.
+    uint64_t frames_played;
+    double clock_time;
 };
 
 enum {
@@ -99,6 +125,10 @@ struct audio_thread_msg {
 
     void *user_data;
     void (*extern_func)(void *);
+
+    // sample frame since the stream started when this takes effect,
+    // 0 means before the next rendered frame.
+    uint64_t frame;
 };
 
 
@@ -110,6 +140,12 @@ static int NumAudioThreads;
 
 static struct audio_thread* ChannelAllocTable[NUM_CHANNELS];
 
+// offline rendering, no audio devices or render threads. OfflineFrame is
+// the render position in sample frames.
+#define OFFLINE_CHUNK_FRAMES (AUDIO_SAMPLES * 64)
+static int Offline;
+static uint64_t OfflineFrame;
+
 
 struct voice_render_result {
     int out_samples;
@@ -293,62 +329,60 @@ struct voice_render_result my_tsf_voice_render(tsf* f, struct tsf_voice* v, floa
 }
 
 
-/**
- * WE HAVE ARRIVED AT THE MOST IMPORTANT FUNCTION IN THE SYSTEM:
- * 
- * This is where synth instruments and effects are outputed to the sound system.
- * This is run in a FIFO thread at max priority. This function gets called approximately
- * once every 2 milliseconds.
- */
-TSFDEF void my_tsf_render_float(tsf* f, float* out_right, float* out_left, int samples)
+static void proc_at_msg(struct audio_thread* at, struct audio_thread_msg* msg);
+
+/*
+   render all playing voices for 'samples' frames starting at 'offset' within 
+   the per channel buffers.
+*/
+static void render_voices(tsf* f, 
+    float channel_buffers[NUM_CHANNELS][2][AUDIO_SAMPLES],
+    unsigned char* channels_in_use, int* channel_list, int* num_channels_in_use,
+    int offset, int samples, int block_samples)
 {
 	struct tsf_voice *v = f->voices, *vEnd = v + f->voiceNum;
-    int n = sizeof(float) * samples;
-	TSF_MEMSET(out_left, 0, n);
-	TSF_MEMSET(out_right, 0, n);
     int i;
-    // per channel, left/right array of samples.
-    float channel_buffers[NUM_CHANNELS][2][AUDIO_SAMPLES];
-    unsigned char channels_in_use[NUM_CHANNELS];
-    int channel_list[NUM_CHANNELS];
-    int num_channels_in_use = 0;
-    int chan_count;
-
-    memset(channel_buffers, 0, sizeof(channel_buffers));
-    memset(channels_in_use, 0, sizeof(channels_in_use));
-
-    fg_freq_domain_event_clear();
 
-    // stage 1. 
-    //   Render sound font audio into buffers per channel, there will be multiple
-    //   my_tsf_render_float calls per channel
     for (; v != vEnd; v++) {
 		if (v->playingPreset != -1) {
             float chan_buffer[AUDIO_SAMPLES * 2];
             struct voice_render_result vr;
-            float* chan_left = channel_buffers[v->playingChannel][0];
-            float* chan_right = channel_buffers[v->playingChannel][1];
+            float* chan_left = channel_buffers[v->playingChannel][0] + offset;
+            float* chan_right = channel_buffers[v->playingChannel][1] + offset;
             float freq = midi2freq(v->playingKey);
             float amp = v->ampenv.level;
 
-            if (v->playingChannel >= NUM_CHANNELS || num_channels_in_use >= NUM_CHANNELS) {
+            if (v->playingChannel >= NUM_CHANNELS || *num_channels_in_use >= NUM_CHANNELS) {
                 // not sure what to do here, this is one of this 'it should never happen' 
                 // but it happened anyway cases ;)
                 fprintf(stderr,"Too many channels configured, cant render sf!\n");
                 continue;                
             }
 
-            memset(chan_buffer, 0, sizeof(chan_buffer));
+            memset(chan_buffer, 0, sizeof(float) * samples * 2);
             vr = my_tsf_voice_render(f, v, chan_buffer, samples);
 
             // compute frequency domain without a FFT.
-            fg_freq_domain_event_add(v->playingChannel, freq, amp, vr.outL, vr.outR);           
+            if (samples == block_samples) {
+                fg_freq_domain_event_add(v->playingChannel, freq, amp, vr.outL, vr.outR);           
+            } else {
+                // partial block, the bandpass filters sum the entries of 
+                // a channel so pad with silence.
+                float padL[AUDIO_SAMPLES];
+                float padR[AUDIO_SAMPLES];
+
+                memset(padL, 0, sizeof(padL));
+                memset(padR, 0, sizeof(padR));
+                memcpy(padL + offset, vr.outL, sizeof(float) * samples);
+                memcpy(padR + offset, vr.outR, sizeof(float) * samples);
+                fg_freq_domain_event_add(v->playingChannel, freq, amp, padL, padR);
+            }
 
             if(channels_in_use[v->playingChannel] == 0) {
                 // new channel being used
                 channels_in_use[v->playingChannel] = 1;
-                channel_list[num_channels_in_use] = v->playingChannel;
-                num_channels_in_use++; 
+                channel_list[*num_channels_in_use] = v->playingChannel;
+                (*num_channels_in_use)++; 
             }
 
             // accumulate multiple renderings per channel.
@@ -358,6 +392,72 @@ TSFDEF void my_tsf_render_float(tsf* f, float* out_right, float* out_left, int s
             }
         }
     }
+}
+
+/**
+ * WE HAVE ARRIVED AT THE MOST IMPORTANT FUNCTION IN THE SYSTEM:
+ * 
+ * This is where synth instruments and effects are outputed to the sound system.
+ * This is run in a FIFO thread at max priority. This function gets called approximately
+ * once every 2 milliseconds.
+ *
+ * Timestamped messages that are due within this block split the soundfont 
+ * rendering at their exact sample offset so a noteon doesn't get rounded to
+ * a block boundary. Filters still see the whole block.
+ */
+TSFDEF void my_tsf_render_float(struct audio_thread* at, float* out_right, float* out_left, int samples)
+{
+    tsf* f = at->g_TinySoundFont;
+    int n = sizeof(float) * samples;
+	TSF_MEMSET(out_left, 0, n);
+	TSF_MEMSET(out_right, 0, n);
+    int i;
+    // per channel, left/right array of samples.
+    float channel_buffers[NUM_CHANNELS][2][AUDIO_SAMPLES];
+    unsigned char channels_in_use[NUM_CHANNELS];
+    int channel_list[NUM_CHANNELS];
+    int num_channels_in_use = 0;
+    int chan_count;
+    int cursor = 0;
+    uint64_t block_start = at->frames_rendered;
+
+    memset(channel_buffers, 0, sizeof(channel_buffers));
+    memset(channels_in_use, 0, sizeof(channels_in_use));
+
+    fg_freq_domain_event_clear();
+
+    // stage 1. 
+    //   Render sound font audio into buffers per channel, there will be multiple
+    //   my_tsf_voice_render calls per channel. The block is split at the 
+    //   offset of each pending message.
+    while (cursor < samples) {
+        int seg_end = samples;
+
+        if (at->pending != NULL) {
+            struct audio_thread_msg* msg = (struct audio_thread_msg*) at->pending->data;
+            if (msg->frame < block_start + samples) {
+                seg_end = (msg->frame > block_start + cursor) ? 
+                    (int)(msg->frame - block_start) : cursor;
+            }
+        }
+
+        if (seg_end > cursor) {
+            render_voices(f, channel_buffers, channels_in_use, channel_list, 
+                &num_channels_in_use, cursor, seg_end - cursor, samples);
+            cursor = seg_end;
+        }
+
+        // apply messages that are due at the cursor.
+        while (at->pending != NULL) {
+            struct audio_thread_msg* msg = (struct audio_thread_msg*) at->pending->data;
+            if (msg->frame > block_start + cursor) {
+                break;
+            }
+            at->pending = g_list_delete_link(at->pending, at->pending);
+            proc_at_msg(at, msg);
+        }
+    }
+    at->frames_rendered += samples;
 
     // stage 2. 
     //   apply audio filters if configured for that channel
@@ -373,7 +473,7 @@ TSFDEF void my_tsf_render_float(tsf* f, float* out_right, float* out_left, int s
         }
 
         // this is the new filter graph way.
-        synth_apply_filter_graph(channel, chan_left, chan_right, samples);
+        synth_apply_filter_graph(channel, chan_left, chan_right, samples, block_start);
 
         // stage 3. 
         //   mix all channel buffers to out_right and out_left which in turn will
@@ -422,59 +522,101 @@ static struct audio_thread* checkout(int chan, int sfont_id) {
     return at;
 }
 
-/**
- * Nonblocking call to the message queue, process any queued 
- * requests.  
+/*
+ * execute a message in the render thread and free it.
  */
-static void proc_at_msgs(struct audio_thread* at) {
-    struct audio_thread_msg* msg;
+static void proc_at_msg(struct audio_thread* at, struct audio_thread_msg* msg) {
+    switch(msg->ev_type) {
+        case SF_NOTEON:
+            tsf_channel_note_on(
+                at->g_TinySoundFont,
+                msg->chan,
+                msg->midicode,
+                msg->vel 
+            );
+            break;
 
-    while ((msg = g_async_queue_timeout_pop(at->queue,0)) != NULL) {
-        switch(msg->ev_type) {
-            case SF_NOTEON:
-                tsf_channel_note_on(
-                    at->g_TinySoundFont,
-                    msg->chan,
-                    msg->midicode,
-                    msg->vel 
-                );
-                break;
+        case SF_NOTEOFF:
+            tsf_channel_note_off(
+                at->g_TinySoundFont,
+                msg->chan,
+                msg->midicode
+            );
+            break;
 
-            case SF_NOTEOFF:
-                tsf_channel_note_off(
-                    at->g_TinySoundFont,
-                    msg->chan,
-                    msg->midicode
-                );
-                break;
+        case SF_SELECT:
+            tsf_channel_set_bank_preset(at->g_TinySoundFont, 
+            msg->chan, msg->bank, msg->preset);    
+            break;
 
-            case SF_SELECT:
-                tsf_channel_set_bank_preset(at->g_TinySoundFont, 
-                msg->chan, msg->bank, msg->preset);    
-                break;
+        case SF_PITCH_WHEEL:
+            tsf_channel_set_pitchwheel(at->g_TinySoundFont, msg->chan, 
+            msg->pitchWheel);
+            break;
 
-            case SF_PITCH_WHEEL:
-                tsf_channel_set_pitchwheel(at->g_TinySoundFont, msg->chan, 
-                msg->pitchWheel);
-                break;
+        case SF_PITCH_RANGE:
+            tsf_channel_set_pitchrange(at->g_TinySoundFont, msg->chan, 
+                msg->pitch_range);
+            break;
 
-            case SF_PITCH_RANGE:
-                tsf_channel_set_pitchrange(at->g_TinySoundFont, msg->chan, 
-                    msg->pitch_range);
-                break;
+        case SF_RESET:
+            tsf_reset(at->g_TinySoundFont);
+            break;
 
-            case SF_RESET:
-                tsf_reset(at->g_TinySoundFont);
-                break;
+        case SF_EXTERN_FUNC:
+            // execute the function in this thread.
+            msg->extern_func(msg->user_data);
+            break;
 
-            case SF_EXTERN_FUNC:
-                // execute the function in this thread.
-                msg->extern_func(msg->user_data);
-                break;
+    }
+    free(msg);
+}
 
+// order by frame, equal frames keep the order they were sent in.
+static gint msg_frame_cmp(gconstpointer a, gconstpointer b) {
+    const struct audio_thread_msg* ma = (const struct audio_thread_msg*) a;
+    const struct audio_thread_msg* mb = (const struct audio_thread_msg*) b;
+    return (ma->frame < mb->frame) ? -1 : 1;
+}
+
+/**
+ * Nonblocking call to the message queue, process any queued 
+ * requests. Timestamped messages that are not due yet are held in the
+ * pending list for my_tsf_render_float.  
+ */
+static void proc_at_msgs(struct audio_thread* at) {
+    struct audio_thread_msg* msg;
+
+    while ((msg = g_async_queue_timeout_pop(at->queue,0)) != NULL) {
+        if (msg->frame <= at->frames_rendered) {
+            // immediate or already late.
+            proc_at_msg(at, msg);
+        } else {
+            at->pending = g_list_insert_sorted(at->pending, msg, msg_frame_cmp);
+        }
+    }
+}
+
+/*
+ * frame that corresponds to a CLOCK_MONOTONIC time, 0 (immediate) if 
+ * 'when' is 0 or the stream hasn't started.
+ */
+static uint64_t frame_at(struct audio_thread* at, double when) {
+    uint64_t frame = 0;
+
+    if (Offline) {
+        // 'when' is the time since the offline render started.
+        frame = (uint64_t) (when * at->spec.freq);
+    } else if (when > 0.0) {
+        pthread_mutex_lock(&at->state_mutex);
+        if (at->clock_time > 0.0) {
+            double f = (double) at->frames_played + 
+                (when - at->clock_time) * at->spec.freq + SCHEDULE_LATENCY_FRAMES;
+            frame = (f < 1.0) ? 1 : (uint64_t) f;
         }
-        free(msg);
+        pthread_mutex_unlock(&at->state_mutex);
     }
+    return frame;
 }
 
 /*
@@ -507,6 +649,10 @@ static void audio_consumer(void *userdata, Uint8 *stream, int len) {
                 buffer[i * 2] = left[i];
                 buffer[i * 2 + 1] = right[i];
             }
+            pthread_mutex_lock(&at->state_mutex);
+            at->frames_played += AUDIO_SAMPLES;
+            at->clock_time = gcsynth_monotonic();
+            pthread_mutex_unlock(&at->state_mutex);
         }
     } // else we can do nothing, the audio renderer hasn't started.
 }
@@ -521,7 +667,7 @@ static void audio_render(void* arg)
     float out_right[AUDIO_SAMPLES];
     float out_left[AUDIO_SAMPLES];
 
-    my_tsf_render_float(at->g_TinySoundFont,
+    my_tsf_render_float(at,
         out_left,out_right, AUDIO_SAMPLES);
 
     ring_buffer_push(at->rb, out_left, out_right);
@@ -558,12 +704,72 @@ static void *audio_render_thread(void *arg) {
         pthread_mutex_unlock(&at->state_mutex);
     }
 
+    g_list_free_full(at->pending, free);
+    at->pending = NULL;
+
     printf("audio thread exited\n");
     SDL_CloseAudioDevice(at->dev);
     return NULL;
 }
 
 
+/*
+    Soundfont samples, see gcsynth_sfcache.h
+*/
+
+// the soundfont tsf_load is reading, fonts are loaded one at a time by 
+// gcsynth_sf_init
+static const char* LoadingFont = NULL;
+
+static int sf_load_samples(void** pRawBuffer, float** pFloatBuffer, unsigned int* pSmplCount, 
+    struct tsf_riffchunk* chunkSmpl, struct tsf_stream* stream)
+{
+    const float* cached;
+    unsigned int count = chunkSmpl->size / (unsigned int) sizeof(short);
+
+    if (LoadingFont == NULL || !TSF_FourCCEquals(chunkSmpl->id, "smpl")) {
+        return tsf_load_samples(pRawBuffer, pFloatBuffer, pSmplCount, chunkSmpl, stream);
+    }
+
+    if ((cached = sfcache_open(LoadingFont, count)) != NULL) {
+        // converted before, the samples aren't read at all
+        if (!stream->skip(stream->data, chunkSmpl->size)) {
+            sfcache_release(cached);
+            return 0;
+        }
+        *pSmplCount = count;
+        *pFloatBuffer = (float*) cached;
+        return 1;
+    }
+
+    if (!tsf_load_samples(pRawBuffer, pFloatBuffer, pSmplCount, chunkSmpl, stream)) {
+        return 0;
+    }
+    // first load of this font, from now on it is mapped
+    if ((cached = sfcache_store(LoadingFont, *pFloatBuffer, *pSmplCount)) != NULL) {
+        TSF_FREE(*pFloatBuffer);
+        *pFloatBuffer = (float*) cached;
+    }
+    return 1;
+}
+
+static void sf_free_samples(float* samples)
+{
+    if (samples && !sfcache_release(samples)) {
+        TSF_FREE(samples);
+    }
+}
+
+static tsf* sf_load(const char* sf_file)
+{
+    tsf* res;
+    LoadingFont = sf_file;
+    res = tsf_load_filename(sf_file);
+    LoadingFont = NULL;
+    return res;
+}
+
+
 static int generate_instruments_info_file(char* sf_file[], int num_font_files)
 {
     int i, j;
@@ -650,7 +856,7 @@ static int generate_instruments_info_file(char* sf_file[], int num_font_files)
  * Create an audio thread for each sound font since the soundfont library
  * does not support multiple sound fonts.
  */
-int gcsynth_sf_init(char* sf_file[], int num_font_files, AudioChannelFilter filter_func) {
+int gcsynth_sf_init(char* sf_file[], int num_font_files, AudioChannelFilter filter_func, int offline) {
     int a_thread;
     
     if (num_font_files >= (MAX_ATHREADS-1)) {
@@ -660,13 +866,15 @@ int gcsynth_sf_init(char* sf_file[], int num_font_files, AudioChannelFilter filt
 
     NumAudioThreads = num_font_files;
     AudioFilterFunc = filter_func;
+    Offline = offline;
+    OfflineFrame = 0;
 
     // setup 
     for(a_thread =0; a_thread < num_font_files; a_thread++) {
         int f_index = a_thread; 
         SDL_zero(AudioThreads[a_thread].spec);
 
-        AudioThreads[a_thread].g_TinySoundFont = tsf_load_filename(sf_file[f_index]);
+        AudioThreads[a_thread].g_TinySoundFont = sf_load(sf_file[f_index]);
         if (!AudioThreads[a_thread].g_TinySoundFont) {
             fprintf(stderr,"Unable to load %s\n", sf_file[f_index]);
             return -1;
@@ -674,6 +882,10 @@ int gcsynth_sf_init(char* sf_file[], int num_font_files, AudioChannelFilter filt
         int sample_rate = (int) 
             AudioThreads[a_thread].g_TinySoundFont->outSampleRate;
 
+        if (offline) {
+            // all soundfonts are mixed into one stream.
+            sample_rate = SAMPLE_RATE;
+        }
         printf("%s sample_rate = %d\n", sf_file[f_index], sample_rate);    
 
         AudioThreads[a_thread].spec.freq = sample_rate;
@@ -693,6 +905,10 @@ int gcsynth_sf_init(char* sf_file[], int num_font_files, AudioChannelFilter filt
 
         AudioThreads[a_thread].audio_renderer_running = 0;
         AudioThreads[a_thread].request_frames = g_async_queue_new();
+        AudioThreads[a_thread].frames_rendered = 0;
+        AudioThreads[a_thread].pending = NULL;
+        AudioThreads[a_thread].frames_played = 0;
+        AudioThreads[a_thread].clock_time = 0.0;
 
      	// Set the SoundFont rendering output mode
 	    tsf_set_output(
@@ -700,6 +916,15 @@ int gcsynth_sf_init(char* sf_file[], int num_font_files, AudioChannelFilter filt
             TSF_STEREO_UNWEAVED, 
             AudioThreads[a_thread].spec.freq, 0);
 
+        if (offline) {
+            // rendered by the caller of gcsynth_sf_render_offline
+            if (pthread_mutex_init(&AudioThreads[a_thread].state_mutex, NULL) != 0) {
+                perror("Mutex initialization failed");
+                return 1;
+            }
+            continue;
+        }
+
         AudioThreads[a_thread].dev = SDL_OpenAudioDevice(
                 NULL, 
                 0, 
@@ -777,11 +1002,39 @@ int gcsynth_sf_init(char* sf_file[], int num_font_files, AudioChannelFilter filt
         }
     }
 
-    // write out the data/sf_info/instruments.json file
+    return 0;
+}
+
+
+/**
+ * write out the data/sf_info/instruments.json file
+ */
+int gcsynth_sf_write_info(char* sf_file[], int num_font_files)
+{
     return generate_instruments_info_file(sf_file, num_font_files);
 }
 
 
+// bring the samples of a preset into memory ahead of its first note, 
+// the render thread would otherwise fault them in from the sample cache.
+// Not called in the render thread, the preset table isn't changed after 
+// the font is loaded.
+static void sf_prefault_preset(tsf* f, int bank, int preset)
+{
+    int index = tsf_get_presetindex(f, bank, preset);
+    struct tsf_region* region;
+    struct tsf_region* regionEnd;
+
+    if (index < 0) {
+        return;
+    }
+    region = f->presets[index].regions;
+    regionEnd = region + f->presets[index].regionNum;
+    for (; region != regionEnd; region++) {
+        sfcache_prefault(f->fontSamples, region->offset, region->end + 1);
+    }
+}
+
 /**
  * bind a channel with a particular audio thread for a given soundfont id
  */
@@ -793,6 +1046,7 @@ int gcsynth_sf_select(int chan, int sfont_id, int bank, int preset)
     if (at) {
         struct audio_thread_msg* msg = (struct audio_thread_msg*)
             calloc(sizeof(struct audio_thread_msg),1);
+        sf_prefault_preset(at->g_TinySoundFont, bank, preset);
         if (msg != NULL) {
             msg->ev_type = SF_SELECT;
             msg->chan = chan;
@@ -835,6 +1089,11 @@ int gcsynth_sf_extern_func(int chan, void (*callback)(void*), void* data)
 
 // noteon event
 int gcsynth_sf_noteon(int chan, int midicode, int vel)
+{
+    return gcsynth_sf_noteon_at(chan, midicode, vel, 0.0);
+}
+
+int gcsynth_sf_noteon_at(int chan, int midicode, int vel, double when)
 {
     int ret = -1;
     struct audio_thread* at = get_audio_thread(chan);
@@ -848,6 +1107,7 @@ int gcsynth_sf_noteon(int chan, int midicode, int vel)
             msg->chan = chan;
             msg->midicode = midicode;
             msg->vel = vel / 128.0;    
+            msg->frame = frame_at(at, when);
 
             g_async_queue_push(at->queue, msg);
             ret = 0;
@@ -862,6 +1122,11 @@ int gcsynth_sf_noteon(int chan, int midicode, int vel)
 
 // noteoff
 int gcsynth_sf_noteoff(int chan, int midicode)
+{
+    return gcsynth_sf_noteoff_at(chan, midicode, 0.0);
+}
+
+int gcsynth_sf_noteoff_at(int chan, int midicode, double when)
 {
     int ret = -1;
     struct audio_thread* at = get_audio_thread(chan);
@@ -873,6 +1138,7 @@ int gcsynth_sf_noteoff(int chan, int midicode)
             msg->ev_type = SF_NOTEOFF;
             msg->chan = chan;
             msg->midicode = midicode;
+            msg->frame = frame_at(at, when);
 
             g_async_queue_push(at->queue, msg);
             ret = 0;
@@ -886,6 +1152,11 @@ int gcsynth_sf_noteoff(int chan, int midicode)
 // this is how to mechanize a bend/slide guitar 
 // effect.
 int gcsynth_sf_pitchwheel(int chan, float semitones) 
+{
+    return gcsynth_sf_pitchwheel_at(chan, semitones, 0.0);
+}
+
+int gcsynth_sf_pitchwheel_at(int chan, float semitones, double when) 
 {
     int ret = -1;
     struct audio_thread* at = get_audio_thread(chan);
@@ -903,6 +1174,7 @@ int gcsynth_sf_pitchwheel(int chan, float semitones)
             msg->ev_type = SF_PITCH_WHEEL;
             msg->chan = chan;
             msg->pitchWheel = pitchWheel; 
+            msg->frame = frame_at(at, when);
 
             g_async_queue_push(at->queue, msg);
             ret = 0;
@@ -915,6 +1187,11 @@ int gcsynth_sf_pitchwheel(int chan, float semitones)
 // of the range. So we would want a large range for a whammy
 // bar and small range for bend for precision.
 int gcsynth_sf_pitchrange(int chan, float pitch_range) 
+{
+    return gcsynth_sf_pitchrange_at(chan, pitch_range, 0.0);
+}
+
+int gcsynth_sf_pitchrange_at(int chan, float pitch_range, double when) 
 {
     int ret = -1;
     struct audio_thread* at = get_audio_thread(chan);
@@ -926,6 +1203,7 @@ int gcsynth_sf_pitchrange(int chan, float pitch_range)
             msg->ev_type = SF_PITCH_RANGE;
             msg->chan = chan;
             msg->pitch_range = pitch_range; 
+            msg->frame = frame_at(at, when);
 
             g_async_queue_push(at->queue, msg);
             ret = 0;
@@ -960,6 +1238,11 @@ void gcsynth_sf_reset()
 */
 void gcsynth_sf_shutdown() {
     int i;
+
+    if (Offline) {
+        // no render threads
+        return;
+    }
     for (i = 0; i < NumAudioThreads; i++) {
         struct audio_thread* at = &AudioThreads[i];
         pthread_mutex_lock(&at->state_mutex);
@@ -971,4 +1254,116 @@ void gcsynth_sf_shutdown() {
         struct audio_thread* at = &AudioThreads[i];
         pthread_join(at->thread, NULL);
     }
-}
\ No newline at end of file
+}
+
+
+/*
+    Offline rendering, the caller's thread does what the render threads 
+    and SDL do in real time. Every soundfont is rendered a block at a time
+    and mixed into one stream.
+*/
+int gcsynth_sf_render_offline(struct scheduled_event** events, int num_events,
+    double until, OfflineWriter writer, void* user_data)
+{
+    short pcm[OFFLINE_CHUNK_FRAMES * 2];
+    int chunk_frames = 0;
+    int ev_index = 0;
+    int a_thread, i;
+    uint64_t end_frame = (uint64_t) (until * SAMPLE_RATE);
+
+    if (!Offline) {
+        gcsynth_raise_exception("gcsynth_sf_render_offline: synth was not started offline");
+        return -1;
+    }
+
+    while (OfflineFrame < end_frame) {
+        float mix_left[AUDIO_SAMPLES];
+        float mix_right[AUDIO_SAMPLES];
+        uint64_t block_end = OfflineFrame + AUDIO_SAMPLES;
+
+        memset(mix_left, 0, sizeof(mix_left));
+        memset(mix_right, 0, sizeof(mix_right));
+
+        // events that start in this block, sample accurate ones are placed at 
+        // their frame by my_tsf_render_float.
+        while (ev_index < num_events && 
+            (uint64_t) (events[ev_index]->when * 0.001 * SAMPLE_RATE) < block_end) {
+            gcsynth_event_execute(events[ev_index], events[ev_index]->when * 0.001);
+            ev_index++;
+        }
+
+        for(a_thread = 0; a_thread < NumAudioThreads; a_thread++) {
+            struct audio_thread* at = &AudioThreads[a_thread];
+            float out_right[AUDIO_SAMPLES];
+            float out_left[AUDIO_SAMPLES];
+
+            proc_at_msgs(at);
+            // same argument order as audio_render
+            my_tsf_render_float(at, out_left, out_right, AUDIO_SAMPLES);
+            for(i = 0; i < AUDIO_SAMPLES; i++) {
+                mix_left[i] += out_left[i];
+                mix_right[i] += out_right[i];
+            }
+        }
+        OfflineFrame = block_end;
+
+        for(i = 0; i < AUDIO_SAMPLES; i++) {
+            float l = mix_left[i] * 32767.0f;
+            float r = mix_right[i] * 32767.0f;
+            pcm[(chunk_frames + i) * 2] = (short) (l > 32767.0f ? 32767 : (l < -32768.0f ? -32768 : l));
+            pcm[(chunk_frames + i) * 2 + 1] = (short) (r > 32767.0f ? 32767 : (r < -32768.0f ? -32768 : r));
+        }
+        chunk_frames += AUDIO_SAMPLES;
+
+        if (chunk_frames == OFFLINE_CHUNK_FRAMES) {
+            if (writer(user_data, pcm, chunk_frames) == -1) {
+                return -1;
+            }
+            chunk_frames = 0;
+        }
+    }
+
+    if (chunk_frames > 0 && writer(user_data, pcm, chunk_frames) == -1) {
+        return -1;
+    }
+
+    // events at or after 'until', the messages wait in each thread's 
+    // queue for the next call.
+    for(; ev_index < num_events; ev_index++) {
+        gcsynth_event_execute(events[ev_index], events[ev_index]->when * 0.001);
+    }
+
+    return 0;
+}
+
+int gcsynth_sf_render_offline_reset()
+{
+    int a_thread;
+
+    if (!Offline) {
+        gcsynth_raise_exception("gcsynth_sf_render_offline_reset: synth was not started offline");
+        return -1;
+    }
+
+    for(a_thread = 0; a_thread < NumAudioThreads; a_thread++) {
+        struct audio_thread* at = &AudioThreads[a_thread];
+        tsf* f = at->g_TinySoundFont;
+        struct tsf_voice *v = f->voices, *vEnd = v + f->voiceNum;
+
+        // drop anything left over from a previous render.
+        proc_at_msgs(at);
+        g_list_free_full(at->pending, free);
+        at->pending = NULL;
+        at->frames_rendered = 0;
+
+        // silence voices but keep the channel presets, unlike tsf_reset
+        for (; v != vEnd; v++) {
+            if (v->playingPreset != -1) {
+                tsf_voice_kill(v);
+            }
+        }
+    }
+    OfflineFrame = 0;
+
+    return 0;
+}
@@ -8,8 +8,14 @@
 
 typedef void (*AudioChannelFilter)(int channel, float* left, float* right, int samples);
 
-
-int gcsynth_sf_init(char* sf_file[], int num_fonts, AudioChannelFilter filter_func);
+// receives interleaved stereo 16 bit pcm from an offline render, return -1 to abort.
+typedef int (*OfflineWriter)(void* user_data, const short* pcm, int frames);
+
+// offline != 0 loads the soundfonts without opening audio devices or 
+// starting render threads.
+int gcsynth_sf_init(char* sf_file[], int num_fonts, AudioChannelFilter filter_func, int offline);
+// write data/sf_info/instruments.json, the presets of the fonts loaded by gcsynth_sf_init
+int gcsynth_sf_write_info(char* sf_file[], int num_fonts);
 void gcsynth_sf_shutdown();
 
 /**
@@ -25,7 +31,30 @@ int gcsynth_sf_noteoff(int chan, int midicode);
 int gcsynth_sf_pitchrange(int chan, float pitch_range);
 int gcsynth_sf_pitchwheel(int chan, float semitones);
 
+/*
+ * Timestamped versions, 'when' is a gcsynth_monotonic() time. The event
+ * is rendered at the sample frame for that time rather than at the start
+ * of the next audio block, 0.0 means as soon as possible.
+ */
+int gcsynth_sf_noteon_at(int chan, int midicode, int vel, double when);
+int gcsynth_sf_noteoff_at(int chan, int midicode, double when);
+int gcsynth_sf_pitchrange_at(int chan, float pitch_range, double when);
+int gcsynth_sf_pitchwheel_at(int chan, float semitones, double when);
+
 void gcsynth_sf_reset();
+
+struct scheduled_event;
+
+/*
+ * Offline rendering (gcsynth_sf_init with offline set). Renders from the
+ * current offline position up to 'until' seconds as fast as possible.
+ * events are sorted by 'when' in milliseconds from the start of the 
+ * render, events not reached by 'until' are queued for the next call. 
+ */
+int gcsynth_sf_render_offline(struct scheduled_event** events, int num_events,
+    double until, OfflineWriter writer, void* user_data);
+// rewind the offline position to 0 and silence all voices.
+int gcsynth_sf_render_offline_reset();
 int gcsynth_sf_extern_func(int chan, void (*callback)(void*), void* data);
 
 
@@ -0,0 +1,250 @@
+#include "gcsynth_sfcache.h"
+
+#include <errno.h>
+#include <fcntl.h>
+#include <limits.h>
+#include <pthread.h>
+#include <stdint.h>
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+#include <sys/mman.h>
+#include <sys/stat.h>
+#include <unistd.h>
+
+#define SFCACHE_MAGIC "GCSC"
+#define SFCACHE_VERSION 1
+// the samples start page aligned
+#define SFCACHE_HEADER_SIZE 4096
+#define SFCACHE_MAX_MAPPINGS 32
+
+struct sfcache_header {
+    char magic[4];
+    uint32_t version;
+    // identity of the soundfont the samples were converted from
+    uint64_t sf_size;
+    int64_t sf_mtime_sec;
+    int64_t sf_mtime_nsec;
+    uint32_t count;
+};
+
+struct sfcache_mapping {
+    char path[PATH_MAX];
+    void* base;
+    size_t length;
+    int refs;
+};
+
+static struct sfcache_mapping Mappings[SFCACHE_MAX_MAPPINGS];
+static pthread_mutex_t MappingsLock = PTHREAD_MUTEX_INITIALIZER;
+
+
+static int sfcache_path(const char* sf_file, char* path, size_t size)
+{
+    char* data_dir = getenv("GC_DATA_DIR");
+    const char* base = strrchr(sf_file, '/');
+    unsigned long hash = 5381;
+    const char* c;
+
+    if (data_dir == NULL) {
+        return -1;
+    }
+    base = base ? base + 1 : sf_file;
+    // fonts with the same name in different directories
+    for (c = sf_file; *c; c++) {
+        hash = hash * 33 + (unsigned char) *c;
+    }
+    if (snprintf(path, size, "%s/sf_cache/%s.%08lx.f32", data_dir, base, hash & 0xFFFFFFFFUL) >= (int) size) {
+        return -1;
+    }
+    return 0;
+}
+
+static void sfcache_header_init(struct sfcache_header* h, struct stat* st, unsigned int count)
+{
+    memset(h, 0, sizeof(*h));
+    memcpy(h->magic, SFCACHE_MAGIC, 4);
+    h->version = SFCACHE_VERSION;
+    h->sf_size = (uint64_t) st->st_size;
+    h->sf_mtime_sec = (int64_t) st->st_mtim.tv_sec;
+    h->sf_mtime_nsec = (int64_t) st->st_mtim.tv_nsec;
+    h->count = count;
+}
+
+// caller holds MappingsLock
+static struct sfcache_mapping* sfcache_find_path(const char* path)
+{
+    int i;
+    for (i = 0; i < SFCACHE_MAX_MAPPINGS; i++) {
+        if (Mappings[i].refs > 0 && strcmp(Mappings[i].path, path) == 0) {
+            return &Mappings[i];
+        }
+    }
+    return NULL;
+}
+
+static const float* sfcache_map(const char* path, struct sfcache_header* expected)
+{
+    struct sfcache_mapping* m;
+    struct sfcache_header h;
+    struct stat st;
+    size_t length = SFCACHE_HEADER_SIZE + (size_t) expected->count * sizeof(float);
+    void* base;
+    int fd, i;
+
+    pthread_mutex_lock(&MappingsLock);
+    m = sfcache_find_path(path);
+    if (m && memcmp(m->base, expected, sizeof(h)) == 0) {
+        // the same font loaded again, e.g. by another audio thread
+        m->refs++;
+        pthread_mutex_unlock(&MappingsLock);
+        return (const float*) ((char*) m->base + SFCACHE_HEADER_SIZE);
+    }
+    pthread_mutex_unlock(&MappingsLock);
+
+    if ((fd = open(path, O_RDONLY)) == -1) {
+        return NULL;
+    }
+    if (fstat(fd, &st) == -1 || (size_t) st.st_size != length ||
+        read(fd, &h, sizeof(h)) != sizeof(h) || memcmp(&h, expected, sizeof(h)) != 0) {
+        // stale, the soundfont changed
+        close(fd);
+        return NULL;
+    }
+    base = mmap(NULL, length, PROT_READ, MAP_SHARED, fd, 0);
+    close(fd);
+    if (base == MAP_FAILED) {
+        fprintf(stderr, "sfcache: unable to map %s: %s\n", path, strerror(errno));
+        return NULL;
+    }
+    // voices read the samples of one region at a time, read ahead of
+    // the whole file would defeat loading per preset. A selected preset
+    // is read ahead by sfcache_prefault.
+    madvise(base, length, MADV_RANDOM);
+
+    pthread_mutex_lock(&MappingsLock);
+    for (i = 0; i < SFCACHE_MAX_MAPPINGS; i++) {
+        if (Mappings[i].refs == 0) {
+            strncpy(Mappings[i].path, path, PATH_MAX - 1);
+            Mappings[i].base = base;
+            Mappings[i].length = length;
+            Mappings[i].refs = 1;
+            break;
+        }
+    }
+    pthread_mutex_unlock(&MappingsLock);
+    if (i == SFCACHE_MAX_MAPPINGS) {
+        fprintf(stderr, "sfcache: too many soundfonts mapped\n");
+        munmap(base, length);
+        return NULL;
+    }
+    return (const float*) ((char*) base + SFCACHE_HEADER_SIZE);
+}
+
+
+const float* sfcache_open(const char* sf_file, unsigned int count)
+{
+    char path[PATH_MAX];
+    struct sfcache_header h;
+    struct stat st;
+
+    if (stat(sf_file, &st) == -1 || sfcache_path(sf_file, path, sizeof(path)) == -1) {
+        return NULL;
+    }
+    sfcache_header_init(&h, &st, count);
+    return sfcache_map(path, &h);
+}
+
+
+const float* sfcache_store(const char* sf_file, const float* samples, unsigned int count)
+{
+    char path[PATH_MAX];
+    char tmp[PATH_MAX + 32];
+    char header[SFCACHE_HEADER_SIZE];
+    struct sfcache_header h;
+    struct stat st;
+    size_t length = (size_t) count * sizeof(float);
+    FILE* fptr;
+    char* dir;
+    int ok;
+
+    if (stat(sf_file, &st) == -1 || sfcache_path(sf_file, path, sizeof(path)) == -1) {
+        return NULL;
+    }
+    dir = strdup(path);
+    *strrchr(dir, '/') = '\0';
+    mkdir(dir, 0755);
+    free(dir);
+
+    sfcache_header_init(&h, &st, count);
+    memset(header, 0, sizeof(header));
+    memcpy(header, &h, sizeof(h));
+
+    // written aside and renamed, another process may be mapping it
+    snprintf(tmp, sizeof(tmp), "%s.%d.tmp", path, (int) getpid());
+    if ((fptr = fopen(tmp, "wb")) == NULL) {
+        fprintf(stderr, "sfcache: unable to write %s: %s\n", tmp, strerror(errno));
+        return NULL;
+    }
+    ok = fwrite(header, 1, sizeof(header), fptr) == sizeof(header) &&
+         fwrite(samples, 1, length, fptr) == length;
+    ok = (fclose(fptr) == 0) && ok;
+    if (!ok || rename(tmp, path) == -1) {
+        fprintf(stderr, "sfcache: unable to write %s: %s\n", path, strerror(errno));
+        unlink(tmp);
+        return NULL;
+    }
+    return sfcache_map(path, &h);
+}
+
+
+void sfcache_prefault(const float* samples, unsigned int start, unsigned int end)
+{
+    long page = sysconf(_SC_PAGESIZE);
+    uintptr_t first, last;
+    int i, mapped = 0;
+
+    if (end <= start) {
+        return;
+    }
+    pthread_mutex_lock(&MappingsLock);
+    for (i = 0; i < SFCACHE_MAX_MAPPINGS; i++) {
+        char* data = (char*) Mappings[i].base + SFCACHE_HEADER_SIZE;
+        if (Mappings[i].refs > 0 && (const char*) samples == data) {
+            mapped = 1;
+            break;
+        }
+    }
+    pthread_mutex_unlock(&MappingsLock);
+    if (!mapped) {
+        return;
+    }
+
+    // asynchronous read ahead, the caller isn't held up by the disk
+    first = (uintptr_t) (samples + start) & ~((uintptr_t) page - 1);
+    last = (uintptr_t) (samples + end);
+    if (madvise((void*) first, last - first, MADV_WILLNEED) == -1) {
+        fprintf(stderr, "sfcache: prefault failed: %s\n", strerror(errno));
+    }
+}
+
+
+int sfcache_release(const float* samples)
+{
+    void* base = (char*) samples - SFCACHE_HEADER_SIZE;
+    int i, found = 0;
+
+    pthread_mutex_lock(&MappingsLock);
+    for (i = 0; i < SFCACHE_MAX_MAPPINGS; i++) {
+        if (Mappings[i].refs > 0 && Mappings[i].base == base) {
+            if (--Mappings[i].refs == 0) {
+                munmap(Mappings[i].base, Mappings[i].length);
+                Mappings[i].base = NULL;
+            }
+            found = 1;
+            break;
+        }
+    }
+    pthread_mutex_unlock(&MappingsLock);
+    return found;
+}
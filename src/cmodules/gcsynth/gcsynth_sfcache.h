@@ -0,0 +1,39 @@
+#ifndef __GCSYNTH_SFCACHE_H
+#define __GCSYNTH_SFCACHE_H
+
+/*
+Soundfont sample cache.
+
+tsf converts the 16 bit samples of a soundfont to floats on the heap,
+for a large bank that is hundreds of MB per process, all converted before
+the first note. Instead the converted samples are written once to
+$GC_DATA_DIR/sf_cache and mapped read only from then on:
+
+  - pages are read from disk when a preset's samples are first played.
+  - the pages are shared by every mapping of the file, the audio threads
+    and any other process (offline renders) that loads the same font.
+  - clean file backed pages, the kernel can drop them under memory
+    pressure instead of swapping.
+
+The cache file is a header with the size and mtime of the soundfont and
+the sample count followed by the floats, a changed soundfont rewrites it.
+*/
+
+// the converted samples of sf_file mapped from the cache, NULL if there
+// is no up to date cache file.
+const float* sfcache_open(const char* sf_file, unsigned int count);
+
+// write the converted samples of sf_file to the cache and map them,
+// returns NULL if the cache can't be written (caller keeps 'samples').
+const float* sfcache_store(const char* sf_file, const float* samples, unsigned int count);
+
+// start reading samples[start, end) of a mapped cache into memory, 
+// called when a preset is selected so its first note doesn't wait on 
+// the disk in the render thread. Does nothing for samples on the heap.
+void sfcache_prefault(const float* samples, unsigned int start, unsigned int end);
+
+// release samples returned by sfcache_open/sfcache_store, returns 0 if
+// they weren't mapped by the cache.
+int sfcache_release(const float* samples);
+
+#endif
@@ -23,10 +23,16 @@ void gcsynth_start(struct gcsynth* gcSynth)
     }
 
     // new synth
-    if (gcsynth_sf_init(cfg->sfpaths, cfg->num_sfpaths, synth_filter_router)) {
+    if (gcsynth_sf_init(cfg->sfpaths, cfg->num_sfpaths, synth_filter_router, cfg->offline)) {
         RAISE("unable to launch synth")
     }
 
+    // the preset list of every font, skipped when the python side 
+    // has it cached for these files (see instrument_info.load_cache)
+    if (cfg->sf_info && gcsynth_sf_write_info(cfg->sfpaths, cfg->num_sfpaths)) {
+        RAISE("unable to write the soundfont instrument info")
+    }
+
     gcsynth_sequencer_setup(gcSynth);
 }
 
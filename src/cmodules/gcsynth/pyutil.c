@@ -65,6 +65,18 @@ float get_dict_flt_field(PyObject* dict, const char*key, float defval)
     return result;     
 }
 
+double get_dict_dbl_field(PyObject* dict, const char*key, double defval)
+{
+    PyObject* dict_field = NULL;
+    double result = defval;
+
+    if ((dict_field = PyDict_GetItemString(dict, key)) != NULL) {
+        result = PyFloat_AsDouble(dict_field);
+    }
+
+    return result;     
+}
+
 /*
 struct scheduled_event {
     unsigned int when;
@@ -92,7 +104,7 @@ static unsigned long EventIdCounter = 0;
 static void print_event(struct scheduled_event* ev) {
     printf("scheduled_event:\n");
     if (ev) {
-        printf("\nev_type = %d, ev_channel = %d, when=%d \n",
+        printf("\nev_type = %d, ev_channel = %d, when=%f \n",
             ev->ev_type, ev->channel, ev->when
         ); 
     } else {
@@ -108,10 +120,13 @@ struct scheduled_event* event_from_pydata(PyObject* dict)
 
     if (ev) {
         ev->ev_type = get_dict_int_field(dict,"ev_type",-1);        
-        if ((ev->channel = get_dict_int_field(dict,"channel",-1)) == -1) {
+        if ((ev->channel = get_dict_int_field(dict,"channel",-1)) == -1 &&
+            ev->ev_type != EV_PROGRESS) {
             errmsg = "event_from_pydata: channel is required ";    
         }
-        ev->when = get_dict_int_field(dict,"when", 0);
+        // fractions of a millisecond are allowed.
+        ev->when = get_dict_dbl_field(dict,"when", 0.0);
+        ev->group = get_dict_int_field(dict,"group", 0);
         ev->event_id = EventIdCounter++;
 
         switch(ev->ev_type)
@@ -185,6 +200,14 @@ struct scheduled_event* event_from_pydata(PyObject* dict)
                 ev->pitch_change = get_dict_flt_field(dict,"pitch_change",0.0);
                 break;      
 
+            case EV_PITCH_RANGE:
+                ev->pitch_range = get_dict_flt_field(dict,"pitch_range",2.0);
+                break;
+
+            case EV_PROGRESS:
+                ev->token = get_dict_int_field(dict,"token",0);
+                break;
+
             default:
                 errmsg = "event_from_pydata: Invalid type";
                 break;
@@ -196,7 +219,7 @@ struct scheduled_event* event_from_pydata(PyObject* dict)
         print_event(ev);
         gcsynth_raise_exception(errmsg);
         if (ev) {
-            free(ev);
+            scheduled_event_free(ev);
             ev = NULL;
         }
     }
@@ -8,6 +8,7 @@
 const char *get_dict_str_field(PyObject* dict, const char*key, const char* defval);
 long        get_dict_int_field(PyObject* dict, const char*key, long defval);
 float       get_dict_flt_field(PyObject* dict, const char*key, float defval);
+double      get_dict_dbl_field(PyObject* dict, const char*key, double defval);
 
 struct scheduled_event* event_from_pydata(PyObject* dict);
 
@@ -36,19 +36,19 @@ CSOURCES = [
     'gcsynth_event.c',
     'pyutil.c',
     'gcsynth_sf.c',
+    'gcsynth_sfcache.c',
     'gcsynth_acapture.c',
     'ringbuffer.c',
     'repeater_loop.c',
     'fgraph/freqdomain.c',
 #    'fgraph/demuxer.c',
 #    'fgraph/muxer.c',
-    'fgraph/mixer.c',
-    'fgraph/splitter.c',
     'fgraph/effect.c',
     'fgraph/gainbalance.c',
     'fgraph/bandpass.c',
     'fgraph/fgraph.c',
     'fgraph/fgrun.c',
+    'fgraph/params.c',
     'fgraph/py_graph_api.c'
 ]
 
@@ -13,6 +13,7 @@
    [OPTIONAL] #define TSF_MALLOC, TSF_REALLOC, and TSF_FREE to avoid stdlib.h
    [OPTIONAL] #define TSF_MEMCPY, TSF_MEMSET to avoid string.h
    [OPTIONAL] #define TSF_POW, TSF_POWF, TSF_EXPF, TSF_LOG, TSF_TAN, TSF_LOG10, TSF_SQRT to avoid math.h
+   [OPTIONAL] #define TSF_LOAD_SAMPLES and TSF_FREE_SAMPLES to provide the sample buffer (gcsynth: mapped from a cache)
 
    NOT YET IMPLEMENTED
      - Support for ChorusEffectsSend and ReverbEffectsSend generators
@@ -281,6 +282,11 @@ TSFDEF float tsf_channel_get_tuning(tsf* f, int channel);
 #  define TSF_REALLOC realloc
 #endif
 
+#if !defined(TSF_LOAD_SAMPLES) || !defined(TSF_FREE_SAMPLES)
+#  define TSF_LOAD_SAMPLES tsf_load_samples
+#  define TSF_FREE_SAMPLES TSF_FREE
+#endif
+
 #if !defined(TSF_MEMCPY) || !defined(TSF_MEMSET)
 #  include <string.h>
 #  define TSF_MEMCPY  memcpy
@@ -1411,7 +1417,7 @@ TSFDEF tsf* tsf_load(struct tsf_stream* stream)
 						#endif
 					) && !rawBuffer && !floatBuffer && chunk.size >= sizeof(short))
 				{
-					if (!tsf_load_samples(&rawBuffer, &floatBuffer, &smplCount, &chunk, stream)) goto out_of_memory;
+					if (!TSF_LOAD_SAMPLES(&rawBuffer, &floatBuffer, &smplCount, &chunk, stream)) goto out_of_memory;
 				}
 				else stream->skip(stream->data, chunk.size);
 			}
@@ -1448,7 +1454,7 @@ TSFDEF tsf* tsf_load(struct tsf_stream* stream)
 	TSF_FREE(hydra.phdrs); TSF_FREE(hydra.pbags); TSF_FREE(hydra.pmods);
 	TSF_FREE(hydra.pgens); TSF_FREE(hydra.insts); TSF_FREE(hydra.ibags);
 	TSF_FREE(hydra.imods); TSF_FREE(hydra.igens); TSF_FREE(hydra.shdrs);
-	TSF_FREE(rawBuffer);   TSF_FREE(floatBuffer);
+	TSF_FREE(rawBuffer);   TSF_FREE_SAMPLES(floatBuffer);
 	return res;
 }
 
@@ -1480,7 +1486,7 @@ TSFDEF void tsf_close(tsf* f)
 		struct tsf_preset *preset = f->presets, *presetEnd = preset + f->presetNum;
 		for (; preset != presetEnd; preset++) TSF_FREE(preset->regions);
 		TSF_FREE(f->presets);
-		TSF_FREE(f->fontSamples);
+		TSF_FREE_SAMPLES(f->fontSamples);
 		TSF_FREE(f->refCount);
 	}
 	TSF_FREE(f->channels);
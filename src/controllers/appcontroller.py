@@ -17,6 +17,7 @@ from models.song import Song
 from models.track import Track
 from view.events import Signals, StringBendEvent
 from services.projectMngr import ProjectManager
+from services.effectRepo import EffectRepository
 from music.instrument import Instrument
 from view.config import LabelText
 
@@ -121,7 +122,9 @@ class SongController:
         root = SongItem(self.song.title)
         root.setData(self.song)
 
-        for track in self.song.tracks:
+        # names come from the project header, tracks are loaded when
+        # they are selected.
+        for track in self.song.track_entries():
             self.addQTrackModel(track, root)
 
         self.q_model = root
@@ -307,6 +310,10 @@ class AppController:
 
         self.update_navigator()
 
+        # the UI is up, look for ladspa plugins installed or updated
+        # since the last run (startup used the cached scan)
+        EffectRepository().scan_in_background()
+
     def on_load_settings(self, settings: QSettings):
         if settings.contains(self.settings_key):
             val = settings.value(self.settings_key)
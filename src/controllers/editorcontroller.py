@@ -223,6 +223,7 @@ class EditorController:
                     if sum_d == evt.dur_change:
                         for n_te in rem_list:
                             m.tab_events.remove(n_te)    
+                        tmodel.invalidate_time_index(m)
                         tedit.model_updated() # type: ignore
                         break
 
@@ -244,6 +245,7 @@ class EditorController:
         if tmodel and tedit:
             te, _ = tmodel.current_moment()
             te.fret[te.string] = evt.midi_drum_code
+            te.touch()
             tedit.current_tab_event_updated()
             tedit.setFocus()
 
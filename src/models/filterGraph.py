@@ -39,6 +39,10 @@ class GraphConnection:
         "Is this connection in use?"
         return self.in_uuid != "" and self.out_uuid != ""
 
+    def endpoints(self) -> Tuple[str, int, str, int]:
+        "The ports it connects, what gcsynth knows of it."
+        return (self.in_uuid, self.in_idx, self.out_uuid, self.out_idx)
+
     def pretty_print(self, graph: 'FilterGraph', indent = ""):
         in_node = graph.nodes.get(self.in_uuid)
         out_node = graph.nodes.get(self.out_uuid)
@@ -74,37 +78,18 @@ class GraphNode:
             port.pretty_print(fg, indent=indent+"    ")
         
         
-    def changed(self, other):
+    def settings(self) -> dict:
+        """
+        The values gcsynth runs the node with, not how it is drawn. 
+        Derived classes add theirs.
+        """
+        return {}
 
-        def non_presentation_data(obj : GraphNode):
-            p = {
-                'in_port_data': [],
-                'out_port_data': [],
-                'properties': []
-            }
-            for port in obj.in_ports:
-                port_data = vars(port)
-                del port_data['uuid']
-                port_data = {}
-                p['in_port_data'].append(port_data)
-            for port in obj.out_ports:
-                port_data = vars(port)
-                del port_data['uuid']
-                p['out_port_data'].append(port_data)
-            if hasattr(obj, 'properties'):
-                p['properties'] = getattr(obj,'properties')
-            if hasattr(obj,'enabled'):
-                p['enabled'] = getattr(obj,'enabled')
-            if hasattr(obj,'threshold'):
-                p['threshold'] = getattr(obj,'threshold')
-            if hasattr(obj,'low_threshold'):
-                p['low_threshold'] = getattr(obj,'low_threshold')
-            if hasattr(obj,'high_threshold'):
-                p['high_threshold'] = getattr(obj,'high_threshold')
-
-            return p
-        
-        return non_presentation_data(self) != non_presentation_data(other)
+    def changed(self, other):
+        if self.__class__ is not other.__class__ or self.settings() != other.settings():
+            return True
+        return [c.endpoints() for c in self.in_ports] != [c.endpoints() for c in other.in_ports] or \
+            [c.endpoints() for c in self.out_ports] != [c.endpoints() for c in other.out_ports]
 
 
     def num_in_ports(self) -> int:
@@ -212,6 +197,9 @@ class EffectNode(GraphNode):
     def get_effect(self) -> Effect:
         return self.effect    
 
+    def settings(self) -> dict:
+        return {'properties': self.properties, 'enabled': self.enabled}
+
     def __init__(self, effect : Effect):
         super().__init__()
         self.properties : Dict[str, float] = {}
@@ -232,6 +220,9 @@ class LowPassNode(GraphNode):
     def label(self) -> str:
         return "LowPass"
 
+    def settings(self) -> dict:
+        return {'threshold': self.threshold}
+
     def __init__(self):
         super().__init__()
         self.threshold = 261.63 # middle c in standard tuning
@@ -247,6 +238,9 @@ class HighPassNode(GraphNode):
     def label(self) -> str:
         return "HighPass"
 
+    def settings(self) -> dict:
+        return {'threshold': self.threshold}
+
     def __init__(self):
         super().__init__()
         self.threshold = 261.63 # middle c in standard tuning
@@ -260,6 +254,9 @@ class BandPassNode(GraphNode):
     def label(self) -> str:
         return "BandPass"
 
+    def settings(self) -> dict:
+        return {'low_threshold': self.low_threshold, 'high_threshold': self.high_threshold}
+
     def __init__(self):
         super().__init__()
         self.low_threshold = 200.0
@@ -275,6 +272,9 @@ class GainBalanceNode(GraphNode):
     def label(self) -> str:
         return "GainBalance"
 
+    def settings(self) -> dict:
+        return {'gain': self.gain, 'balance': self.balance}
+
     def __init__(self):
         super().__init__()
         self.gain = 1.0
@@ -403,6 +403,8 @@ class FilterGraph:
             "nodes_added": [],
             "nodes_removed": [],
             "nodes_updated": [],
+            "connections_added": [],
+            "connections_removed": [],
             "change_occured": False
         }
 
@@ -422,8 +424,21 @@ class FilterGraph:
             if uuid not in self.nodes:
                 report["nodes_removed"].append(node)
 
-        report['change_occured'] = len(report['nodes_added']) > 0 or \
-            len(report['nodes_removed']) > 0 or len(report['nodes_updated']) > 0
+        for (uuid, conn) in self.connections.items():
+            other_conn = past_node.connections.get(uuid)
+            if other_conn is None:
+                report["connections_added"].append(conn)
+            elif conn.endpoints() != other_conn.endpoints():
+                # rewired, gcsynth has no move
+                report["connections_removed"].append(other_conn)
+                report["connections_added"].append(conn)
+
+        for (uuid, conn) in past_node.connections.items():
+            if uuid not in self.connections:
+                report["connections_removed"].append(conn)
+
+        report['change_occured'] = any(len(report[k]) > 0 for k in 
+            ("nodes_added", "nodes_removed", "nodes_updated", "connections_added", "connections_removed"))
 
         return report
         
@@ -4,6 +4,7 @@ from typing import List, Tuple
 from music.durationtypes import (WHOLE, 
         HALF, QUARTER, SIXTEENTH, THIRTYSECOND, SIXTYFORTH)
 from models.effect import Effects 
+from models.revision import Revisioned
 import logging
 import math
 import uuid
@@ -76,8 +77,22 @@ TupletTypes[13] = ("tridecuplet", 4)
 
 TUPLET_DISABLED = -1
 
-class TabEvent:
+class TabEvent(Revisioned):
     BEND_PERIODS = 13
+    # cursor and layout, see Revisioned
+    UNTRACKED = frozenset(('string', 'note_ypos'))
+    # what TabEvent.beats depends on, assigning them moves every later
+    # moment of the track, see Track.moment_at_time
+    BEAT_FIELDS = frozenset(('duration', 'dotted', 'double_dotted', 'tuplet_code'))
+
+    def __setattr__(self, name, value):
+        super().__setattr__(name, value)
+        if name in self.BEAT_FIELDS:
+            # weakref to the measure, set by the track when it indexes it
+            owner = self.__dict__.get('_owner')
+            measure = owner() if owner else None
+            if measure is not None:
+                measure._beats_changed()
 
     REST = 0
     NOTE = 1
@@ -106,6 +121,12 @@ class TabEvent:
                     break
         return result
         
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.pop('_rev', None)
+        state.pop('_owner', None)
+        return state
+
     def __setstate__(self, state):
         # support migration
         self.__dict__.update(state)
@@ -130,6 +151,7 @@ class TabEvent:
             self.tied_notes[self.string] = False
         else:
             self.tied_notes[self.string] = True
+        self.touch()
 
     def clone(self):
         r = copy.deepcopy(self)
@@ -247,7 +269,90 @@ class TabEvent:
 
 
 
-class Measure:
+class Measure(Revisioned):
+    # timesig, bpm and key are properties so the track that owns this
+    # measure can invalidate its cached measure params, see
+    # Track.getMeasureParams
+    PARAM_FIELDS = ('timesig', 'bpm', 'key')
+    # cursor and derived state, see Revisioned
+    UNTRACKED = frozenset(('current_tab_event', 'beat_error_msg'))
+
+    def _track(self):
+        owner = self.__dict__.get('_owner')
+        return owner() if owner else None
+
+    def _param_changed(self):
+        track = self._track()
+        if track is not None:
+            track.invalidate_measure_params(self)
+
+    def _beats_changed(self):
+        track = self._track()
+        if track is not None:
+            track.invalidate_time_index(self)
+
+    def _tab_events_changed(self):
+        # beat/time offsets of this measure onward are stale, see 
+        # Track.moment_at_time
+        self.touch()
+        track = self._track()
+        if track is not None:
+            track.invalidate_time_index(self)
+
+    @property
+    def tab_events(self) -> List[TabEvent]:
+        return self._tab_events
+
+    @tab_events.setter
+    def tab_events(self, value: List[TabEvent]):
+        self._tab_events = value
+        self._tab_events_changed()
+
+    @property
+    def timesig(self) -> 'TimeSig | None':
+        return self._timesig
+
+    @timesig.setter
+    def timesig(self, value: 'TimeSig | None'):
+        self._timesig = value
+        self._param_changed()
+
+    @property
+    def bpm(self):
+        return self._bpm
+
+    @bpm.setter
+    def bpm(self, value):
+        self._bpm = value
+        self._param_changed()
+
+    @property
+    def key(self):
+        return self._key
+
+    @key.setter
+    def key(self, value):
+        self._key = value
+        self._param_changed()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        # weakref to the owning track, re-established by the track.
+        state.pop('_owner', None)
+        state.pop('_rev', None)
+        return state
+
+    def revision(self) -> int:
+        "stamp of the last change to this measure or its tab events"
+        return max([self._rev] + [te._rev for te in self.tab_events])
+
+    def __setstate__(self, state):
+        # support migration, these used to be plain attributes
+        for name in self.PARAM_FIELDS + ('tab_events',):
+            if name in state:
+                state['_' + name] = state.pop(name)
+        self.__dict__.update(state)
+
     def __init__(self, **kwargs):
         # a list of tab events in the order they are in the staff
 
@@ -280,14 +385,17 @@ class Measure:
 
     def remove_current(self):
         del self.tab_events[self.current_tab_event]
+        self._tab_events_changed()
         self.current_tab_event = self.current_tab_event % len(self.tab_events)        
 
     def append(self, tab_event : TabEvent):
         self.tab_events.append(tab_event)        
+        self._tab_events_changed()
 
     def delete(self, i : int):
         if i >= 0 and i < len(self.tab_events):
             del self.tab_events[i]
+            self._tab_events_changed()
 
     def set_timespec(self, timespec : TimeSig):
         self.timesig = timespec
@@ -0,0 +1,48 @@
+"""
+Modification stamps for the song model.
+
+Every tracked change of a Track, Measure or TabEvent stamps the object
+with the next value of a process wide counter. Anything that caches work
+derived from the model (undo capture, autosave, rendering) remembers the
+revision it last saw and can tell in O(1), model_revision(), whether
+anything changed since, then find what changed by comparing stamps.
+
+Attribute assignment is tracked automatically, in place changes of a list
+attribute (te.fret[i] = n) need an explicit touch().
+"""
+import itertools
+
+_revisions = itertools.count(1)
+_revision = 0
+
+
+def next_revision() -> int:
+    global _revision
+    _revision = next(_revisions)
+    return _revision
+
+
+def model_revision() -> int:
+    "the last revision handed out"
+    return _revision
+
+
+class Revisioned:
+    # attributes that are editor state (cursors) or derived from the
+    # model, assigning them is not an edit.
+    UNTRACKED = frozenset()
+
+    # stamp of the last change, not pickled
+    _rev = 0
+
+    def __setattr__(self, name, value):
+        object.__setattr__(self, name, value)
+        if name[0] != '_' and name not in self.UNTRACKED:
+            object.__setattr__(self, '_rev', next_revision())
+
+    def touch(self):
+        "mark as changed, needed after changing a list attribute in place"
+        object.__setattr__(self, '_rev', next_revision())
+
+    def modified_since(self, revision: int) -> bool:
+        return self._rev > revision
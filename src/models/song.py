@@ -1,10 +1,88 @@
-
-
 from typing import List
 from models.track import Track
 import uuid
 
 
+class TrackStub:
+    """
+    A track of a saved song that hasn't been loaded yet, see TrackList.
+    What the project navigator shows is available without loading the
+    measures. 'source' is the open project file (see
+    services.projectFormat.project_reader), 'index' the track section.
+    """
+    def __init__(self, info: dict, source, index: int):
+        self.track_edit_id = info.get("track_edit_id", "")
+        self.instrument_name = info.get("instrument_name", "")
+        self.tuning = info.get("tuning", [])
+        self.drum_track = info.get("drum_track", False)
+        self.measure_count = info.get("measures", 0)
+        self.source = source
+        self.index = index
+        # the loaded track
+        self.track: Track | None = None
+
+    def load(self) -> Track:
+        if self.track is None:
+            self.track = self.source.load(self.index)
+        return self.track
+
+
+def load_track(entry: 'Track | TrackStub') -> Track:
+    "the track of a Song.track_entries() entry, loaded if needed"
+    if isinstance(entry, TrackStub):
+        return entry.load()
+    return entry
+
+
+class TrackList(list):
+    """
+    Tracks of a song opened from a project file. Entries start out as
+    a TrackStub and are replaced by the Track the first time they are
+    accessed, so song.tracks[i] is always a Track. Iterating loads every
+    track, use entries() to look at them without loading.
+    """
+    def _load(self, i: int) -> Track:
+        entry = list.__getitem__(self, i)
+        if isinstance(entry, TrackStub):
+            entry = entry.load()
+            list.__setitem__(self, i, entry)
+        return entry
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self._load(j) for j in range(*i.indices(len(self)))]
+        return self._load(i)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self._load(i)
+
+    def index(self, track) -> int:
+        # the track may have been loaded through its stub, see load_track
+        for (i, entry) in enumerate(list.__iter__(self)):
+            if entry is track or \
+                (isinstance(entry, TrackStub) and entry.track is track):
+                return i
+        raise ValueError(f"{track} is not in the track list")
+
+    def __contains__(self, track) -> bool:
+        try:
+            self.index(track)
+            return True
+        except ValueError:
+            return False
+
+    def entries(self) -> List['Track | TrackStub']:
+        return list(list.__iter__(self))
+
+    def is_loaded(self, i: int) -> bool:
+        return not isinstance(list.__getitem__(self, i), TrackStub)
+
+    def __reduce_ex__(self, protocol):
+        # copies/pickles hold loaded tracks, stubs refer to an open file
+        return (TrackList, (list(self),))
+
+
 class Song:
     def __init__(self):
         # instrument name -> list of measures
@@ -14,3 +92,9 @@ class Song:
         self.author = ""
         self.poly_rythm_tracks = False
         self.filename = ""
+
+    def track_entries(self) -> List['Track | TrackStub']:
+        "the tracks, not loading the ones that haven't been yet"
+        if isinstance(self.tracks, TrackList):
+            return self.tracks.entries()
+        return list(self.tracks)
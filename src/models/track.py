@@ -1,9 +1,12 @@
+import bisect
 import copy
 import uuid
+import weakref
 
 from models.measure import TUPLET_DISABLED, Measure, TimeSig, TabEvent 
 from typing import Callable, List, Optional, Tuple
 from models.effect import Effects
+from models.revision import Revisioned, model_revision
 from music.constants import Dynamic
 from music.durationtypes import QUARTER
 from services.effectRepo import EffectRepository
@@ -44,8 +47,10 @@ class MomentCursor:
     
 
 
-class Track:
+class Track(Revisioned):
     FIRST_NOTE_COLUMN = 2
+    # cursor, see Revisioned
+    UNTRACKED = frozenset(('current_measure',))
 
     def blank_measure(self, **kwargs):
         """
@@ -75,6 +80,7 @@ class Track:
                 for te in new_m.tab_events:
                     te.fret = [-1] * te.num_gstrings
                 self.measures.append(new_m)    
+                self.touch()
     
     def _reassemble(self, teList: List[TabEvent], ts: TimeSig, m_num: int):
         """
@@ -98,20 +104,27 @@ class Track:
                 else:
                     m = Measure(measure_number=m_num+1)
                     self.measures.append(m)
+                    self.touch()
                     self.measures[m_num].tab_events = [te.clone()]
 
     def remove_tab_events(self, remList: List[TabEvent]):
         if len(remList) == 0: return 
 
         uids = set([te.uuid for te in remList])
+        # measures before the first one with a removed tab event are 
+        # left as is.
+        m_num = 0
+        while m_num < len(self.measures)-1 and \
+            not any(te.uuid in uids for te in self.measures[m_num].tab_events):
+            m_num += 1
+
         teList = []
-        for m in self.measures:
+        for m in self.measures[m_num:]:
             for te in m.tab_events:
                 if te.uuid not in uids:
                     teList.append(te)
 
-        ts, _, _, _ = self.getMeasureParams(self.measures[0])
-        m_num = 0
+        ts, _, _, _ = self.getMeasureParams(self.measures[m_num])
         self._reassemble(teList, ts, m_num)
 
         # re-assign current measure, tab if needed.
@@ -248,32 +261,236 @@ class Track:
         self._reassemble(teList, ts, m_num)
 
     def getMeasureParams(self, m : Measure) -> Tuple[TimeSig, int, str, str]:
-        ts = self.measures[0].timesig
-        bpm = self.measures[0].bpm
-        key = self.measures[0].key
-        cleff = self.cleff 
-        for measure in self.measures[1:]:
-            if measure is m:
-                break
-            if measure.timesig:
-                ts = measure.timesig 
-            if measure.bpm:
-                bpm = measure.bpm
-            if measure.key:
-                key = measure.key
+        """
+        Effective (timesig, bpm, key, cleff) for measure m, a measure inherits
+        whatever it doesn't set from the measures before it. 
+
+        Results are kept in a per track index so this is O(1) for repeated
+        calls. Changing timesig/bpm/key of a measure invalidates the index 
+        from that measure onward, see Measure._param_changed. Measures added,
+        removed or moved are detected by position.
+        """
+        idx = self._measure_pos.get(id(m))
+        if idx is None or idx >= len(self.measures) or self.measures[idx] is not m:
+            self._index_measures()
+            # a measure not in the track gets the params in effect at the end.
+            idx = self._measure_pos.get(id(m), len(self.measures) - 1)
+
+        params = self._measure_params
+        while self._params_valid <= idx:
+            i = self._params_valid
+            measure = self.measures[i]
+            if i == 0:
+                (ts, bpm, key) = (measure.timesig, measure.bpm, measure.key)
+            else:
+                (ts, bpm, key) = params[i-1]
+                ts = measure.timesig or ts
+                bpm = measure.bpm or bpm
+                key = measure.key or key
+            if i < len(params):
+                params[i] = (ts, bpm, key)
+            else:
+                params.append((ts, bpm, key))
+            self._params_valid += 1
+
+        (ts, bpm, key) = params[idx]
         assert(ts)
         assert(bpm)
         assert(key)        
-        return (ts, bpm, key, cleff)
+        return (ts, bpm, key, self.cleff)
+
+    def invalidate_measure_params(self, m : Measure | None = None):
+        "m's params changed, None if unknown"
+        idx = self._measure_pos.get(id(m), 0) if m is not None else 0
+        if idx < self._params_valid:
+            self._params_valid = idx
+        # a bpm or time signature change moves everything after it.
+        self.invalidate_time_index(m)
+
+    def _index_measures(self):
+        """
+        The measure list changed, params are kept for the measures up to 
+        the first one that moved.
+        """
+        indexed = self._indexed_measures
+        n = min(len(indexed), len(self.measures))
+        first_change = 0
+        while first_change < n and indexed[first_change] is self.measures[first_change]:
+            first_change += 1
+        self._params_valid = min(self._params_valid, first_change)
+        del self._measure_params[len(self.measures):]
+        self._truncate_time_index(first_change)
+
+        owner = weakref.ref(self)
+        self._measure_pos = {}
+        for (i, measure) in enumerate(self.measures):
+            self._measure_pos[id(measure)] = i
+            measure._owner = owner
+        self._indexed_measures = list(self.measures)
+
+    def modified_since(self, revision: int) -> bool:
+        """
+        True if the track, its measures or their tab events changed after 
+        'revision' (see models.revision). O(1) when nothing in the model 
+        changed at all.
+        """
+        if model_revision() <= revision:
+            return False
+        return self._rev > revision or \
+            any(m.revision() > revision for m in self.measures)
+
+    def measures_changed(self):
+        "measures were replaced in place (e.g. undo), re-index them"
+        self._index_measures()
+
+    def _init_measure_params(self):
+        # see getMeasureParams
+        self._measure_pos = {}
+        self._indexed_measures = []
+        self._measure_params = []
+        self._params_valid = 0
+        self._init_time_index()
+
+    # cumulative beat/time index
+    #
+    # For each measure the absolute start (beats and seconds from the 
+    # start of the track) of every tab event, built lazily from the first
+    # measure up. Edits invalidate the index from the edited measure onward
+    # so only the tail is recomputed. Beats are counted in the beat unit 
+    # of each measure's time signature (see TabEvent.beats), seconds follow
+    # the bpm of each measure. Positions are in score order, repeats are 
+    # not expanded.
+
+    def _init_time_index(self):
+        # _measure_beats[i] / _measure_secs[i] start of measure i, the entry
+        # after the last valid measure is where it ends.
+        self._time_valid = 0
+        self._measure_beats = [0.0]
+        self._measure_secs = [0.0]
+        # absolute start of each tab event, per measure
+        self._te_beats = []
+        self._te_secs = []
+
+    def _truncate_time_index(self, idx: int):
+        if idx < self._time_valid:
+            self._time_valid = idx
+            del self._measure_beats[idx+1:]
+            del self._measure_secs[idx+1:]
+            del self._te_beats[idx:]
+            del self._te_secs[idx:]
+
+    def invalidate_time_index(self, m : Measure | None = None):
+        """
+        Tab events of m were added, removed or had their duration changed,
+        None if unknown.
+        """
+        idx = self._measure_pos.get(id(m), 0) if m is not None else 0
+        self._truncate_time_index(idx)
+
+    def _check_measures(self):
+        """
+        cheap check for measures added or removed since the last index. 
+        Duration edits of tab events invalidate the index themselves.
+        """
+        indexed = self._indexed_measures
+        if len(indexed) != len(self.measures) or \
+            (len(indexed) > 0 and indexed[-1] is not self.measures[-1]):
+            self._index_measures()
+
+    def _extend_time_index(self, upto: int):
+        "make sure offsets are valid for measures [0, upto)"
+        upto = min(upto, len(self.measures))
+        while self._time_valid < upto:
+            i = self._time_valid
+            m = self.measures[i]
+            (ts, bpm, _, _) = self.getMeasureParams(m)
+            beat_duration = ts.beat_duration()
+            beats = self._measure_beats[i]
+            secs = self._measure_secs[i]
+            te_beats = []
+            te_secs = []
+            # a duration edit of one of them invalidates from here, see
+            # TabEvent.BEAT_FIELDS
+            owner = weakref.ref(m)
+            for te in m.tab_events:
+                te._owner = owner
+                te_beats.append(beats)
+                te_secs.append(secs)
+                b = te.beats(beat_duration)
+                beats += b
+                secs += b * (60.0 / bpm)
+            self._te_beats.append(te_beats)
+            self._te_secs.append(te_secs)
+            self._measure_beats.append(beats)
+            self._measure_secs.append(secs)
+            self._time_valid += 1
+
+    def _moment_at(self, value: float, measure_starts, te_starts) -> Tuple[int, int]:
+        self._check_measures()
+        self._extend_time_index(len(self.measures))
+        n = len(self.measures)
+        # empty measures share their start with the next one, bisect_right
+        # skips over them.
+        midx = bisect.bisect_right(measure_starts, value, 0, n) - 1
+        midx = max(0, min(midx, n - 1))
+        starts = te_starts[midx]
+        tidx = max(0, bisect.bisect_right(starts, value) - 1)
+        return (midx, tidx)
+
+    def moment_at_beat(self, beat: float) -> Tuple[int, int]:
+        """
+        (measure index, tab event index) of the tab event sounding at 'beat'
+        beats from the start of the track, clamped to the first/last moment.
+        O(log n) once the index is built.
+        """
+        return self._moment_at(beat, self._measure_beats, self._te_beats)
+
+    def moment_at_time(self, seconds: float) -> Tuple[int, int]:
+        "same as moment_at_beat but for a time in seconds, tempo changes included"
+        return self._moment_at(seconds, self._measure_secs, self._te_secs)
+
+    def moment_start(self, measure: int, tab: int = 0) -> Tuple[float, float]:
+        "(beats, seconds) from the start of the track to this moment"
+        self._check_measures()
+        self._extend_time_index(measure + 1)
+        if tab < len(self._te_beats[measure]):
+            return (self._te_beats[measure][tab], self._te_secs[measure][tab])
+        return (self._measure_beats[measure+1], self._measure_secs[measure+1])
+
+    def length(self) -> Tuple[float, float]:
+        "(beats, seconds) of the whole track"
+        self._check_measures()
+        n = len(self.measures)
+        self._extend_time_index(n)
+        return (self._measure_beats[n], self._measure_secs[n])
+
+    def seek_beat(self, beat: float):
+        "move the current moment to 'beat', see moment_at_beat"
+        self.set_moment(*self.moment_at_beat(beat))
+
+    def seek_time(self, seconds: float):
+        "move the current moment to 'seconds', see moment_at_time"
+        self.set_moment(*self.moment_at_time(seconds))
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        for name in ('_measure_pos', '_indexed_measures', 
+                     '_measure_params', '_params_valid',
+                     '_time_valid', '_measure_beats', '_measure_secs',
+                     '_te_beats', '_te_secs', '_rev'):
+            state.pop(name, None)
+        return state
 
     def __setstate__(self, state):
         # support migration
         self.__dict__.update(state)
+        self._init_measure_params()
         
         if not hasattr(self, "drum_track"):
             self.drum_track = False
 
     def __init__(self, cleff = None):
+        self._init_measure_params()
         self.track_edit_id = ""
         self.instrument_name = "Acoustic Guitar"
         # instrument currently allocated for this track.
@@ -311,6 +528,7 @@ class Track:
         m = self.blank_measure(**kwargs)
         self.measures.append(m)   
         m.cleff = self.cleff
+        self.touch()
         return m 
         
 
@@ -332,6 +550,7 @@ class Track:
     def remove_measure(self):
         if len(self.measures) > 0:
             del self.measures[self.current_measure]
+            self.touch()
             if self.current_measure >= len(self.measures):
                 self.current_measure = len(self.measures) - 1
             for (mn, m) in enumerate(self.measures):
@@ -0,0 +1,492 @@
+"""
+Background autosave.
+
+Every few seconds the measures edited since the last pass (see
+models.revision) are pickled on the GUI thread, that is the only work
+the editor waits for. A worker thread appends them to a journal next to
+the project file (song.gc -> song.gc.journal), once the journal grows
+past GC_AUTOSAVE_COMPACT_BYTES, or the user saves, the worker replays
+it onto the project file, writes a new one and starts a new journal.
+
+Journal layout, every entry is u32 length, u32 crc32, zlib(pickle):
+
+    ('base', info)              first entry, identifies the project file
+                                the journal applies to (size, mtime) and
+                                the keys of its tracks and measures.
+    [record, ...]               one entry per autosave pass
+
+    ('song', attrs)             title, author ...
+    ('tracks', [track key])     track order
+    ('track', key, attrs, [measure key] | None, {measure key: state})
+
+Measures and tracks are identified by keys that stay the same while they
+are edited, inserting a measure records the new measure and the order,
+not every measure after it. A torn entry at the end (crash while
+writing) is ignored. Opening a project with a journal replays it, see
+recover.
+"""
+import atexit
+import itertools
+import logging
+import os
+import pickle
+import queue
+import struct
+import threading
+import time
+import zlib
+from typing import Dict, List, Tuple
+
+from PyQt6.QtCore import QObject, QTimer
+from singleton_decorator import singleton
+
+from models.revision import model_revision
+from models.song import Song, TrackStub
+from models.track import Track
+from services.projectFormat import read_song, write_song
+from services.redoUndo import load_measure, measure_state, track_state
+
+# seconds between autosave passes
+AUTOSAVE_INTERVAL = float(os.environ.get("GC_AUTOSAVE_INTERVAL", 5.0))
+# journal size that triggers a rewrite of the project file
+AUTOSAVE_COMPACT_BYTES = int(os.environ.get("GC_AUTOSAVE_COMPACT_BYTES", 1 << 20))
+
+JOURNAL_SUFFIX = ".journal"
+ENTRY = struct.Struct("<II")
+SONG_FIELDS = ('title', 'author', 'poly_rythm_tracks')
+
+
+def journal_path(path: str) -> str:
+    return path + JOURNAL_SUFFIX
+
+
+def _file_id(path: str) -> Tuple[int, int]:
+    st = os.stat(path)
+    return (st.st_size, st.st_mtime_ns)
+
+
+def _song_attrs(song: Song) -> dict:
+    return {k: getattr(song, k, None) for k in SONG_FIELDS}
+
+
+def encode_entry(obj) -> bytes:
+    payload = zlib.compress(pickle.dumps(obj, pickle.HIGHEST_PROTOCOL), 1)
+    return ENTRY.pack(len(payload), zlib.crc32(payload)) + payload
+
+
+def read_entries(path: str) -> List:
+    "the entries of a journal up to the first torn or corrupt one"
+    entries = []
+    with open(path, 'rb') as f:
+        data = f.read()
+    pos = 0
+    while pos + ENTRY.size <= len(data):
+        (length, crc) = ENTRY.unpack_from(data, pos)
+        payload = data[pos + ENTRY.size:pos + ENTRY.size + length]
+        if len(payload) != length or zlib.crc32(payload) != crc:
+            logging.warning(f"{path}: ignoring torn journal entry at {pos}")
+            break
+        try:
+            entries.append(pickle.loads(zlib.decompress(payload)))
+        except Exception as e:
+            logging.warning(f"{path}: ignoring journal entry at {pos}, {e}")
+            break
+        pos += ENTRY.size + length
+    return entries
+
+
+def _apply(song: Song, tracks: Dict[int, Track], measures: Dict[int, dict],
+           orders: Dict[int, List[int]], records):
+    for rec in records:
+        kind = rec[0]
+        if kind == 'song':
+            song.__dict__.update(rec[1])
+        elif kind == 'tracks':
+            song.tracks = [tracks[k] for k in rec[1]]
+        elif kind == 'track':
+            (_, key, attrs, order, changed) = rec
+            track = tracks.get(key)
+            if track is None:
+                # added since the file was written
+                track = Track.__new__(Track)
+                state = pickle.loads(attrs)
+                state['measures'] = []
+                state.setdefault('current_measure', 0)
+                track.__setstate__(state)
+                tracks[key] = track
+                measures[key] = {}
+            elif attrs is not None:
+                track.__dict__.update(pickle.loads(attrs))
+            live = measures[key]
+            for (mkey, data) in changed.items():
+                live[mkey] = load_measure(data)
+            if order is not None:
+                orders[key] = order
+            track.measures = [live[k] for k in orders[key]]
+            track.current_measure = max(0, min(track.current_measure, len(track.measures) - 1))
+            track.measures_changed()
+
+
+def replay(path: str) -> Tuple[Song, bool]:
+    """
+    The project file with its journal applied, returns (song, True if
+    the journal had changes).
+    """
+    song = read_song(path)
+    jpath = journal_path(path)
+    if not os.access(jpath, os.F_OK):
+        return (song, False)
+    entries = read_entries(jpath)
+    if len(entries) < 2 or entries[0][0] != 'base':
+        return (song, False)
+
+    info = entries[0][1]
+    if info['file_id'] != _file_id(path) or info['uuid'] != song.uuid or \
+        len(info['tracks']) != len(song.tracks):
+        # the project file was written after the journal was started
+        logging.warning(f"{jpath}: stale journal ignored")
+        return (song, False)
+
+    tracks = {}
+    measures = {}
+    orders = {}
+    for (tkey, mkeys, track) in zip(info['tracks'], info['measures'], song.tracks):
+        tracks[tkey] = track
+        measures[tkey] = dict(zip(mkeys, track.measures))
+        orders[tkey] = mkeys
+    for records in entries[1:]:
+        _apply(song, tracks, measures, orders, records)
+    return (song, True)
+
+
+def recover(path: str) -> Song | None:
+    "the song as it was autosaved, None if there is nothing to recover"
+    (song, changed) = replay(path)
+    if changed:
+        song.filename = path
+        return song
+    return None
+
+
+def _canonical(entry):
+    "a track list entry, the loaded track if a stub was loaded"
+    if isinstance(entry, TrackStub) and entry.track is not None:
+        return entry.track
+    return entry
+
+
+class song_journal:
+    """
+    Autosave state of one song. collect() and snapshot() run on the GUI
+    thread, the methods that touch files on the autosave thread.
+    'recovered', the journal on disk was replayed into 'song'.
+    """
+    def __init__(self, song: Song, path: str, recovered: bool = False):
+        self.song = song
+        self.path = path
+        self.keys = itertools.count()
+        self.seen = model_revision()
+        self.attrs = _song_attrs(song)
+        # by track key: measure keys in order, key by id(measure),
+        # measure by key and pickled track attributes
+        self.morder: Dict[int, List[int]] = {}
+        self.mkey: Dict[int, Dict[int, int]] = {}
+        self.live: Dict[int, Dict[int, object]] = {}
+        self.tattrs: Dict[int, bytes] = {}
+        # track (or stub if not loaded) by key and key by id()
+        self.tracks: Dict[int, object] = {}
+        self.tkey: Dict[int, int] = {}
+        # stubs of tracks not loaded when autosave started, their
+        # measures are keyed by position once they are.
+        self.stubs: Dict[int, TrackStub] = {}
+        self.order: List[int] = []
+        for entry in song.track_entries():
+            key = next(self.keys)
+            obj = _canonical(entry)
+            self.order.append(key)
+            self.tkey[id(obj)] = key
+            self.tracks[key] = obj
+            if isinstance(obj, TrackStub):
+                self.stubs[key] = obj
+                self.morder[key] = [next(self.keys) for _ in range(obj.measure_count)]
+            else:
+                self._index(key, obj)
+        self.base = self.snapshot()
+
+        # autosave thread
+        self.jpath = journal_path(path)
+        self.journal_bytes = 0
+        # the journal on disk belongs to this song
+        self.started = recovered
+
+    def _index(self, key: int, track: Track, mkeys: List[int] | None = None):
+        if mkeys is None:
+            mkeys = [next(self.keys) for _ in track.measures]
+        self.morder[key] = list(mkeys)
+        self.mkey[key] = {id(m): k for (m, k) in zip(track.measures, mkeys)}
+        self.live[key] = {k: m for (m, k) in zip(track.measures, mkeys)}
+        self.tattrs[key] = track_state(track)
+
+    def _full(self, key: int, track: Track) -> tuple:
+        self._index(key, track)
+        return ('track', key, self.tattrs[key], list(self.morder[key]),
+                {k: measure_state(m) for (k, m) in self.live[key].items()})
+
+    def _loaded(self, track: Track) -> int | None:
+        "key of a track that was a stub at the last pass"
+        for (key, stub) in self.stubs.items():
+            if stub.track is track:
+                return key
+        return None
+
+    def collect(self) -> List[tuple]:
+        "records of what changed since the last call"
+        records = []
+        attrs = _song_attrs(self.song)
+        if attrs != self.attrs:
+            records.append(('song', attrs))
+            self.attrs = attrs
+        rev = model_revision()
+        current = [_canonical(e) for e in self.song.track_entries()]
+        if rev == self.seen and len(current) == len(self.order) and \
+            all(self.tracks[k] is t for (k, t) in zip(self.order, current)):
+            return records
+        seen = self.seen
+
+        order = []
+        for obj in current:
+            key = self.tkey.get(id(obj))
+            if key is not None and self.tracks.get(key) is not obj:
+                key = None
+            if isinstance(obj, TrackStub):
+                # not loaded, unchanged
+                pass
+            elif key is None and (key := self._loaded(obj)) is not None:
+                # loaded since the last pass
+                stub = self.stubs.pop(key)
+                self.tkey.pop(id(stub), None)
+                self.tkey[id(obj)] = key
+                self.tracks[key] = obj
+                base = self.morder[key]
+                if len(obj.measures) == len(base) and obj._rev <= seen:
+                    # measures are where the stub had them, only edits
+                    self._index(key, obj, base)
+                    rec = self._changes(key, obj, seen)
+                    if rec is not None:
+                        records.append(rec)
+                else:
+                    records.append(self._full(key, obj))
+            elif key is None:
+                # new track
+                key = next(self.keys)
+                self.tkey[id(obj)] = key
+                self.tracks[key] = obj
+                records.append(self._full(key, obj))
+            else:
+                rec = self._changes(key, obj, seen)
+                if rec is not None:
+                    records.append(rec)
+            order.append(key)
+
+        if order != self.order:
+            records.append(('tracks', order))
+            self.order = order
+            for key in set(self.tracks) - set(order):
+                self._forget(key)
+        self.seen = rev
+        return records
+
+    def _changes(self, key: int, track: Track, seen: int) -> tuple | None:
+        mkey = self.mkey[key]
+        live = self.live[key]
+        changed = {}
+        order = []
+        for m in track.measures:
+            k = mkey.get(id(m))
+            if k is None or live.get(k) is not m:
+                k = next(self.keys)
+                mkey[id(m)] = k
+                live[k] = m
+                changed[k] = measure_state(m)
+            elif m.revision() > seen:
+                changed[k] = measure_state(m)
+            order.append(k)
+
+        new_order = None
+        if order != self.morder[key]:
+            new_order = order
+            current = set(order)
+            for k in self.morder[key]:
+                if k not in current:
+                    m = live.pop(k, None)
+                    if m is not None and mkey.get(id(m)) == k:
+                        del mkey[id(m)]
+            self.morder[key] = order
+
+        attrs = None
+        if track._rev > seen:
+            attrs = track_state(track)
+            if attrs == self.tattrs[key]:
+                attrs = None
+            else:
+                self.tattrs[key] = attrs
+        if attrs is None and new_order is None and not changed:
+            return None
+        return ('track', key, attrs, new_order, changed)
+
+    def _forget(self, key: int):
+        entry = self.tracks.pop(key)
+        self.tkey.pop(id(entry), None)
+        for d in (self.morder, self.mkey, self.live, self.tattrs, self.stubs):
+            d.pop(key, None)
+
+    def snapshot(self) -> dict:
+        "keys of the song as it is now, the base of the next journal"
+        return {
+            'uuid': self.song.uuid,
+            'tracks': list(self.order),
+            'measures': [list(self.morder[k]) for k in self.order]
+        }
+
+    # autosave thread
+
+    def _start(self, base: dict):
+        info = dict(base)
+        info['file_id'] = _file_id(self.path)
+        data = encode_entry(('base', info))
+        with open(self.jpath, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        self.journal_bytes = len(data)
+        self.started = True
+
+    def append(self, records: List[tuple]):
+        if not self.started:
+            self._start(self.base)
+        data = encode_entry(records)
+        with open(self.jpath, 'ab') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        self.journal_bytes += len(data)
+
+    def compact(self, base: dict):
+        """
+        Write the project file with the journal applied, 'base' are the
+        keys of the song at the time, see snapshot. The editor keeps
+        working on its own copy, the song is rebuilt from the files.
+        """
+        t0 = time.perf_counter()
+        if self.started:
+            (song, _) = replay(self.path)
+            write_song(song, self.path)
+        self.base = base
+        self._start(base)
+        logging.debug(f"autosave: compacted {self.path} in "
+                      f"{time.perf_counter() - t0:.3f}s")
+
+    def discard(self):
+        if os.access(self.jpath, os.F_OK):
+            os.remove(self.jpath)
+        self.started = False
+
+
+@singleton
+class Autosave(QObject):
+    """
+    Autosaves the songs that have a project file, see the module doc.
+    The GUI thread only collects the changed measures, the files are
+    written by a worker thread.
+    """
+    def watch(self, song: Song, recovered: bool = False):
+        """
+        start autosaving a song that was just read from/written to
+        song.filename. 'recovered', the song was replayed from its
+        journal (see recover), it is written to the project file.
+        """
+        if song.uuid in self.journals or len(song.filename) == 0:
+            return
+        j = self.journals[song.uuid] = song_journal(song, song.filename, recovered)
+        if recovered:
+            self.tasks.put((j.compact, (j.snapshot(),)))
+        if not self.timer.isActive():
+            self.timer.start()
+
+    def unwatch(self, song: Song, discard: bool = True):
+        """
+        stop autosaving a song, with 'discard' the changes since the
+        project file was last written are dropped.
+        """
+        j = self.journals.pop(song.uuid, None)
+        if j is not None and discard:
+            self.tasks.put((j.discard, ()))
+
+    def is_watched(self, song: Song) -> bool:
+        return song.uuid in self.journals
+
+    def save(self, song: Song):
+        "the user saved, write the project file in the background"
+        j = self.journals.get(song.uuid)
+        if j is not None:
+            records = j.collect()
+            if records:
+                self.tasks.put((j.append, (records,)))
+            self.tasks.put((j.compact, (j.snapshot(),)))
+
+    def _collect(self, j: song_journal):
+        t0 = time.perf_counter()
+        records = j.collect()
+        if records:
+            self.tasks.put((j.append, (records,)))
+            self.tasks.put((self._maybe_compact, (j, j.snapshot())))
+        self.collect_seconds = time.perf_counter() - t0
+
+    def on_timer(self):
+        for j in list(self.journals.values()):
+            try:
+                self._collect(j)
+            except Exception:
+                logging.exception(f"autosave of {j.path} failed")
+
+    def _maybe_compact(self, j: song_journal, base: dict):
+        if j.journal_bytes > AUTOSAVE_COMPACT_BYTES:
+            j.compact(base)
+
+    def flush(self, timeout: float | None = None):
+        "collect now and wait until the worker is idle"
+        self.on_timer()
+        done = threading.Event()
+        self.tasks.put((done.set, ()))
+        done.wait(timeout)
+
+    def _run(self):
+        while True:
+            (fn, args) = self.tasks.get()
+            if fn is None:
+                break
+            try:
+                fn(*args)
+            except Exception:
+                logging.exception("autosave worker")
+
+    def on_exit(self):
+        # the journals are replayed next time the songs are opened
+        self.timer.stop()
+        self.flush(timeout=10.0)
+        self.tasks.put((None, ()))
+
+    def __init__(self):
+        super().__init__()
+        self.journals: Dict[str, song_journal] = {}
+        # seconds the last collect took on the GUI thread
+        self.collect_seconds = 0.0
+        self.tasks = queue.Queue()
+        self.worker = threading.Thread(target=self._run, name="autosave", daemon=True)
+        self.worker.start()
+
+        self.timer = QTimer()
+        self.timer.setInterval(int(AUTOSAVE_INTERVAL * 1000))
+        self.timer.timeout.connect(self.on_timer)
+
+        atexit.register(self.on_exit)
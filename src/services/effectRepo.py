@@ -1,5 +1,7 @@
 import glob
-from typing import List
+import logging
+import threading
+from typing import Dict, List
 import gcsynth
 import os
 from models.effect import Effect, Effects
@@ -8,6 +10,8 @@ from singleton_decorator import singleton
 import copy
 
 EFFECT_CFG_FILE = os.environ['GC_DATA_DIR']+"/effect_config/config.json"
+# plugin file -> size, mtime and the labels it contains, see EffectRepository.scan
+PLUGIN_CACHE_FILE = os.environ['GC_DATA_DIR']+"/effect_config/plugin_cache.json"
 LADSPA_FILE_SPEC = os.environ.get('LADSPA_PATH','/usr/lib/ladspa')+"/*.so"
 
 
@@ -70,8 +74,34 @@ def classifier(label):
     return effect_class
 
 
+def _file_id(filepath) -> List[int]:
+    st = os.stat(filepath)
+    return [st.st_size, st.st_mtime_ns]
+
+
+def _read_json(filename) -> dict:
+    if os.access(filename, os.F_OK):
+        with open(filename) as f:
+            return json.load(f)
+    return {}
+
+
+def _write_json(filename, obj):
+    tmp = filename + ".tmp"
+    with open(tmp, "w") as f:
+        f.write(json.dumps(obj, indent=4, sort_keys=True))
+    os.replace(tmp, filename)
+
+
 @singleton
 class EffectRepository:
+    """
+    The ladspa plugins installed on the system. Opening every plugin
+    takes seconds with a large collection so what was found is cached in
+    PLUGIN_CACHE_FILE, startup only reads the cache and scan() (run in
+    the background once the UI is up) reopens the plugin files that were 
+    added or changed since.
+    """
 
     def get(self, name) -> Effect | None:
         return self.effects.get(name)
@@ -86,12 +116,10 @@ class EffectRepository:
         return self.effects.get(name)
     
     def update(self, elist: List[Effect]):
-        data = open(EFFECT_CFG_FILE).read()
-        cfg = json.loads(data)
-        for e in elist:
-            cfg[e.label] = e.json_data()
-        data = json.dumps(cfg, indent=4, sort_keys=True)
-        open(EFFECT_CFG_FILE,"w").write(data)
+        with self.lock:
+            for e in elist:
+                self.cfg[e.label] = e.json_data()
+            _write_json(EFFECT_CFG_FILE, self.cfg)
 
     def create_effects(self) -> Effects:
         """
@@ -104,57 +132,92 @@ class EffectRepository:
             r.add(label, copy.deepcopy(e))
         return r
 
-    def __init__(self):
-        cfg = {}
-        self.effects = {}
-        
-        if os.access(EFFECT_CFG_FILE, os.F_OK):
-            data = open(EFFECT_CFG_FILE).read()
-            cfg = json.loads(data)
-        
-        ladspa_labels = set()
+    def _load_effects(self, cfg: dict, plugins: dict) -> Dict[str, Effect]:
+        # labels of plugins that are no longer installed are left out
+        effects = {}
+        for (filepath, p) in plugins.items():
+            for (label, name) in p['labels']:
+                if label in cfg:
+                    controls = cfg[label]['controls']
+                    effects[label] = Effect(name, label, filepath, controls, classifier(label))
+        return effects
+
+    def scan(self, full = False) -> bool:
+        """
+        Look for added, changed or removed plugin files, with 'full' every
+        file is reopened. Returns True if the effects changed.
+        """
+        with self.lock:
+            cfg = dict(self.cfg)
+            cached = self.plugins
+        plugins = {}
+        new_labels = False
 
         for filepath in glob.glob(LADSPA_FILE_SPEC):
+            try:
+                fid = _file_id(filepath)
+            except OSError:
+                continue
+            p = cached.get(filepath)
+            if not full and p is not None and p['id'] == fid:
+                plugins[filepath] = p
+                continue
+
+            labels = []
             for data in gcsynth.ladspa_plugin_labels(filepath):
                 t = data.split(':')
                 label = t[0]
                 name = t[1]
-                ladspa_labels.add(label)
-                eclass = classifier(label)
+                labels.append([label, name])
                 # newly detected effect
                 if label not in cfg:
                     controls = gcsynth.filter_query(filepath, label)
-                    
-                    e = Effect(name, label, filepath, controls, eclass)
                     cfg[label] = {
                         'controls': controls,
                         'name': name,
                         'label': label,
                         'path': filepath,
-                        'class': eclass
+                        'class': classifier(label)
                     }
-                    self.effects[label] = e
+                    new_labels = True
                     print(f"{label} {name} {filepath}")
-                else:
-                    # previously loaded
-                    d = cfg[label]
-                    controls = d['controls']
-                    e = Effect(name, label, filepath, controls, eclass)
-                    self.effects[label] = e
-
-        data = json.dumps(cfg, indent=4, sort_keys=True)
-        open(EFFECT_CFG_FILE,"w").write(data)
-               
-        # there is a chance that the user may delete a ladspa audio effect
-        # from teh system, then we would have a stale entry in our database.
-        deleted_effects = set()       
-        for label in self.effects.keys():
-            if label not in ladspa_labels:
-                deleted_effects.add(label)
-
-        for label in deleted_effects:
-            if label in self.effects:
-                del self.effects[label]
+            plugins[filepath] = {'id': fid, 'labels': labels}
+
+        changed = plugins != cached
+        if changed or new_labels:
+            effects = self._load_effects(cfg, plugins)
+            with self.lock:
+                # keep what update() saved in the meantime
+                cfg.update(self.cfg)
+                self.cfg = cfg
+                self.plugins = plugins
+                self.effects = effects
+                _write_json(EFFECT_CFG_FILE, self.cfg)
+                _write_json(PLUGIN_CACHE_FILE, self.plugins)
+        return changed
+
+    def scan_in_background(self, full = False) -> threading.Thread:
+        def run():
+            try:
+                if self.scan(full):
+                    logging.info("ladspa plugins changed since the last scan")
+            except Exception:
+                logging.exception("ladspa plugin scan failed")
+        t = threading.Thread(target=run, name="ladspa-scan", daemon=True)
+        t.start()
+        return t
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.cfg = _read_json(EFFECT_CFG_FILE)
+        self.plugins = _read_json(PLUGIN_CACHE_FILE)
+        self.effects : Dict[str, Effect] = {}
+
+        if self.plugins:
+            self.effects = self._load_effects(self.cfg, self.plugins)
+        else:
+            # first run, nothing to show until the plugins are opened
+            self.scan()
 
 
 
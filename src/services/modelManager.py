@@ -2,19 +2,40 @@
 Manage an archive of models. There is a master index file that maps the
 preset name to a file containing a serialized model. The user may change the preset 
 resulting in a re-index. 
+
+The manifest is kept in memory with an index per class name (presets,
+songs) of the tag names, sorted so listing and prefix search don't scan
+the library, and a trigram index for fuzzy search. Changes are appended
+to manifest.journal (see services.autosave for the entry framing), the
+whole manifest.dat is only rewritten once the journal has
+GC_MANIFEST_COMPACT_RECORDS records.
 """
+import bisect
+import difflib
 import os 
 import pickle
-from typing import Dict, List
+from typing import Dict, List, Set, Tuple
 import uuid
 
 from singleton_decorator import singleton
 
 from models.filterGraph import FilterGraph
 from models.song import Song
+from services.autosave import encode_entry, read_entries
 from view.events import Signals
 
+# journal records before manifest.dat is rewritten
+MANIFEST_COMPACT_RECORDS = int(os.environ.get("GC_MANIFEST_COMPACT_RECORDS", 256))
+
+
+def _key(tag_name: str) -> str:
+    "searches ignore case"
+    return tag_name.casefold()
+
 
+def _trigrams(key: str) -> Set[str]:
+    padded = f"  {key} "
+    return {padded[i:i+3] for i in range(len(padded) - 2)}
 
 
 class ManifestEntry:
@@ -27,6 +48,72 @@ class ManifestEntry:
         self.uuid = ""
         
 
+class class_index:
+    """
+    Tag names of one class of model: uuid by tag name, the tag names
+    sorted by search key and trigram -> tag names for fuzzy search.
+    """
+    def __init__(self):
+        self.by_tag: Dict[str, str] = {}
+        self.sorted: List[Tuple[str, str]] = []
+        self.trigrams: Dict[str, Set[str]] = {}
+
+    def add(self, tag_name: str, entry_uuid: str):
+        if tag_name not in self.by_tag:
+            key = _key(tag_name)
+            bisect.insort(self.sorted, (key, tag_name))
+            for g in _trigrams(key):
+                self.trigrams.setdefault(g, set()).add(tag_name)
+        self.by_tag[tag_name] = entry_uuid
+
+    def remove(self, tag_name: str):
+        if self.by_tag.pop(tag_name, None) is None:
+            return
+        key = _key(tag_name)
+        i = bisect.bisect_left(self.sorted, (key, tag_name))
+        del self.sorted[i]
+        for g in _trigrams(key):
+            tags = self.trigrams[g]
+            tags.discard(tag_name)
+            if not tags:
+                del self.trigrams[g]
+
+    def tags(self) -> List[str]:
+        return [tag for (_, tag) in self.sorted]
+
+    def prefix(self, prefix: str) -> List[str]:
+        key = _key(prefix)
+        i = bisect.bisect_left(self.sorted, (key, ""))
+        r = []
+        while i < len(self.sorted) and self.sorted[i][0].startswith(key):
+            r.append(self.sorted[i][1])
+            i += 1
+        return r
+
+    def fuzzy(self, query: str, limit: int, cutoff: float) -> List[str]:
+        """
+        the tag names closest to query, best first. Only names sharing
+        trigrams with the query are compared.
+        """
+        key = _key(query)
+        counts: Dict[str, int] = {}
+        for g in _trigrams(key):
+            for tag in self.trigrams.get(g, ()):
+                counts[tag] = counts.get(tag, 0) + 1
+        candidates = sorted(counts, key=lambda t: -counts[t])[:limit * 8]
+        scored = []
+        for tag in candidates:
+            m = difflib.SequenceMatcher(None, key, _key(tag))
+            score = m.ratio()
+            if _key(tag).startswith(key) or key in _key(tag):
+                # partial names typed in a search box
+                score = max(score, 0.9)
+            if score >= cutoff:
+                scored.append((-score, tag))
+        scored.sort()
+        return [tag for (_, tag) in scored[:limit]]
+
+
 class Manifest:
     """
     A data structure that holds references to serialized modules.
@@ -34,36 +121,65 @@ class Manifest:
     def __init__(self):
         self.index : Dict[str, ManifestEntry] = {}
         self.map_tag_name_to_uuid : Dict[str, str] = {}
+        self.classes : Dict[str, class_index] = {}
+
+    def __getstate__(self):
+        # the indexes are rebuilt on load
+        return {'index': self.index}
+
+    def __setstate__(self, state):
+        self.index = state['index']
+        self.map_tag_name_to_uuid = {}
+        self.classes = {}
+        for entry in list(self.index.values()):
+            self._index(entry)
+
+    def _index(self, entry: ManifestEntry):
+        self.map_tag_name_to_uuid[entry.tag_name] = entry.uuid
+        self.classes.setdefault(entry.class_name, class_index()).add(entry.tag_name, entry.uuid)
+
+    def _unindex(self, entry: ManifestEntry):
+        if self.map_tag_name_to_uuid.get(entry.tag_name) == entry.uuid:
+            del self.map_tag_name_to_uuid[entry.tag_name]
+        ci = self.classes.get(entry.class_name)
+        if ci is not None and ci.by_tag.get(entry.tag_name) == entry.uuid:
+            ci.remove(entry.tag_name)
+        if entry.tag_name not in self.map_tag_name_to_uuid:
+            # a model of another class with the same name
+            for ci in self.classes.values():
+                if entry.tag_name in ci.by_tag:
+                    self.map_tag_name_to_uuid[entry.tag_name] = ci.by_tag[entry.tag_name]
+                    break
 
     def getPresets(self) -> List[str]:
-        r = []
-        for entry in self.index.values():
-            if entry.class_name != "FilterGraph":
-                continue
-            r.append(entry.tag_name)
-        return r
+        return self.getTags("FilterGraph")
     
     def getSongTitles(self):
-        r = []
-        for entry in self.index.values():
-            if entry.class_name != "Song":
-                continue
-            r.append(entry.tag_name)
-        return r
-    
+        return self.getTags("Song")
+
+    def getTags(self, class_name: str) -> List[str]:
+        "tag names of a class of model sorted ignoring case"
+        ci = self.classes.get(class_name)
+        return ci.tags() if ci else []
+
+    def search(self, prefix: str, class_name: str) -> List[str]:
+        "tag names starting with prefix, ignoring case"
+        ci = self.classes.get(class_name)
+        return ci.prefix(prefix) if ci else []
+
+    def fuzzy_search(self, query: str, class_name: str, limit: int = 10, 
+                     cutoff: float = 0.5) -> List[str]:
+        ci = self.classes.get(class_name)
+        return ci.fuzzy(query, limit, cutoff) if ci else []
 
     def update_name(self, model : Song | FilterGraph):
-        # find the old name 
-        uuid = model.uuid
-        entry = self.index[uuid]
+        # the entry is re-indexed under its new name
         self.add_model(model)
-        # remove old tag_name
-        del self.map_tag_name_to_uuid[entry.tag_name]
-
 
-    def add_model(self, model : Song | FilterGraph):
+    def add_model(self, model : Song | FilterGraph) -> List[ManifestEntry]:
         """ 
-        Add a filter graph or song to the manifest.
+        Add a filter graph or song to the manifest, returns the entries
+        it replaces, see add_entry.
         """
         entry = ManifestEntry()
         entry.class_name = model.__class__.__name__
@@ -79,38 +195,95 @@ class Manifest:
             entry.uuid = fg.uuid
         else:
             raise TypeError("Expected Song or FilterGraph model")
-        self.map_tag_name_to_uuid[entry.tag_name] = entry.uuid
+        return self.add_entry(entry)
+
+    def add_entry(self, entry: ManifestEntry) -> List[ManifestEntry]:
+        """
+        Add or re-index an entry, returns the other entries dropped
+        because they had the same class and tag name (overwritten).
+        """
+        replaced = []
+        old = self.index.get(entry.uuid)
+        if old is not None:
+            self._unindex(old)
+        ci = self.classes.get(entry.class_name)
+        other = ci and ci.by_tag.get(entry.tag_name)
+        if other and other != entry.uuid:
+            replaced.append(self.index.pop(other))
+            self._unindex(replaced[-1])
         self.index[entry.uuid] = entry
+        self._index(entry)
+        return replaced
+
+    def remove_entry(self, entry_uuid: str) -> ManifestEntry | None:
+        entry = self.index.pop(entry_uuid, None)
+        if entry is not None:
+            self._unindex(entry)
+        return entry
+
+    def lookup(self, tag_name) -> ManifestEntry | None:
+        entry_uuid = self.map_tag_name_to_uuid.get(tag_name)
+        return None if entry_uuid is None else self.index.get(entry_uuid)
 
     def lookup_filename(self, tag_name):
-        d = self.map_tag_name_to_uuid
-        if tag_name in d:
-            uuid = d[tag_name]
-            return self.index[uuid].file_name
-        return None
+        entry = self.lookup(tag_name)
+        return None if entry is None else entry.file_name
 
     def remove_model(self, tag_name):
-        d = self.map_tag_name_to_uuid
-        if tag_name in d:
-            uuid = d[tag_name]
-            del self.index[uuid]
-            del d[tag_name]
+        entry = self.lookup(tag_name)
+        if entry is not None:
+            self.remove_entry(entry.uuid)
 
 
 @singleton
 class ModelManager:
 
-    def __init__(self):
-        self.model_dir = os.environ['GC_DATA_DIR']+os.sep+"models"
+    def __init__(self, model_dir: str | None = None):
+        self.model_dir = model_dir or os.environ['GC_DATA_DIR']+os.sep+"models"
         self.manifest = Manifest() 
 
         if not os.access(self.model_dir, os.F_OK):
             os.mkdir(self.model_dir)
         self.manifest_file = self.model_dir+os.sep+"manifest.dat"
+        self.journal_file = self.model_dir+os.sep+"manifest.journal"
         if os.access(self.manifest_file, os.F_OK):
             with open(self.manifest_file, 'rb') as f:
                 self.manifest = pickle.load(f)
+        # changes since manifest.dat was written
+        self.journal_records = 0
+        if os.access(self.journal_file, os.F_OK):
+            for rec in read_entries(self.journal_file):
+                self._apply(rec)
+                self.journal_records += 1
+
+    def _apply(self, rec):
+        if rec[0] == 'add':
+            entry = ManifestEntry()
+            entry.__dict__.update(rec[1])
+            self.manifest.add_entry(entry)
+        elif rec[0] == 'remove':
+            self.manifest.remove_entry(rec[1])
+
+    def _log(self, rec):
+        """
+        Append a change to the journal, a crash while writing loses
+        only that change. Replaying a record twice is harmless so the 
+        journal is removed after the new manifest.dat is in place.
+        """
+        with open(self.journal_file, 'ab') as f:
+            f.write(encode_entry(rec))
+            f.flush()
+            os.fsync(f.fileno())
+        self.journal_records += 1
+        if self.journal_records >= MANIFEST_COMPACT_RECORDS:
+            self.compact()
 
+    def compact(self):
+        "rewrite manifest.dat, empties the journal"
+        _write_atomic(self.manifest_file, self.manifest)
+        if os.access(self.journal_file, os.F_OK):
+            os.remove(self.journal_file)
+        self.journal_records = 0
 
     def get_presets(self) -> List[str]:
         return self.manifest.getPresets()
@@ -118,6 +291,13 @@ class ModelManager:
     def get_songs(self) -> List[str]:
         return self.manifest.getSongTitles()
 
+    def search(self, prefix: str, class_name: str = "FilterGraph") -> List[str]:
+        return self.manifest.search(prefix, class_name)
+
+    def fuzzy_search(self, query: str, class_name: str = "FilterGraph", 
+                     limit: int = 10) -> List[str]:
+        return self.manifest.fuzzy_search(query, class_name, limit)
+
     def get_model(self, tag_name) -> Song | FilterGraph | None:
         file_name = self.manifest.lookup_filename(tag_name)
         if file_name is None:
@@ -142,24 +322,30 @@ class ModelManager:
         else:
             raise TypeError("Expected Song or FilterGraph model")
         
-        with open(model.filename, 'wb') as f:
-            pickle.dump(model, f)
+        _write_atomic(model.filename, model)
 
-        self.manifest.add_model(model)
-        with open(self.manifest_file, 'wb') as f:
-            pickle.dump(self.manifest, f)
+        replaced = self.manifest.add_model(model)
+        self._log(('add', dict(self.manifest.index[model.uuid].__dict__)))
+        for entry in replaced:
+            # overwritten preset
+            self._log(('remove', entry.uuid))
+            if entry.file_name != model.filename and os.access(entry.file_name, os.F_OK):
+                os.remove(entry.file_name)
 
     def remove_model(self, tag_name):
-        filename = self.manifest.lookup_filename(tag_name)
-        if filename is None:
+        entry = self.manifest.lookup(tag_name)
+        if entry is None:
             return
-        os.remove(filename)
-        self.manifest.remove_model(tag_name)
-        with open(self.manifest_file, 'wb') as f:
-            pickle.dump(self.manifest, f)
-        
-
-
-
+        self.manifest.remove_entry(entry.uuid)
+        self._log(('remove', entry.uuid))
+        if os.access(entry.file_name, os.F_OK):
+            os.remove(entry.file_name)
 
 
+def _write_atomic(file_name: str, obj):
+    tmp = file_name + ".tmp"
+    with open(tmp, 'wb') as f:
+        pickle.dump(obj, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, file_name)
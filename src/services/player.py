@@ -5,14 +5,14 @@ Processes track(s) and allows user to rewind pause skip etc.
 
 """
 
-from typing import List, Tuple
-from models.measure import Measure, TabEvent, DynamicVariance
+from typing import List
+import os
+import itertools
+from models.measure import TabEvent
 from models.song import Song
 from models.track import Track
 from PyQt6.QtCore import QObject, QTimer, QThread, pyqtSignal
-import copy
 import time
-from music.constants import Dynamic
 from music.instrument import Instrument
 from threading import Event as thread_event
 from threading import Lock
@@ -20,6 +20,10 @@ from threading import Lock
 from util.gctimer import GcTimer
 
 from services.synth.synthservice import synthservice
+from services.synth import sequencer as seq
+from services.songCompiler import (compile_track, compile_song, compile_region, SongTimeline,
+    TimelineEvent, EV_NOTEON, EV_NOTEOFF, EV_PITCH_WHEEL, EV_PITCH_RANGE,
+    EV_EFFECTS, EV_HIGHLIGHT_ON, EV_HIGHLIGHT_OFF)
 from view.events import Signals, PlayerVisualEvent
 
 
@@ -51,289 +55,489 @@ def PlayMoment(track: Track, instrument: Instrument):
 
 
 
-def compile_track(track: Track, m_idx=0) -> List[Tuple[TabEvent,Measure]]:
+class song_player_api(QObject):
     """ 
-    Walk through track and generate a list of tab events, unravel all repeat loops
-    so that we have a single vector that the player can walk through.
-
-    Return a List of (tab_event,measure)
+    internal api for the player, walks an index through a compiled
+    SongTimeline. All timing, velocity and note computations were done
+    by the song compiler so each timer callback only dispatches the
+    events that are due.
     """
-    class repeat_item:
-        def __init__(self, **kw):
-            self.start_measure = kw.get('start',-1)
-            self.end_measure = kw.get('end',-1)
-            self.repeat_counter = kw.get('count',-1)
-            self.tab_events = []
-
-    result = []
-    repeat_stack = []
-    
-    while m_idx < len(track.measures):
-        m = track.measures[m_idx]
-
-        if m.start_repeat:
-            r = repeat_item(start=m.measure_number)
-            repeat_stack = [r] + repeat_stack
-
-        for _te in m.tab_events:
-            te = copy.deepcopy(_te)
-            if len(repeat_stack) == 0:
-                result.append((te, m))
-            else:
-                r : repeat_item = repeat_stack[0]
-                r.tab_events.append((te,m))        
-
-        if m.end_repeat:
-            r : repeat_item = repeat_stack[0]
-            if r.end_measure == -1:
-                r.end_measure = m.measure_number
-                r.repeat_counter = m.repeat_count
-            
-            tab_events = r.tab_events * (r.repeat_counter + 1) 
-            del repeat_stack[0]
-            if len(repeat_stack) > 0:
-                repeat_stack[0].tab_events += tab_events
-            else:
-                result += tab_events
-            
-        m_idx += 1
-
-    # print("compiled result: ")
-    # for (te,m) in result:
-    #     print((te.fret, m.measure_number))
-    # print("-----------------------------------------")
-
-    # walk the track applying dynamics and articulations, when encountered they change
-    # the settings for the current and all subsiquent tab events until a new one 
-    # encountered.
-    dynamic = Dynamic.MF
-    legato = False 
-    staccato = False
-
-    for te,m in result:
-        if te.dynamic is None:
-            te.dynamic = dynamic
-        else:
-            dynamic = te.dynamic
+    # events within this many seconds of now are dispatched together
+    # rather than scheduling a timer for each.
+    DISPATCH_WINDOW = 0.001
 
-        if te.legato is None:
-            te.legato = legato 
-        else:
-            legato = te.legato 
+    def __init__(self, timeline: SongTimeline, is_playing: thread_event):
+        super().__init__()
+        self.timeline = timeline
+        self.is_playing = is_playing
+        self.synth = synthservice()
+        self.timer = GcTimer()
+        self.timer_id = -1
+        self.timer_loop_lock = Lock()
+        # index of the next event to be dispatched
+        self.index = 0
+        # position in seconds within the timeline and the perf_counter
+        # reference that corresponds to position 0.
+        self.position = 0.0
+        self.t0 = 0.0
+        # (chan, midi_code) pairs currently sounding
+        self.sounding = set()
+
+    def _now(self) -> float:
+        return time.perf_counter() - self.t0
+
+    def _execute(self, evt: TimelineEvent):
+        if evt.ev_type == EV_NOTEON:
+            self.synth.noteon(evt.channel, evt.midi_code, evt.velocity, evt.gstring)
+            self.sounding.add((evt.channel, evt.midi_code))
+        elif evt.ev_type == EV_NOTEOFF:
+            self.synth.noteoff(evt.channel, evt.midi_code, evt.gstring)
+            self.sounding.discard((evt.channel, evt.midi_code))
+        elif evt.ev_type == EV_PITCH_WHEEL:
+            self.synth.pitch_change(evt.channel, evt.value)
+        elif evt.ev_type == EV_PITCH_RANGE:
+            self.synth.pitch_range(evt.channel, evt.value)
+        elif evt.ev_type == EV_EFFECTS:
+            self.timeline.instruments[evt.track_idx].setup_effects(evt.effects)
+        elif evt.ev_type in (EV_HIGHLIGHT_ON, EV_HIGHLIGHT_OFF):
+            ev_type = PlayerVisualEvent.TABEVENT_HIGHLIGHT_ON \
+                if evt.ev_type == EV_HIGHLIGHT_ON else PlayerVisualEvent.TABEVENT_HIGHLIGHT_OFF
+            v_evt = PlayerVisualEvent(ev_type, evt.tab_event)
+            v_evt.measure = evt.measure
+            Signals.player_visual_event.emit(v_evt)
+
+    def _play_loop(self):
+        with self.timer_loop_lock:
+            self.timer_id = -1
+            if not self.is_playing.is_set():
+                return
+            events = self.timeline.events
+            now = self._now()
+            i = self.index
+            while i < len(events) and events[i].when <= now + self.DISPATCH_WINDOW:
+                self._execute(events[i])
+                i += 1
+            self.index = i
+            self.position = now
+
+            if i < len(events):
+                delay = max(0.0, events[i].when - self._now())
+                self.timer_id = self.timer.start(delay, self._play_loop)
+
+    def _cancel_timer(self):
+        if self.timer_id != -1:
+            self.timer.cancel(self.timer_id)
+            self.timer_id = -1
+
+    def _silence(self):
+        for (chan, midi_code) in self.sounding:
+            self.synth.noteoff(chan, midi_code)
+        self.sounding = set()
 
-        if te.staccato is None:
-            te.staccato = staccato 
+    def _clear_highlights(self):
+        p_evt = PlayerVisualEvent(PlayerVisualEvent.CLEAR_ALL, TabEvent(6))
+        Signals.player_visual_event.emit(p_evt)
+
+    def play(self, position: float = 0.0):
+        with self.timer_loop_lock:
+            self._cancel_timer()
+            self.position = position
+            self.index = self.timeline.index_at(position)
+            self.t0 = time.perf_counter() - position
+        self._play_loop()
+
+    def seek(self, position: float):
+        "jump to 'position' seconds into the timeline"
+        with self.timer_loop_lock:
+            self._cancel_timer()
+            self._silence()
+        self._clear_highlights()
+        if self.is_playing.is_set():
+            self.play(position)
         else:
-            staccato = te.staccato
+            self.position = position
+            self.index = self.timeline.index_at(position)
 
+    def resume(self):
+        if self.index < len(self.timeline.events):
+            self.play(self.position)
 
-    return result    
+    def pause(self):
+        with self.timer_loop_lock:
+            self._cancel_timer()
+            if self.is_playing.is_set():
+                self.position = self._now()
+            self._silence()
 
+    def stop(self):
+        with self.timer_loop_lock:
+            self._cancel_timer()
+            self._silence()
+            self.index = 0
+            self.position = 0.0
+        self._clear_highlights()
 
 
-class track_player_api(QObject):
-    """ 
-    internal api for player thead
+class dispatcher_player_api(song_player_api):
+    """
+    Same interface as song_player_api but the audio events of the
+    timeline are handed to the gcsynth libev dispatcher in batches, all
+    relative to a common epoch, so note timing does not depend on the GIL
+    or on the Qt event loop. Highlights and effect changes are sent as
+    EV_PROGRESS events whose token is the timeline index, the dispatcher
+    calls back into python to execute them.
+
+    WINDOW seconds of events are submitted at a time, a REFILL progress
+    event REFILL_LEAD seconds before the end of a window submits the
+    next one. WINDOW = None submits the whole song in one call.
+    """
+    WINDOW = 4.0
+    REFILL_LEAD = 1.0
+    REFILL = -1
+
+    # every play() gets a new dispatcher group so stale progress
+    # callbacks of a cancelled play can be ignored.
+    groups = itertools.count(1)
+
+    def __init__(self, timeline: SongTimeline, is_playing: thread_event):
+        super().__init__(timeline, is_playing)
+        self.group = 0
+        # index of the first event not yet submitted to the dispatcher
+        self.submitted = 0
+
+    def _now(self) -> float:
+        # gcsynth uses CLOCK_MONOTONIC, same as time.monotonic()
+        return time.monotonic() - self.t0
+
+    def _encode(self, i: int, evt: TimelineEvent):
+        # highlights and effects need python, get called back.
+        te = evt.timer_event(i)
+        te.group = self.group
+        return te.encode()
+
+    def _submit(self):
+        "submit the next window of events, caller holds timer_loop_lock"
+        events = self.timeline.events
+        i = self.submitted
+        if i >= len(events):
+            return
+        end = len(events) if self.WINDOW is None else \
+            self.timeline.index_at(events[i].when + self.WINDOW)
+        end = max(end, i + 1)
+        batch = [self._encode(j, events[j]) for j in range(i, end)]
+        if end < len(events):
+            refill = seq.progress(
+                max(events[i].when, events[end].when - self.REFILL_LEAD) * 1000.0,
+                self.REFILL)
+            refill.group = self.group
+            batch.append(refill.encode())
+        self.submitted = end
+        self.synth.timer_event(batch, self.t0)
+
+    def _on_progress(self, group: int, token: int):
+        "called from the synth service progress thread"
+        with self.timer_loop_lock:
+            if group != self.group or not self.is_playing.is_set():
+                return
+            if token == self.REFILL:
+                self._submit()
+                return
+            self.index = token + 1
+        self._execute(self.timeline.events[token])
+
+    def _cancel_timer(self):
+        if self.group != 0:
+            self.synth.timer_cancel(self.group)
+            self.group = 0
+
+    def _silence(self):
+        # we don't know exactly which notes the dispatcher left on, turn
+        # off everything that was submitted. These are queued behind the
+        # cancel so nothing inflight can turn a note back on afterwards.
+        notes = set((evt.channel, evt.midi_code)
+                    for evt in self.timeline.events[:self.submitted]
+                    if evt.ev_type == EV_NOTEON)
+        batch = [seq.noteoff(0, chan, midi_code).encode()
+                 for (chan, midi_code) in notes]
+        if len(batch) > 0:
+            self.synth.timer_event(batch)
+        self.submitted = self.index
+
+    def play(self, position: float = 0.0):
+        with self.timer_loop_lock:
+            self._cancel_timer()
+            self.group = next(self.groups)
+            self.position = position
+            self.index = self.timeline.index_at(position)
+            self.submitted = self.index
+            self.t0 = time.monotonic() - position
+            self.synth.set_progress_callback(self._on_progress)
+            self._submit()
+
+
+class loop_region:
     """
-    def __init__(self, track: Track, start_measure: int, is_playing: thread_event):
-        super().__init__() 
+    Practice loop over measures start_measure..end_measure (inclusive).
 
-        self.intrument = Instrument(track.instrument_name)
-        self.track = track 
-        self.midx = start_measure # measure index
-        self.expected_tm = None
-        self.timer_id = -1
-        self.timer = GcTimer()
-        self.track.set_moment(start_measure, 0)
-        self.is_playing = is_playing
+    count_in   -> measures of clicks before the first pass
+    tempo      -> tempo of the first pass as a fraction of the written tempo
+    tempo_step -> added to the tempo after every pass until tempo_max, 
+                  e.g. 0.7, 0.05, 1.0 starts at 70% and speeds up 5% a pass
+    """
+    # midi codes of the count-in clicks, the first beat is accented.
+    CLICK_ACCENT = 84
+    CLICK = 79
+
+    def __init__(self, start_measure: int, end_measure: int, count_in: int = 0,
+                 tempo: float = 1.0, tempo_step: float = 0.0, tempo_max: float = 1.0):
+        if end_measure < start_measure:
+            raise ValueError("loop region ends before it starts")
+        if tempo <= 0.0 or tempo_max <= 0.0:
+            raise ValueError("tempo must be positive")
         self.start_measure = start_measure
-        self.timer_loop_lock = Lock()
-        self.current_dynamic_variance : DynamicVariance | None = None
-
-        self.linear_tabs = [] 
-        self.linear_tab_idx = 0
-
-    def _play_current_moment(self) -> Tuple[float,bool]:
+        self.end_measure = end_measure
+        self.count_in = count_in
+        self.tempo = tempo
+        self.tempo_step = tempo_step
+        self.tempo_max = tempo_max
+
+    def tempo_at(self, pass_no: int) -> float:
+        "tempo factor of a pass, the count-in (-1) uses the tempo of pass 0"
+        t = self.tempo + self.tempo_step * max(pass_no, 0)
+        if self.tempo_step >= 0.0:
+            return min(t, max(self.tempo_max, self.tempo))
+        return max(t, min(self.tempo_max, self.tempo))
+
+    def count_in_timeline(self, tracks: List[Track], instruments: List[Instrument]) -> SongTimeline:
         """
-        play the current moment within a track, return 
-        (
-           the floating point timeof the next moment,
-           boolean -> are there more moments to play?
-        ) 
-
-        This is called within the timer loop no external calls
-        allowed.
+        clicks at the time signature and bpm of the first measure, played
+        on the first channel of the first instrument.
         """
-        (tab_event, measure) = self.track.current_moment()
-        (ts, bpm, _, _) = self.track.getMeasureParams(measure)
- 
-        # emit signal to update visuals
-        evt = PlayerVisualEvent(PlayerVisualEvent.TABEVENT_HIGHLIGHT_ON, tab_event) 
-        Signals.player_visual_event.emit(evt)
-
-        beat_duration = ts.beat_duration()
-        duration = self.intrument.tab_event(tab_event, bpm, beat_duration, -1, self.track.drum_track)
-        r = self.track.next_moment()
-
-        return (duration,type(r) != type(None))
-        
-    def skip_measure(self):
-        if self.timer_id != -1:
-            self.timer.cancel(self.timer_id)
-        self.track.skip_measure() 
-    
-    def previous_measure(self):
-        if self.timer_id != -1:
-            self.timer.cancel(self.timer_id)
-        self.track.previous_measure()
-        
-    def _play_loop(self, i, linear_tabs):
-        self.linear_tab_idx = i
-        if i < len(linear_tabs) and self.is_playing.is_set():
-            (tab_event, measure) = linear_tabs[i]
-            (ts, bpm, _, _) = self.track.getMeasureParams(measure)
-    
-            # emit signal to update visuals
-            evt = PlayerVisualEvent(PlayerVisualEvent.TABEVENT_HIGHLIGHT_ON, tab_event) 
-            evt.measure = measure
-            Signals.player_visual_event.emit(evt)
-
-            if i > 0:
-                (prev_tab_event, prev_measure) = linear_tabs[i-1]
-                p_evt = PlayerVisualEvent(PlayerVisualEvent.TABEVENT_HIGHLIGHT_OFF, prev_tab_event)
-                p_evt.measure = prev_measure 
-                Signals.player_visual_event.emit(p_evt)
-
-            beat_duration = ts.beat_duration()
-
-            override_velocity = -1
-            if tab_event.dynamic_variance != None:
-                if not tab_event.dynamic_variance.enabled:
-                    self.current_dynamic_variance = None 
-                else:
-                    if self.current_dynamic_variance == None:
-                        tab_event.dynamic_variance.reset()
-                        self.current_dynamic_variance = tab_event.dynamic_variance
-
-            if self.current_dynamic_variance:
-                override_velocity = self.current_dynamic_variance.getDynamic( # type: ignore
-                    ts.beats_per_measure,
-                    tab_event.duration,
-                    tab_event.dynamic
-                )
-
-            duration = self.intrument.tab_event(tab_event, bpm, beat_duration, \
-                override_velocity, self.track.drum_track)
-            
-            # call next moment 
-            self.timer_id = self.timer.start(duration, 
-                self._play_loop, (i+1,linear_tabs))
-            
-        elif i == len(linear_tabs) and len(linear_tabs) > 0:
-            (prev_tab_event, prev_measure) = linear_tabs[i-1]
-            p_evt = PlayerVisualEvent(PlayerVisualEvent.TABEVENT_HIGHLIGHT_OFF, prev_tab_event)
-            p_evt.measure = prev_measure 
-            Signals.player_visual_event.emit(p_evt)
-
+        timeline = SongTimeline(tracks, instruments)
+        if self.count_in <= 0 or len(tracks) == 0:
+            return timeline
+        track = tracks[0]
+        (ts, bpm, _, _) = track.getMeasureParams(track.measures[self.start_measure])
+        beat = 60.0 / bpm
+        chan = min(instruments[0].get_channels_used())
+        for i in range(self.count_in * ts.beats_per_measure):
+            on = TimelineEvent(i * beat, EV_NOTEON, 0)
+            on.channel = chan
+            on.midi_code = self.CLICK_ACCENT if i % ts.beats_per_measure == 0 else self.CLICK
+            on.velocity = 100
+            off = TimelineEvent((i + 0.25) * beat, EV_NOTEOFF, 0)
+            off.channel = chan
+            off.midi_code = on.midi_code
+            timeline.events += [on, off]
+        timeline.duration = self.count_in * ts.beats_per_measure * beat
+        timeline.finalize()
+        return timeline
+
+
+class loop_player_api(dispatcher_player_api):
+    """
+    Plays a compiled loop region over and over on the gcsynth dispatcher.
+    The region is compiled once, each pass is submitted with its own 
+    epoch and tempo so passes follow each other without a gap and
+    nothing is recompiled or reallocated. Pass -1 is the count-in.
 
-        elif self.timer_id != -1:
-            self.timer.cancel(self.timer_id)
-            self.timer_id = -1
+    Positions (_now, seek, pause) are relative to the start of the pass
+    that is playing, in timeline seconds at the written tempo.
+    """
+    def __init__(self, timeline: SongTimeline, is_playing: thread_event,
+                 region: loop_region, count_in: SongTimeline):
+        super().__init__(timeline, is_playing)
+        self.region = region
+        self.count_in = count_in
+        # pass being submitted to the dispatcher
+        self.pass_no = 0
+        # pass -> (epoch, tempo) for passes submitted and not yet finished
+        self.passes = {}
+        self.notes = set((evt.channel, evt.midi_code)
+            for evt in timeline.events + count_in.events if evt.ev_type == EV_NOTEON)
+
+    def _pass_timeline(self, pass_no: int) -> SongTimeline:
+        return self.count_in if pass_no < 0 else self.timeline
+
+    def playing_pass(self) -> int:
+        "pass that is playing now, -1 during the count-in"
+        now = time.monotonic()
+        started = [p for (p, (epoch, _)) in self.passes.items() if epoch <= now]
+        return max(started) if len(started) > 0 else min(self.passes, default=0)
+
+    def _now(self) -> float:
+        p = self.playing_pass()
+        if p not in self.passes:
+            return self.position
+        (epoch, tempo) = self.passes[p]
+        return (time.monotonic() - epoch) * tempo
+
+    def _encode_pass(self, i: int, evt: TimelineEvent, tempo: float):
+        # progress tokens carry the pass so highlights of the count-in
+        # and of earlier passes can be told apart.
+        te = evt.timer_event(self.pass_no * len(self.timeline.events) + i)
+        te.when = evt.when * 1000.0 / tempo
+        te.group = self.group
+        return te.encode()
+
+    def _next_pass(self):
+        (epoch, tempo) = self.passes[self.pass_no]
+        epoch += self._pass_timeline(self.pass_no).duration / tempo
+        self.pass_no += 1
+        self.passes[self.pass_no] = (epoch, self.region.tempo_at(self.pass_no))
+        self.submitted = 0
+        # forget passes that have finished
+        now = time.monotonic()
+        for p in [p for (p, (e, _)) in self.passes.items() if p < self.pass_no - 1 and e < now]:
+            del self.passes[p]
+
+    def _submit(self):
+        "submit the next window of the current pass, caller holds timer_loop_lock"
+        timeline = self._pass_timeline(self.pass_no)
+        if self.submitted >= len(timeline.events):
+            self._next_pass()
+            timeline = self._pass_timeline(self.pass_no)
+        events = timeline.events
+        (epoch, tempo) = self.passes[self.pass_no]
+        i = self.submitted
+        batch = []
+        end = i
+        if i < len(events):
+            end = len(events) if self.WINDOW is None else \
+                timeline.index_at(events[i].when + self.WINDOW * tempo)
+            end = max(end, i + 1)
+            batch = [self._encode_pass(j, events[j], tempo) for j in range(i, end)]
+        # always come back, at the end of a pass to start the next one.
+        window_end = events[end].when if end < len(events) else timeline.duration
+        window_start = events[i].when if i < len(events) else 0.0
+        refill = seq.progress(
+            max(window_start, window_end - self.REFILL_LEAD * tempo) * 1000.0 / tempo,
+            self.REFILL)
+        refill.group = self.group
+        batch.append(refill.encode())
+        self.submitted = end
+        self.synth.timer_event(batch, epoch)
+
+    def _on_progress(self, group: int, token: int):
+        "called from the synth service progress thread"
+        with self.timer_loop_lock:
+            if group != self.group or not self.is_playing.is_set():
+                return
+            if token == self.REFILL:
+                self._submit()
+                return
+            (pass_no, i) = divmod(token, len(self.timeline.events))
+            if pass_no == self.playing_pass():
+                self.index = i + 1
+        self._execute(self.timeline.events[i])
+
+    def _silence(self):
+        batch = [seq.noteoff(0, chan, midi_code).encode()
+                 for (chan, midi_code) in self.notes]
+        if len(batch) > 0:
+            self.synth.timer_event(batch)
+
+    def play(self, position: float = 0.0):
+        """
+        start the loop at 'position' within the pass that was playing, 
+        a fresh start plays the count-in first.
+        """
+        with self.timer_loop_lock:
+            p = self.playing_pass() if len(self.passes) > 0 else \
+                (-1 if len(self.count_in.events) > 0 else 0)
+            self._cancel_timer()
+            self.group = next(self.groups)
+            self.pass_no = p
+            tempo = self.region.tempo_at(p)
+            self.passes = {p: (time.monotonic() - position / tempo, tempo)}
+            self.position = position
+            timeline = self._pass_timeline(p)
+            self.index = timeline.index_at(position)
+            self.submitted = self.index
+            self.synth.set_progress_callback(self._on_progress)
+            self._submit()
 
-        
-    def play(self):
-        self.linear_tabs = compile_track(self.track)
-        if len(self.linear_tabs) > 0:
-            self.is_playing.set()
-            self._play_loop(0, self.linear_tabs)     
+    def pause(self):
+        with self.timer_loop_lock:
+            self._cancel_timer()
+            if self.is_playing.is_set():
+                self.position = self._now()
+                # resume where we are, at the same tempo.
+                p = self.playing_pass()
+                self.passes = {p: self.passes[p]} if p in self.passes else {}
+            self._silence()
 
     def resume(self):
-        if self.linear_tab_idx < len(self.linear_tabs):
-            self.is_playing.set()
-            self._play_loop(self.linear_tab_idx, self.linear_tabs)
-        else:
-            self.play()
-
-    #expected_tm = None
-
-    def timer_loop(self):      
-        # if we are still playing
-        if self.is_playing.is_set():
-            # if self.expected_tm:
-            #     drift = self.expected_tm - time.perf_counter()
-            #     print(f"drift = {drift}")        
-
-            # play all note(s) in this moment in the measure, return
-            # the number of milliseconds till for the next moment.
-            duration_secs, more_moments = self._play_current_moment()
-            if more_moments:
-                #self.expected_tm = time.perf_counter() + duration_secs
-                self.timer = GcTimer().start(duration_secs, self.timer_loop, ())
+        self.play(self.position)
 
-        
-    def stop(self, reset_start_measure=True):
-        if self.timer_id != -1:
-            self.timer.cancel(self.timer_id)
-            self.timer_id = -1
-        self.intrument.stop()    
-
-        if reset_start_measure:
-            self.linear_tab_idx = 0
-            self.linear_tabs = []
-            self.track.set_moment(self.start_measure, 0)
-
-        p_evt = PlayerVisualEvent(PlayerVisualEvent.CLEAR_ALL, TabEvent(6))
-        Signals.player_visual_event.emit(p_evt)
+    def stop(self):
+        super().stop()
+        self.passes = {}
+        self.pass_no = 0
 
-    def pause(self):
-        # stop but do not rewind to starting meaasure
-        self.stop(False)
 
+# 'dispatcher' schedules audio events in gcsynth, 'timer' dispatches
+# them from python with GcTimer.
+PLAYER_MODE = os.environ.get("GC_PLAYER_MODE", "dispatcher")
 
 
 class Player:
-    def __init__(self, tracks : List[Track], start_measure = 0):
+    """
+    Plays a list of tracks. The tracks are compiled once into a single
+    timeline, see services.songCompiler.
+    """
+    def __init__(self, tracks : List[Track], start_measure = 0, mode = None,
+                 loop : loop_region | None = None):
         self.is_playing = thread_event()
         self.is_playing.clear()
-        self.track_players = []
-        for track in tracks:
-            p = track_player_api(track, start_measure, self.is_playing) 
-            self.track_players.append(p)
+        self.tracks = tracks
+        self.instruments = [Instrument(t.instrument_name, t.tuning) for t in tracks]
+        if loop is not None:
+            # looping is done by the dispatcher, start_measure and mode 
+            # don't apply.
+            self.timeline = compile_region(tracks, self.instruments, 
+                                           loop.start_measure, loop.end_measure)
+            self.song_player = loop_player_api(self.timeline, self.is_playing, loop,
+                loop.count_in_timeline(tracks, self.instruments))
+            return
+        self.timeline = compile_song(tracks, self.instruments, start_measure)
+        if (mode or PLAYER_MODE) == "dispatcher":
+            self.song_player = dispatcher_player_api(self.timeline, self.is_playing)
+        else:
+            self.song_player = song_player_api(self.timeline, self.is_playing)
         
     def start(self):
-        self.is_playing.set()
-        for p in self.track_players:
-            p.timer_loop()
+        self.play()
 
     def skip_measure(self): 
-        self.is_playing.clear()
-        for p in self.track_players:
-            p.skip_measure() 
-        self.start()
+        sp = self.song_player
+        sp.seek(self.timeline.measure_start(sp._now() if self.is_playing.is_set() 
+                                            else sp.position, 1))
 
     def previous_measure(self):
-        self.is_playing.clear() 
-        for p in self.track_players:
-            p.previous_measure() 
-        self.start()
+        sp = self.song_player
+        sp.seek(self.timeline.measure_start(sp._now() if self.is_playing.is_set() 
+                                            else sp.position, -1))
 
     def stop(self):
         self.is_playing.clear()
-        for p in self.track_players:
-            p.stop()
+        self.song_player.stop()
+        for instr in self.instruments:
+            instr.free_resources()
+        self.instruments = []
 
     def pause(self):
-        for p in self.track_players:
-            p.pause()
-            p.expected_tm = None
+        self.song_player.pause()
+        self.is_playing.clear()
 
     def resume(self):
-        for p in self.track_players:
-            p.resume()
+        self.is_playing.set()
+        self.song_player.resume()
 
     def play(self):
-        for p in self.track_players:
-            p.play()
+        if len(self.timeline.events) > 0:
+            self.is_playing.set()
+            self.song_player.play()
 
 
 def unittest():
@@ -0,0 +1,731 @@
+"""
+Binary project file format (.gc)
+
+Songs used to be saved by pickling the whole Song object graph, every
+TabEvent with its uuid string, layout lists and Effects copies. This
+format stores the same data column wise, one section per track:
+
+    preamble   b"GCPF", u16 version, u16 flags, u32 header length
+    header     zlib(json) song attributes, interned effects and the
+               track index: offset/length of each section plus the
+               track attributes, so a track list can be shown without
+               decoding any measures.
+    sections   zlib per track, a small json description followed by
+               packed little endian arrays (measures then tab events,
+               the frets of all tab events as one array).
+
+Effect definitions (plugin path, label, controls) are stored once per
+file, tab events and tracks refer to an interned set of parameter values.
+Attributes the schema doesn't know about are pickled per object so
+nothing is lost, they are expected to be rare.
+
+With read_song(lazy=True) tracks are decoded when first used, see
+models.song.TrackList, tracks that were never loaded are copied as is
+when the song is saved.
+
+Files that don't start with the magic are old pickled songs, see
+read_song, they are converted the next time they are saved.
+"""
+import argparse
+import json
+import math
+import os
+import pickle
+import struct
+import sys
+import threading
+import zlib
+from array import array
+from typing import Dict, List, Tuple
+
+from models.effect import Effect, Effects
+from models.measure import DynamicVariance, Measure, TabEvent, TimeSig
+from models.song import Song, TrackList, TrackStub
+from models.track import Track
+
+MAGIC = b"GCPF"
+FORMAT_VERSION = 1
+PREAMBLE = struct.Struct("<4sHHI")
+
+# zlib level for the header and the track sections
+COMPRESS_LEVEL = 6
+
+_BIG_ENDIAN = sys.byteorder == "big"
+
+
+class ProjectFormatError(ValueError):
+    "not a project file or a newer version of the format"
+
+
+# derived/cache attributes that are never saved
+SKIPPED = frozenset(('_owner', '_rev'))
+
+# attributes stored in columns or the header, anything else ends up in
+# the pickled extras of the object.
+SONG_FIELDS = SKIPPED | frozenset(('uuid', 'tracks', 'title', 'author', 'poly_rythm_tracks', 'filename'))
+TRACK_FIELDS = SKIPPED | frozenset(('track_edit_id', 'instrument_name', 'tuning', 'current_measure',
+                'drum_track', 'cleff', 'measures', 'effects'))
+MEASURE_FIELDS = SKIPPED | frozenset(('_timesig', '_bpm', '_key', '_tab_events', 'staff_changes',
+                  'current_tab_event', 'start_repeat', 'end_repeat',
+                  'repeat_count', 'measure_number', 'beat_error_msg', 'cleff'))
+TAB_EVENT_FIELDS = SKIPPED | frozenset(('uuid', 'duration', 'string', 'fret', 'tied_notes', 'note_ypos',
+                    'tuplet_selected_enabled', 'pitch_bend_active', 'points',
+                    'pitch_changes', 'pitch_range', 'dotted', 'double_dotted',
+                    'render_dynamic', 'dynamic', 'dynamic_variance', 'tuplet_code',
+                    'legato', 'staccato', 'render_clear_articulation', 'upstroke',
+                    'downstroke', 'stroke_duration', 'stroke_duration_index',
+                    'effects', 'num_gstrings', 'tuplet_group_id',
+                    # added to every tab event by the pickle migration
+                    'actual_duration'))
+
+# measure flags
+M_START_REPEAT = 1
+M_END_REPEAT = 2
+M_STAFF_CHANGES = 4
+M_TIMESIG = 8
+M_BPM_FLOAT = 16
+
+# tab event flags, legato and staccato are None/False/True in two bits
+T_DOTTED = 1
+T_DOUBLE_DOTTED = 2
+T_RENDER_DYNAMIC = 4
+T_PITCH_BEND = 8
+T_TUPLET_ENABLED = 16
+T_CLEAR_ARTICULATION = 32
+T_UPSTROKE = 64
+T_DOWNSTROKE = 128
+T_LEGATO_SHIFT = 8
+T_STACCATO_SHIFT = 10
+
+NONE_INT = -32768
+NO_CLEFF = -2
+
+# name -> array typecode, the order is the order in the section. Names
+# are unique across both.
+MEASURE_COLUMNS = (
+    ('number', 'i'), ('repeat_count', 'i'), ('flags', 'B'),
+    ('ts_beats', 'h'), ('ts_note', 'h'), ('bpm', 'd'), ('key', 'i'),
+    ('cleff', 'i'), ('errmsg', 'i'), ('events', 'I'), ('current', 'i'))
+TAB_EVENT_COLUMNS = (
+    ('uuid', 'B'), ('duration', 'd'), ('string', 'b'), ('strings', 'B'),
+    ('num_gstrings', 'B'), ('fret', 'h'), ('tied', 'B'), ('te_flags', 'H'),
+    ('dynamic', 'h'), ('tuplet_code', 'h'), ('pitch_range', 'd'),
+    ('stroke_duration', 'd'), ('stroke_index', 'h'), ('effects', 'i'),
+    ('group', 'i'), ('actual_duration', 'd'))
+
+
+def _pack(typecode: str, values) -> bytes:
+    a = array(typecode, values)
+    if _BIG_ENDIAN:
+        a.byteswap()
+    return a.tobytes()
+
+
+def _unpack(typecode: str, data: bytes) -> array:
+    a = array(typecode)
+    a.frombytes(data)
+    if _BIG_ENDIAN:
+        a.byteswap()
+    return a
+
+
+def _tristate(v) -> int:
+    return 0 if v is None else (2 if v else 1)
+
+
+def _from_tristate(v: int):
+    return None if v == 0 else v == 2
+
+
+class string_table:
+    "interned strings of a section, index -1 is None"
+
+    def __init__(self):
+        self.strings: List[str] = []
+        self.index: Dict[str, int] = {}
+
+    def add(self, s) -> int:
+        if s is None:
+            return -1
+        i = self.index.get(s)
+        if i is None:
+            i = self.index[s] = len(self.strings)
+            self.strings.append(s)
+        return i
+
+
+class effects_table:
+    """
+    Interned effects of a song. An Effect definition (plugin, label,
+    controls) is stored once, an Effects object is a list of
+    [key, definition, enabled, selected, {param: value}].
+    """
+
+    def __init__(self, data: dict | None = None):
+        self.defs: List[dict] = []
+        self.def_index: Dict[str, int] = {}
+        self.sets: List[list] = []
+        self.set_index: Dict[str, int] = {}
+        if data is not None:
+            # the table of a saved song, its track sections stay valid
+            for d in data["defs"]:
+                self.def_index[json.dumps(d, sort_keys=True)] = len(self.defs)
+                self.defs.append(d)
+            for entries in data["sets"]:
+                self.set_index[json.dumps(entries)] = len(self.sets)
+                self.sets.append(entries)
+
+    def _add_def(self, e: Effect) -> int:
+        d = {"name": e.get_name(), "label": e.label, "path": e.path,
+             "eclass": e.eclass, "controls": e.controls}
+        key = json.dumps(d, sort_keys=True)
+        i = self.def_index.get(key)
+        if i is None:
+            i = self.def_index[key] = len(self.defs)
+            self.defs.append(d)
+        return i
+
+    def add(self, effects: Effects | None) -> int:
+        if effects is None:
+            return -1
+        entries = []
+        for (key, e) in effects.etable.items():
+            values = {name: p.current_value for (name, p) in e.params.items()}
+            entries.append([key, self._add_def(e), e.enabled, e.selected, values])
+        k = json.dumps(entries)
+        i = self.set_index.get(k)
+        if i is None:
+            i = self.set_index[k] = len(self.sets)
+            self.sets.append(entries)
+        return i
+
+    def json_data(self) -> dict:
+        return {"defs": self.defs, "sets": self.sets}
+
+
+class effects_loader:
+    "builds Effects from an effects_table, a new object per reference"
+
+    def __init__(self, data: dict):
+        self.defs = data.get("defs", [])
+        self.sets = data.get("sets", [])
+
+    def get(self, i: int) -> Effects | None:
+        if i < 0:
+            return None
+        effects = Effects()
+        for (key, d, enabled, selected, values) in self.sets[i]:
+            spec = self.defs[d]
+            e = Effect(spec["name"], spec["label"], spec["path"],
+                       spec["controls"], spec["eclass"])
+            e.enabled = enabled
+            e.selected = selected
+            for (name, v) in values.items():
+                if name in e.params:
+                    e.params[name].current_value = v
+            effects.etable[key] = e
+        return effects
+
+
+def _extras(obj, known: frozenset) -> dict:
+    d = obj.__dict__
+    if d.keys() <= known:
+        return {}
+    return {k: d[k] for k in d.keys() - known}
+
+
+def _uuid_bytes(u) -> bytes | None:
+    "the 16 bytes of a canonical uuid string, None if it isn't one"
+    if type(u) is not str or len(u) != 36 or not u.islower() or \
+        u[8] != '-' or u[13] != '-' or u[18] != '-' or u[23] != '-':
+        return None
+    try:
+        return bytes.fromhex(u.replace('-', ''))
+    except ValueError:
+        return None
+
+
+def _flag_values(flags: int) -> tuple:
+    return (bool(flags & T_DOTTED), bool(flags & T_DOUBLE_DOTTED),
+            bool(flags & T_RENDER_DYNAMIC), bool(flags & T_PITCH_BEND),
+            bool(flags & T_TUPLET_ENABLED), bool(flags & T_CLEAR_ARTICULATION),
+            bool(flags & T_UPSTROKE), bool(flags & T_DOWNSTROKE),
+            _from_tristate((flags >> T_LEGATO_SHIFT) & 3),
+            _from_tristate((flags >> T_STACCATO_SHIFT) & 3))
+
+
+def _encode_track(track: Track, etable: effects_table) -> Tuple[dict, bytes]:
+    "returns (header entry, compressed section)"
+    strings = string_table()
+    extras = {}
+    sparse = {}
+    mcols = {name: [] for (name, _) in MEASURE_COLUMNS}
+    tcols = {name: [] for (name, _) in TAB_EVENT_COLUMNS}
+    uuids = bytearray()
+    # bound appends, this loop runs for every tab event of the song
+    (duration, string, n_strings, num_gstrings, fret, tied, te_flags, dynamic,
+     tuplet_code, pitch_range, stroke_duration, stroke_index, te_effects,
+     group, actual_duration) = [
+        tcols[name].append if name not in ('fret', 'tied') else tcols[name].extend
+        for (name, _) in TAB_EVENT_COLUMNS[1:]]
+
+    ti = 0
+    for (mi, m) in enumerate(track.measures):
+        ts = m.timesig
+        bpm = m.bpm
+        flags = (M_START_REPEAT if m.start_repeat else 0) | \
+            (M_END_REPEAT if m.end_repeat else 0) | \
+            (M_STAFF_CHANGES if m.staff_changes else 0) | \
+            (M_TIMESIG if ts is not None else 0) | \
+            (M_BPM_FLOAT if isinstance(bpm, float) else 0)
+        mcols['number'].append(m.measure_number)
+        mcols['repeat_count'].append(m.repeat_count)
+        mcols['flags'].append(flags)
+        mcols['ts_beats'].append(ts.beats_per_measure if ts is not None else 0)
+        mcols['ts_note'].append(ts.beat_note_id if ts is not None else 0)
+        mcols['bpm'].append(math.nan if bpm is None else bpm)
+        mcols['key'].append(strings.add(m.key))
+        mcols['cleff'].append(strings.add(m.cleff) if 'cleff' in m.__dict__ else NO_CLEFF)
+        mcols['errmsg'].append(strings.add(m.beat_error_msg))
+        mcols['events'].append(len(m.tab_events))
+        mcols['current'].append(m.current_tab_event)
+        x = _extras(m, MEASURE_FIELDS)
+        if ts is not None and (type(ts) is not TimeSig or len(vars(ts)) != 2):
+            # not something the columns can hold
+            x['_timesig'] = ts
+        if x:
+            extras[f"m{mi}"] = x
+
+        for te in m.tab_events:
+            x = _extras(te, TAB_EVENT_FIELDS)
+            u = _uuid_bytes(te.uuid)
+            if u is None:
+                u = bytes(16)
+                x['uuid'] = te.uuid
+            uuids += u
+            flags = (T_DOTTED if te.dotted else 0) | \
+                (T_DOUBLE_DOTTED if te.double_dotted else 0) | \
+                (T_RENDER_DYNAMIC if te.render_dynamic else 0) | \
+                (T_PITCH_BEND if te.pitch_bend_active else 0) | \
+                (T_TUPLET_ENABLED if te.tuplet_selected_enabled else 0) | \
+                (T_CLEAR_ARTICULATION if te.render_clear_articulation else 0) | \
+                (T_UPSTROKE if te.upstroke else 0) | \
+                (T_DOWNSTROKE if te.downstroke else 0) | \
+                (_tristate(te.legato) << T_LEGATO_SHIFT) | \
+                (_tristate(te.staccato) << T_STACCATO_SHIFT)
+            n = len(te.fret)
+            duration(te.duration)
+            string(te.string)
+            n_strings(n)
+            num_gstrings(te.num_gstrings)
+            fret(te.fret)
+            tied(map(bool, te.tied_notes[:n]))
+            if len(te.tied_notes) != n:
+                x['tied_notes'] = te.tied_notes
+            te_flags(flags)
+            dynamic(NONE_INT if te.dynamic is None else te.dynamic)
+            tuplet_code(te.tuplet_code)
+            pitch_range(te.pitch_range)
+            stroke_duration(te.stroke_duration)
+            stroke_index(NONE_INT if te.stroke_duration_index is None
+                         else te.stroke_duration_index)
+            te_effects(-1 if te.effects is None else etable.add(te.effects))
+            group(-1 if te.tuplet_group_id is None else strings.add(te.tuplet_group_id))
+            actual_duration(te.__dict__.get('actual_duration', math.nan))
+
+            # rare, variable length attributes, see _load_sparse
+            s = {}
+            if te.pitch_changes:
+                s['pitch_changes'] = te.pitch_changes
+            if te.points is not None:
+                s['points'] = te.points
+            if te.dynamic_variance is not None:
+                s['dynamic_variance'] = vars(te.dynamic_variance)
+            if s:
+                sparse[str(ti)] = s
+            if x:
+                extras[f"t{ti}"] = x
+            ti += 1
+    tcols['uuid'] = uuids
+
+    columns = []
+    blobs = []
+    for (layout, cols) in ((MEASURE_COLUMNS, mcols), (TAB_EVENT_COLUMNS, tcols)):
+        for (name, typecode) in layout:
+            data = _pack(typecode, cols[name])
+            columns.append([name, typecode, len(data)])
+            blobs.append(data)
+
+    desc = {
+        "measures": len(track.measures),
+        "tab_events": ti,
+        "strings": strings.strings,
+        "columns": columns,
+        "sparse": sparse
+    }
+    x = _extras(track, TRACK_FIELDS)
+    if extras or x:
+        desc["extras"] = len(blobs)
+        blobs.append(pickle.dumps((x, extras), pickle.HIGHEST_PROTOCOL))
+        columns.append(["extras", "", len(blobs[-1])])
+
+    d = json.dumps(desc).encode('utf-8')
+    section = zlib.compress(struct.pack("<I", len(d)) + d + b"".join(blobs),
+                            COMPRESS_LEVEL)
+    entry = {
+        "track_edit_id": track.track_edit_id,
+        "instrument_name": track.instrument_name,
+        "tuning": track.tuning,
+        "current_measure": track.current_measure,
+        "drum_track": track.drum_track,
+        "cleff": track.cleff,
+        "effects": etable.add(track.effects),
+        "measures": len(track.measures)
+    }
+    return (entry, section)
+
+
+def _load_sparse(te: TabEvent, s: dict):
+    "rare, variable length attributes, set directly so loading isn't an edit"
+    d = te.__dict__
+    if 'pitch_changes' in s:
+        d['pitch_changes'] = [tuple(p) for p in s['pitch_changes']]
+    if 'points' in s:
+        d['points'] = [tuple(p) for p in s['points']]
+    if 'dynamic_variance' in s:
+        dv = DynamicVariance.__new__(DynamicVariance)
+        dv.__dict__.update(s['dynamic_variance'])
+        d['dynamic_variance'] = dv
+
+
+def _decode_track(entry: dict, section: bytes, effects: effects_loader) -> Track:
+    data = zlib.decompress(section)
+    (dlen,) = struct.unpack_from("<I", data)
+    desc = json.loads(data[4:4 + dlen])
+    pos = 4 + dlen
+    cols = {}
+    blobs = {}
+    for (name, typecode, length) in desc["columns"]:
+        blob = data[pos:pos + length]
+        pos += length
+        if typecode:
+            cols[name] = _unpack(typecode, blob) if name != 'uuid' else blob
+        else:
+            blobs[name] = blob
+    (track_x, extras) = pickle.loads(blobs["extras"]) if "extras" in blobs else ({}, {})
+    strings = desc["strings"]
+    sparse = desc["sparse"]
+
+    def string(i):
+        return None if i < 0 else strings[i]
+
+    t_uuid = cols['uuid'].hex()
+    t_duration = cols['duration'].tolist()
+    t_string = cols['string'].tolist()
+    t_strings = cols['strings'].tolist()
+    t_gstrings = cols['num_gstrings'].tolist()
+    t_fret = cols['fret'].tolist()
+    t_tied = [v == 1 for v in cols['tied']]
+    t_flags = cols['te_flags'].tolist()
+    t_dynamic = cols['dynamic'].tolist()
+    t_tuplet = cols['tuplet_code'].tolist()
+    t_range = cols['pitch_range'].tolist()
+    t_stroke = cols['stroke_duration'].tolist()
+    t_stroke_index = cols['stroke_index'].tolist()
+    t_effects = cols['effects'].tolist()
+    t_group = cols['group'].tolist()
+    t_actual = cols['actual_duration'].tolist()
+    # flags -> decoded values, there are only a few distinct ones
+    flag_values = {}
+
+    measures = []
+    ti = 0
+    fi = 0
+    for mi in range(desc["measures"]):
+        flags = cols['flags'][mi]
+        ts = None
+        if flags & M_TIMESIG:
+            ts = TimeSig()
+            ts.beats_per_measure = cols['ts_beats'][mi]
+            ts.beat_note_id = cols['ts_note'][mi]
+        bpm = cols['bpm'][mi]
+        if math.isnan(bpm):
+            bpm = None
+        elif not flags & M_BPM_FLOAT:
+            bpm = int(bpm)
+
+        tab_events = []
+        for _ in range(cols['events'][mi]):
+            n = t_strings[ti]
+            f = t_flags[ti]
+            fv = flag_values.get(f)
+            if fv is None:
+                fv = flag_values[f] = _flag_values(f)
+            dynamic = t_dynamic[ti]
+            stroke_index = t_stroke_index[ti]
+            h = t_uuid[ti * 32:ti * 32 + 32]
+            te = TabEvent.__new__(TabEvent)
+            te.__dict__.update({
+                'uuid': f"{h[:8]}-{h[8:12]}-{h[12:16]}-{h[16:20]}-{h[20:]}",
+                'duration': t_duration[ti],
+                'string': t_string[ti],
+                'fret': t_fret[fi:fi + n],
+                'tied_notes': t_tied[fi:fi + n],
+                # layout, recomputed when the staff is drawn
+                'note_ypos': [-1] * n,
+                'tuplet_selected_enabled': fv[4],
+                'pitch_bend_active': fv[3],
+                'points': None,
+                'pitch_changes': [],
+                'pitch_range': t_range[ti],
+                'dotted': fv[0],
+                'double_dotted': fv[1],
+                'render_dynamic': fv[2],
+                'dynamic': None if dynamic == NONE_INT else dynamic,
+                'dynamic_variance': None,
+                'tuplet_code': t_tuplet[ti],
+                'legato': fv[8],
+                'staccato': fv[9],
+                'render_clear_articulation': fv[5],
+                'upstroke': fv[6],
+                'downstroke': fv[7],
+                'stroke_duration': t_stroke[ti],
+                'stroke_duration_index': None if stroke_index == NONE_INT else stroke_index,
+                'effects': effects.get(t_effects[ti]),
+                'num_gstrings': t_gstrings[ti],
+                'tuplet_group_id': None if t_group[ti] < 0 else strings[t_group[ti]]
+            })
+            if t_actual[ti] == t_actual[ti]:
+                # not nan, only in projects imported from pickles
+                te.__dict__['actual_duration'] = t_actual[ti]
+            if sparse:
+                s = sparse.get(str(ti))
+                if s is not None:
+                    _load_sparse(te, s)
+            if extras:
+                x = extras.get(f"t{ti}")
+                if x is not None:
+                    te.__dict__.update(x)
+            tab_events.append(te)
+            ti += 1
+            fi += n
+
+        m = Measure.__new__(Measure)
+        m.__dict__.update({
+            '_timesig': ts,
+            '_bpm': bpm,
+            '_key': string(cols['key'][mi]),
+            'staff_changes': bool(flags & M_STAFF_CHANGES),
+            '_tab_events': tab_events,
+            'current_tab_event': cols['current'][mi],
+            'start_repeat': bool(flags & M_START_REPEAT),
+            'end_repeat': bool(flags & M_END_REPEAT),
+            'repeat_count': cols['repeat_count'][mi],
+            'measure_number': cols['number'][mi],
+            'beat_error_msg': string(cols['errmsg'][mi]) or ""
+        })
+        if cols['cleff'][mi] != NO_CLEFF:
+            m.__dict__['cleff'] = string(cols['cleff'][mi])
+        x = extras.get(f"m{mi}")
+        if x is not None:
+            m.__dict__.update(x)
+        measures.append(m)
+
+    state = {
+        'track_edit_id': entry["track_edit_id"],
+        'instrument_name': entry["instrument_name"],
+        'tuning': entry["tuning"],
+        'current_measure': entry["current_measure"],
+        'drum_track': entry["drum_track"],
+        'cleff': entry["cleff"],
+        'measures': measures,
+        'effects': effects.get(entry["effects"])
+    }
+    state.update(track_x)
+    track = Track.__new__(Track)
+    track.__setstate__(state)
+    return track
+
+
+def encode_song(song: Song) -> bytes:
+    tracks = song.track_entries()
+    # tracks not loaded since the song was opened are copied, the effects
+    # they refer to are kept at the same index.
+    source = None
+    for t in tracks:
+        if isinstance(t, TrackStub) and t.track is None:
+            source = t.source
+            break
+    etable = effects_table(source.header["effects"] if source else None)
+
+    entries = []
+    sections = []
+    offset = 0
+    for track in tracks:
+        if isinstance(track, TrackStub):
+            if track.track is None and track.source is source:
+                (entry, section) = source.section(track.index)
+            else:
+                (entry, section) = _encode_track(track.load(), etable)
+        else:
+            (entry, section) = _encode_track(track, etable)
+        entry["offset"] = offset
+        entry["length"] = len(section)
+        offset += len(section)
+        entries.append(entry)
+        sections.append(section)
+
+    header = {
+        "song": {
+            "uuid": song.uuid,
+            "title": song.title,
+            "author": song.author,
+            "poly_rythm_tracks": song.poly_rythm_tracks,
+            "filename": song.filename
+        },
+        "effects": etable.json_data(),
+        "tracks": entries
+    }
+    x = _extras(song, SONG_FIELDS)
+    if x:
+        header["extras"] = pickle.dumps(x, pickle.HIGHEST_PROTOCOL).hex()
+    h = zlib.compress(json.dumps(header).encode('utf-8'), COMPRESS_LEVEL)
+    return PREAMBLE.pack(MAGIC, FORMAT_VERSION, 0, len(h)) + h + b"".join(sections)
+
+
+def is_project_file(data: bytes) -> bool:
+    "data, the first bytes of a file"
+    return data[:len(MAGIC)] == MAGIC
+
+
+def read_header(f) -> Tuple[dict, int]:
+    """
+    Read the header of an open project file, returns (header, offset of
+    the first track section).
+    """
+    pre = f.read(PREAMBLE.size)
+    if len(pre) < PREAMBLE.size or not is_project_file(pre):
+        raise ProjectFormatError("not a GuitarComposer project file")
+    (_, version, _, hlen) = PREAMBLE.unpack(pre)
+    if version > FORMAT_VERSION:
+        raise ProjectFormatError(
+            f"project file version {version} is newer than this version of "
+            f"GuitarComposer (supports {FORMAT_VERSION})")
+    try:
+        header = json.loads(zlib.decompress(f.read(hlen)))
+    except (zlib.error, ValueError) as e:
+        raise ProjectFormatError(f"corrupt project header: {e}")
+    return (header, PREAMBLE.size + hlen)
+
+
+class project_reader:
+    """
+    An open project file that tracks are loaded from on demand. The file
+    stays open until every track has been loaded, saving replaces the
+    file (see write_song) so this one keeps reading the old content.
+    """
+    def __init__(self, f):
+        self.f = f
+        (self.header, self.base) = read_header(f)
+        self.effects = effects_loader(self.header["effects"])
+        self.pending = set(range(len(self.header["tracks"])))
+        # tracks may be loaded by the player or the autosave thread
+        self.lock = threading.Lock()
+
+    def section(self, i: int) -> Tuple[dict, bytes]:
+        "(header entry, compressed section) of track i"
+        entry = self.header["tracks"][i]
+        with self.lock:
+            self.f.seek(self.base + entry["offset"])
+            section = self.f.read(entry["length"])
+        if len(section) != entry["length"]:
+            raise ProjectFormatError("truncated project file")
+        return (dict(entry), section)
+
+    def load(self, i: int) -> Track:
+        (entry, section) = self.section(i)
+        try:
+            track = _decode_track(entry, section, self.effects)
+        except (zlib.error, ValueError, KeyError, IndexError, struct.error) as e:
+            raise ProjectFormatError(f"corrupt track section: {e}")
+        with self.lock:
+            self.pending.discard(i)
+            if not self.pending:
+                self.f.close()
+        return track
+
+    def song(self, lazy: bool) -> Song:
+        header = self.header
+        song = Song.__new__(Song)
+        song.__dict__.update(header["song"])
+        if "extras" in header:
+            song.__dict__.update(pickle.loads(bytes.fromhex(header["extras"])))
+        n = len(header["tracks"])
+        if lazy and n > 0:
+            song.tracks = TrackList(
+                TrackStub(info, self, i) for (i, info) in enumerate(header["tracks"]))
+        else:
+            song.tracks = [self.load(i) for i in range(n)]
+        return song
+
+
+def read_project(f, lazy: bool = False) -> Song:
+    """
+    decode a song from an open project file, with 'lazy' the file is
+    kept open and closed once every track is loaded.
+    """
+    return project_reader(f).song(lazy)
+
+
+def write_song(song: Song, file_name: str):
+    "save in the current format, the old file is replaced atomically"
+    data = encode_song(song)
+    tmp = file_name + ".tmp"
+    with open(tmp, 'wb') as f:
+        f.write(data)
+    os.replace(tmp, file_name)
+
+
+def read_song(file_name: str, lazy: bool = False) -> Song:
+    """
+    load a saved song, old pickled projects are imported. With 'lazy'
+    tracks are loaded when they are first used, see models.song.TrackList.
+    Raises OSError, ProjectFormatError or pickle.PickleError.
+    """
+    f = open(file_name, 'rb')
+    try:
+        if is_project_file(f.read(len(MAGIC))):
+            f.seek(0)
+            song = read_project(f, lazy)
+            if isinstance(song.tracks, TrackList):
+                # closed by the reader
+                f = None
+            return song
+        # pre binary format, the __setstate__ methods of the models
+        # migrate old data.
+        f.seek(0)
+        return pickle.load(f)
+    finally:
+        if f is not None:
+            f.close()
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(
+        description="Convert pickled .gc projects to the binary project format")
+    parser.add_argument("files", nargs="+", help=".gc project files, converted in place")
+    args = parser.parse_args(argv)
+
+    failed = 0
+    for file_name in args.files:
+        try:
+            write_song(read_song(file_name), file_name)
+            print(f"{file_name}: converted")
+        except Exception as e:
+            print(f"{file_name}: FAILED {e.__class__.__name__}: {e}")
+            failed += 1
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -4,8 +4,10 @@ This service is responsible for managing the persistence of projects.
 Considerations going forward are that in the future songs might include
 live audio clips and other resources not just the pickling of data.
 
-QSettings is used to persist data.
+QSettings is used to persist data. Songs are saved in the binary format
+of services.projectFormat, old pickled songs are still read.
 """
+import logging
 import pickle
 import marshal
 import os
@@ -17,6 +19,18 @@ from PyQt6.QtWidgets import QFileDialog, QWidget, QMessageBox
 
 from view.events import Signals
 from models.song import Song
+from services.projectFormat import ProjectFormatError, write_song
+from services.projectFormat import read_song as _read_song
+from services.autosave import Autosave, journal_path, recover
+
+
+def read_song(file_name, lazy=False) -> Song:
+    """
+    load a saved song, raises OSError, ProjectFormatError or 
+    pickle.PickleError. No Qt involved so it can be used by command 
+    line tools. With 'lazy' tracks are loaded when first used.
+    """
+    return _read_song(file_name, lazy)
 
 
 @singleton
@@ -58,9 +72,8 @@ class ProjectManager(QObject):
         )
         if len(file_name) > 0:
             try:
-                with open(file_name, 'wb') as file:  
-                    pickle.dump(song, file)
-            except pickle.PickleError as e:
+                write_song(song, file_name)
+            except (OSError, pickle.PickleError) as e:
                 errmsg = f"Error loading {file_name} " + str(e)
                 QMessageBox.critical(
                     None,
@@ -69,16 +82,22 @@ class ProjectManager(QObject):
                     QMessageBox.StandardButton.Ok
                 )
             finally:
+                # autosaved changes of the old file are in the new one
+                Autosave().unwatch(song)
                 song.filename = file_name
                 self.project_dir = os.path.dirname(file_name)
                 self.opened_projects[song.title] = song.filename
+                Autosave().watch(song)
                 return True
         return False 
 
     def save_song(self, song: Song, allow_dialog=True):
-        if len(song.filename) > 0:
-            with open(song.filename, 'wb') as file:  
-                pickle.dump(song, file)
+        if Autosave().is_watched(song) and os.access(song.filename, os.F_OK):
+            # the autosave journal is written to the file in the background
+            Autosave().save(song)
+        elif len(song.filename) > 0:
+            write_song(song, song.filename)
+            Autosave().watch(song)
         elif allow_dialog:
             self.save_using_dialog(song)
 
@@ -101,6 +120,8 @@ class ProjectManager(QObject):
         return song
     
     def close_song(self, s: Song):
+        # closed without saving, the journal is dropped
+        Autosave().unwatch(s)
         if s.title in self.opened_projects:
             del self.opened_projects[s.title]
 
@@ -112,12 +133,21 @@ class ProjectManager(QObject):
             errmsg = f"File {file_name} is inaccessible, please check permissions"
         else:
             try:
-                # load saved work
-                with open(file_name, 'rb') as file:  # 'rb' for reading in binary mode
-                    song = pickle.load(file)
+                # changes autosaved before a crash
+                recovered = False
+                if os.access(journal_path(file_name), os.F_OK):
+                    song = recover(file_name)
+                    recovered = song is not None
+                    if recovered:
+                        logging.warning(f"{file_name}: recovered autosaved changes")
+                if song is None:
+                    # load saved work, tracks are loaded when they are
+                    # selected in the navigator or played.
+                    song = read_song(file_name, lazy=True)
+                    song.filename = file_name
             except FileNotFoundError:
                 errmsg = f"File {file_name} not found"
-            except pickle.PickleError as e:
+            except (pickle.PickleError, ProjectFormatError) as e:
                 errmsg = f"Error loading {file_name} " + str(e)
             
             if errmsg:
@@ -130,7 +160,8 @@ class ProjectManager(QObject):
             else:
                 assert(song)
                 self.project_dir = os.path.dirname(file_name)
-                self.opened_projects[song.title] = song.filename            
+                self.opened_projects[song.title] = song.filename
+                Autosave().watch(song, recovered)
 
         return song
 
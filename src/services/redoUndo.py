@@ -1,14 +1,27 @@
-import os
 from PyQt6.QtCore import QObject
 from singleton_decorator import singleton
+from models.measure import Measure
 from models.track import Track
+from models.revision import model_revision
 from view.events import Signals
+from typing import Dict, List, Tuple
 
-import uuid
-import pickle
 import atexit
+import collections
+import itertools
+import logging
+import os
+import pickle
+import tempfile
+import time
+import zlib
 
-CHANGE_PATH_SPEC = "/tmp/gc-edit-"
+# Undo history budgets in bytes per track. The most recent edits are kept
+# compressed in memory, older ones spill to an append-only journal file, 
+# once the journal grows past its budget the oldest edits are coalesced.
+UNDO_MEMORY_BUDGET = int(os.environ.get("GC_UNDO_MEMORY_BUDGET", 4 << 20))
+UNDO_JOURNAL_BUDGET = int(os.environ.get("GC_UNDO_JOURNAL_BUDGET", 64 << 20))
+UNDO_JOURNAL_DIR = os.environ.get("GC_UNDO_DIR", tempfile.gettempdir())
 
 def recursive_diff(obj1, obj2, visited=None):
     if visited is None:
@@ -55,111 +68,454 @@ def recursive_diff(obj1, obj2, visited=None):
     return diffs
 
 
-class track_change_entry:
+def measure_state(m: Measure) -> bytes:
+    "pickled measure less the cursor, moving the cursor is not an edit"
+    state = m.__getstate__()
+    state.pop('current_tab_event', None)
+    return pickle.dumps(state)
+
+
+def load_measure(data: bytes) -> Measure:
+    m = Measure.__new__(Measure)
+    m.__setstate__(pickle.loads(data))
+    m.current_tab_event = 0
+    return m
+
+
+def track_state(track: Track) -> bytes:
+    "pickled track attributes, everything but the measures and the cursor"
+    state = track.__getstate__()
+    state.pop('measures', None)
+    state.pop('current_measure', None)
+    return pickle.dumps(state)
+
+
+class track_delta:
+    """
+    A single edit. Measures are identified by keys that stay the same 
+    while a measure is edited (see track_change_entry).
+
+    changes      -> key -> (before, after) pickled measures, None if the 
+                    measure didn't exist before/after the edit
+    order_*      -> measure keys in track order, None if no measures 
+                    were added, removed or moved
+    track_*      -> track_state before/after, None if unchanged
+    cursor_*     -> current measure before/after
+    keyframe     -> (pickled track, order) after this edit, kept every 
+                    KEYFRAME_INTERVAL edits
+    """
+    __slots__ = ('changes', 'order_before', 'order_after', 'track_before',
+                 'track_after', 'cursor_before', 'cursor_after', 'keyframe')
+
+    def __init__(self):
+        self.changes: Dict[int, Tuple[bytes | None, bytes | None]] = {}
+        self.order_before = None
+        self.order_after = None
+        self.track_before = None
+        self.track_after = None
+        self.cursor_before = 0
+        self.cursor_after = 0
+        self.keyframe = None
+
+
+def coalesce(a: track_delta, b: track_delta) -> track_delta:
+    "a single delta that has the effect of a followed by b"
+    r = track_delta()
+    for key in set(a.changes) | set(b.changes):
+        before = a.changes[key][0] if key in a.changes else b.changes[key][0]
+        after = b.changes[key][1] if key in b.changes else a.changes[key][1]
+        if before != after:
+            r.changes[key] = (before, after)
+    if a.order_after is not None or b.order_after is not None:
+        r.order_before = a.order_before if a.order_before is not None else b.order_before
+        r.order_after = b.order_after if b.order_after is not None else a.order_after
+    if a.track_after is not None or b.track_after is not None:
+        r.track_before = a.track_before if a.track_before is not None else b.track_before
+        r.track_after = b.track_after if b.track_after is not None else a.track_after
+    r.cursor_before = a.cursor_before
+    r.cursor_after = b.cursor_after
+    r.keyframe = b.keyframe
+    return r
+
+
+class history_slot:
     """
-    just keep adding history redo is diabled, undo enabled
-    history = [c1, c2, c3] 
-                        ^
-                       current
+    A compressed, pickled track_delta. 'data' while it is in memory, 
+    'offset' into the journal once spilled.
+    """
+    __slots__ = ('data', 'offset', 'length', 'keyframe')
 
-                   << undo
-                   >> redo     
+    def __init__(self, data: bytes, keyframe: bool):
+        self.data = data
+        self.offset = -1
+        self.length = len(data)
+        self.keyframe = keyframe
 
-    history = [c1, c2, c3]  use does an undo
-                   ^
-                  current
 
-                  redo can take us back to c3 unless
-                  there is a change, if a change then
-                  [c1,c2,c4] with c4 being current                 
+class track_change_entry:
     """
+    Undo/redo history of a track as a list of deltas.
+
+    history = [d1, d2, d3] 
+                          ^
+                         index, number of deltas applied
+
+                   << undo reverts d3
+                   >> redo re-applies it     
+
+    An edit after an undo drops the deltas after index.
+
+    Each delta only holds the measures that changed so undo/redo patch 
+    the track in place at a cost that depends on the size of the edit.
+    Candidate measures are those around the cursor (before and after the 
+    edit) and those whose tab event list changed, everything else is 
+    assumed unchanged. A full pickle of the track is kept every 
+    KEYFRAME_INTERVAL edits, if we are asked to undo/redo a track object
+    other than the one the history was recorded against the state is 
+    rebuilt from the closest keyframe.
 
-    def filename(self):
-        r = str(uuid.uuid4())
-        # unique to track and current change
-        return f"{CHANGE_PATH_SPEC}{id(self.track)}-{r}"
+    Storage, deltas are compressed history_slots:
+
+    history = [ journal ... | memory ... ]
+                 ^ spilled    ^ newest, at most memory_budget bytes
+
+    Once the journal file is larger than journal_budget it is compacted,
+    dead entries (dropped by an edit after undo) are removed and the 
+    oldest deltas are coalesced into one so the starting state can still
+    be reached but not every step in between.
+    """
+    KEYFRAME_INTERVAL = 50
 
     def update(self, track: Track):
-        "if strack changed save changes"
-        potential_new = pickle.dumps(track)
-        # MODEL_UPDATE will cause potential_new == self.current 
-        if potential_new != self.current:
-            new = potential_new
-            fn = self.filename()
-            with open(fn, 'wb') as file:
-                file.write(new)
-            self.current = new
-            if self.index == len(self.history):
-                self.history.append(fn)
-                self.index += 1
-            else:
-                self.history[self.index] = fn
-                self.history = self.history[:self.index+1] 
+        "if the track changed record a delta"
+        # a different track object, everything is compared.
+        full = track is not self.track
+        self.track = track
+        if not full and model_revision() == self.seen and \
+            len(track.measures) == len(self.order):
+            # nothing was edited, cursor movement or a redraw
+            self.cursor = track.current_measure
+            return
+        seen = self.seen
+        self.seen = model_revision()
+
+        delta = track_delta()
+        order = []
+        for (pos, m) in enumerate(track.measures):
+            key = None if full else self.key_of.get(id(m))
+            if key is None or self.live.get(key) is not m:
+                key = next(self.keys)
+            order.append(key)
+            sig = self.sigs.get(key)
+            if full or m.revision() > seen or sig is None or \
+                len(sig) != len(m.tab_events) or \
+                any(a is not b for (a, b) in zip(sig, m.tab_events)):
+                data = measure_state(m)
+                before = self.snap.get(key)
+                if data != before:
+                    delta.changes[key] = (before, data)
+                self._register(key, m, data)
+
+        current = set(order)
+        for key in self.order:
+            if key not in current:
+                delta.changes[key] = (self.snap[key], None)
+                self._unregister(key)
+
+        if order != self.order:
+            delta.order_before = self.order
+            delta.order_after = order
+        t_state = track_state(track) \
+            if full or track._rev > seen else self.track_snap
+        if t_state != self.track_snap:
+            delta.track_before = self.track_snap
+            delta.track_after = t_state
+        delta.cursor_before = self.cursor
+        delta.cursor_after = track.current_measure
+
+        self.order = order
+        self.track_snap = t_state
+        self.cursor = track.current_measure
+        # MODEL_UPDATE and cursor movement cause no change
+        if len(delta.changes) == 0 and delta.order_after is None and \
+            delta.track_after is None:
+            return
+
+        self._truncate(self.index)
+        if (self.index + 1) % self.KEYFRAME_INTERVAL == 0:
+            delta.keyframe = (pickle.dumps(track), list(order))
+        self._append(delta)
+        self.index += 1
             
-    def undo(self) -> Track | None:
+    def undo(self, track: Track) -> Track | None:
         result = None
         if self.index > 0:
+            t0 = time.perf_counter()
+            if track is self.track:
+                self._apply(self._load(self.index - 1), undo=True)
+            else:
+                self._restore(self.index - 1)
             self.index -= 1
-            fn = self.history[self.index]
-            self.current = open(fn,'rb').read()
-            result = pickle.loads(self.current)
-             
+            result = self.track
+            self._timed("undo", t0)
         return result
 
-    def redo(self) -> Track | None:
+    def redo(self, track: Track) -> Track | None:
         result = None
-        if (self.index+1) < len(self.history):
+        if self.index < len(self.history):
+            t0 = time.perf_counter()
+            if track is self.track:
+                self._apply(self._load(self.index), undo=False)
+            else:
+                self._restore(self.index + 1)
             self.index += 1
-            fn = self.history[self.index]
-            self.current = open(fn,'rb').read()
-            result = pickle.loads(self.current) 
-
+            result = self.track
+            self._timed("redo", t0)
         return result
 
+    def stats(self) -> dict:
+        "history size and undo/redo latency"
+        latency = list(self.latency)
+        n = max(len(latency), 1)
+        return {
+            "steps": len(self.history),
+            "index": self.index,
+            "memory_bytes": self.memory_bytes + len(self.base[0]),
+            "journal_bytes": self.journal_bytes,
+            "spilled": self.spilled,
+            "coalesced": self.coalesced,
+            "undo_ms_last": latency[-1] * 1000.0 if len(latency) > 0 else 0.0,
+            "undo_ms_avg": sum(latency) * 1000.0 / n,
+            "undo_ms_max": max(latency, default=0.0) * 1000.0
+        }
+
+    def close(self):
+        "remove the journal"
+        if os.path.exists(self.journal_path):
+            os.remove(self.journal_path)
+        self.journal_bytes = 0
+
+    def _timed(self, op: str, t0: float):
+        dt = time.perf_counter() - t0
+        self.latency.append(dt)
+        logging.debug(f"{op} {dt * 1000.0:.2f} ms, {len(self.history)} steps, "
+                      f"{self.memory_bytes} bytes in memory, {self.journal_bytes} in journal")
+
+    def _append(self, delta: track_delta):
+        data = zlib.compress(pickle.dumps(delta), 1)
+        self.history.append(history_slot(data, delta.keyframe is not None))
+        self.memory_bytes += len(data)
+        if self.memory_bytes > self.memory_budget:
+            self._spill()
+
+    def _truncate(self, n: int):
+        "drop the deltas after n, spilled ones become dead space in the journal"
+        for slot in self.history[n:]:
+            if slot.data is not None:
+                self.memory_bytes -= slot.length
+        del self.history[n:]
+        self.spilled = min(self.spilled, n)
+
+    def _read(self, slot: history_slot, f=None) -> bytes:
+        if slot.data is not None:
+            return slot.data
+        if f is None:
+            with open(self.journal_path, 'rb') as f:
+                return self._read(slot, f)
+        f.seek(slot.offset)
+        return f.read(slot.length)
+
+    def _load(self, i: int) -> track_delta:
+        return pickle.loads(zlib.decompress(self._read(self.history[i])))
+
+    def _spill(self):
+        "move the oldest in memory deltas to the journal, the newest always stays"
+        with open(self.journal_path, 'ab') as f:
+            while self.memory_bytes > self.memory_budget and \
+                self.spilled < len(self.history) - 1:
+                slot = self.history[self.spilled]
+                slot.offset = f.tell()
+                f.write(slot.data)
+                slot.data = None
+                self.memory_bytes -= slot.length
+                self.spilled += 1
+            self.journal_bytes = f.tell()
+        if self.journal_bytes > self.journal_budget:
+            self._compact()
+
+    def _compact(self):
+        """
+        rewrite the journal with only the live spilled deltas, the oldest 
+        ones are coalesced until it is within half the budget.
+        """
+        live = sum(slot.length for slot in self.history[:self.spilled])
+        merged = None
+        n = 0
+        # never coalesce past the undo position so redo still works.
+        while n < min(self.spilled, self.index) and live > self.journal_budget // 2:
+            delta = self._load(n)
+            merged = delta if merged is None else coalesce(merged, delta)
+            live -= self.history[n].length
+            n += 1
+        if n > 0:
+            slot = history_slot(zlib.compress(pickle.dumps(merged), 1), 
+                                merged.keyframe is not None)
+            self.history[:n] = [slot]
+            self.memory_bytes += slot.length
+            self.spilled -= n - 1
+            self.index -= n - 1
+            self.coalesced += n - 1
+
+        tmp = self.journal_path + ".tmp"
+        with open(tmp, 'wb') as out, open(self.journal_path, 'rb') as f:
+            for slot in self.history[:self.spilled]:
+                data = self._read(slot, f)
+                if slot.data is not None:
+                    self.memory_bytes -= slot.length
+                slot.data = None
+                slot.offset = out.tell()
+                out.write(data)
+            self.journal_bytes = out.tell()
+        os.replace(tmp, self.journal_path)
+        logging.info(f"undo journal compacted to {self.journal_bytes} bytes, "
+                     f"{n} steps coalesced")
+
+    def _register(self, key: int, m: Measure, data: bytes):
+        self.live[key] = m
+        self.key_of[id(m)] = key
+        self.sigs[key] = list(m.tab_events)
+        self.snap[key] = data
 
-    def __init__(self, track: Track):
+    def _unregister(self, key: int):
+        m = self.live.pop(key)
+        if self.key_of.get(id(m)) == key:
+            del self.key_of[id(m)]
+        del self.sigs[key]
+        del self.snap[key]
+
+    def _adopt(self, track: Track, order: List[int] | None = None):
+        "index the measures of track, with the given keys if known"
         self.track = track
-        self.changed = False
-        self.current = pickle.dumps(None)
-        # list of change filenames generated of songs.
-        self.history = []
-        self.index = 0 
+        self.live = {}
+        self.key_of = {}
+        self.sigs = {}
+        self.snap = {}
+        self.order = []
+        for (pos, m) in enumerate(track.measures):
+            key = order[pos] if order is not None else next(self.keys)
+            self._register(key, m, measure_state(m))
+            self.order.append(key)
+        self.track_snap = track_state(track)
+        self.cursor = track.current_measure
+        self.seen = model_revision()
+
+    def _apply(self, delta: track_delta, undo: bool):
+        "patch the track in place"
+        track = self.track
+        side = 0 if undo else 1
+        for (key, pair) in delta.changes.items():
+            if key in self.live:
+                self._unregister(key)
+            if pair[side] is not None:
+                self._register(key, load_measure(pair[side]), pair[side])
+
+        order = delta.order_before if undo else delta.order_after
+        if order is not None:
+            self.order = order
+        track.measures = [self.live[key] for key in self.order]
+
+        t_state = delta.track_before if undo else delta.track_after
+        if t_state is not None:
+            track.__dict__.update(pickle.loads(t_state))
+            self.track_snap = t_state
+
+        # put the cursor where the edit was
+        cursor = delta.cursor_before if undo else delta.cursor_after
+        track.current_measure = max(0, min(cursor, len(track.measures) - 1))
+        m = track.measures[track.current_measure]
+        m.current_tab_event = min(m.current_tab_event, len(m.tab_events) - 1)
+        self.cursor = track.current_measure
+        track.measures_changed()
+        self.seen = model_revision()
+
+    def _restore(self, index: int):
+        "rebuild the state after 'index' deltas from the closest keyframe"
+        k = index
+        while k > 0 and not self.history[k-1].keyframe:
+            k -= 1
+        if k == 0:
+            (data, order) = (zlib.decompress(self.base[0]), self.base[1])
+        else:
+            (data, order) = self._load(k-1).keyframe
+        self._adopt(pickle.loads(data), order)
+        for i in range(k, index):
+            self._apply(self._load(i), undo=False)
+
+    def __init__(self, track: Track, memory_budget: int | None = None, 
+                 journal_budget: int | None = None):
+        self.keys = itertools.count()
+        self.history: List[history_slot] = []
+        self.index = 0
+        self._adopt(track)
+        # keyframe for index 0
+        self.base = (zlib.compress(pickle.dumps(track), 1), list(self.order))
+
+        self.memory_budget = UNDO_MEMORY_BUDGET if memory_budget is None else memory_budget
+        self.journal_budget = UNDO_JOURNAL_BUDGET if journal_budget is None else journal_budget
+        self.journal_path = os.path.join(UNDO_JOURNAL_DIR, 
+            f"gc-undo-{os.getpid()}-{id(self)}.journal")
+        # compressed bytes of the deltas in memory / size of the journal file
+        self.memory_bytes = 0
+        self.journal_bytes = 0
+        # history[:spilled] are in the journal
+        self.spilled = 0
+        # number of steps lost to coalescing
+        self.coalesced = 0
+        # seconds, recent undo/redo calls
+        self.latency = collections.deque(maxlen=100)
 
 @singleton
 class RedoUndoProcessor(QObject):
     """
     Keeps track of changes with the current track being edited. Each track is associated
-    with list of changes, the most recent is kept in memory the rest are cached to the temp
-    directory as pickled objects.
+    with a history of deltas, see track_change_entry. Undo/redo patch the 
+    track in place and return it.
     """
     def undo(self, track: Track) -> Track | None:
         entry = self.track_table.get(track.track_edit_id)
         if entry is not None:
-            entry.undo()
-            return entry.undo()     
+            return entry.undo(track)
 
     def redo(self, track: Track) -> Track | None:
         entry = self.track_table.get(track.track_edit_id)
         if entry is not None:
-            return entry.redo()
+            return entry.redo(track)
 
     def update(self, track: Track) -> None:
         assert(track.track_edit_id != "")
         if track.track_edit_id not in self.track_table:
+            # the first update is the starting point of the history
             self.track_table[track.track_edit_id] = track_change_entry(track)
         else:
             # add to track history
             self.track_table[track.track_edit_id].update(track)
 
+    def stats(self, track: Track) -> dict | None:
+        "see track_change_entry.stats"
+        entry = self.track_table.get(track.track_edit_id)
+        if entry is not None:
+            return entry.stats()
+
+    def on_exit(self):
+        for entry in self.track_table.values():
+            entry.close()
+
     def disable_updates(self):
         Signals.redo_undo_update.disconnect(self.update)
 
     def enable_updates(self):
         Signals.redo_undo_update.connect(self.update)
 
-    def on_exit(self):
-        os.system(f"rm -f {CHANGE_PATH_SPEC}* > /dev/null &")
-        
     def __init__(self):
         super().__init__()
         self.track_table = {}
@@ -167,5 +523,3 @@ class RedoUndoProcessor(QObject):
         Signals.redo_undo_update.connect(self.update)
 
         atexit.register(self.on_exit)
-
-    
\ No newline at end of file
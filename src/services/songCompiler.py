@@ -0,0 +1,588 @@
+"""
+Song compiler.
+
+Walks every track of a song once and produces a single timeline, a flat
+list of events sorted by absolute time (seconds from the start of the
+song). The player only has to walk an index through this list, all the
+work of resolving tempo, dynamics, strums, ties and bends is done up front.
+
+    tracks -> CompiledTrack    -> (tab_event, measure) per track
+           -> SongCompiler     -> SongTimeline.events sorted by 'when'
+"""
+from array import array
+from bisect import bisect_left, bisect_right
+import copy
+from typing import Dict, List, Tuple
+
+from models.measure import Measure, TabEvent, DynamicVariance
+from models.note import Note
+from models.song import Song
+from models.track import Track
+from music.constants import Dynamic
+from music.instrument import Instrument
+from services.synth import sequencer as SeqEvt
+
+
+# Event types, the numeric value also orders events that share the same
+# timestamp. Effects are configured before any notes sound and a noteoff
+# always precedes a noteon so a string can be re-plucked in the same instant.
+EV_EFFECTS = 0
+EV_HIGHLIGHT_OFF = 1
+EV_NOTEOFF = 2
+EV_PITCH_RANGE = 3
+EV_NOTEON = 4
+EV_PITCH_WHEEL = 5
+EV_HIGHLIGHT_ON = 6
+
+
+class TimelineEvent:
+    """
+    A single event in the compiled timeline.
+
+    when      -> absolute time in seconds
+    ev_type   -> one of the EV_* constants
+    track_idx -> index of the track (and instrument) that generated the event
+    """
+    __slots__ = ('when', 'ev_type', 'track_idx', 'channel', 'midi_code',
+                 'velocity', 'value', 'gstring', 'tab_event', 'measure',
+                 'effects')
+
+    def __init__(self, when: float, ev_type: int, track_idx: int):
+        self.when = when
+        self.ev_type = ev_type
+        self.track_idx = track_idx
+        self.channel = -1
+        self.midi_code = -1
+        self.velocity = 0
+        self.value = 0.0
+        self.gstring = -1
+        self.tab_event = None
+        self.measure = None
+        self.effects = None
+
+    def sort_key(self):
+        return (self.when, self.ev_type)
+
+    def is_audio(self) -> bool:
+        "can be executed by gcsynth without calling back into python"
+        return self.ev_type in (EV_NOTEON, EV_NOTEOFF, EV_PITCH_WHEEL, EV_PITCH_RANGE)
+
+    def timer_event(self, token: int = -1) -> SeqEvt.timer_event:
+        """
+        gcsynth timer event, 'when' in milliseconds. Highlights and effects
+        become progress events carrying 'token'.
+        """
+        when = self.when * 1000.0
+        if self.ev_type == EV_NOTEON:
+            return SeqEvt.noteon(when, self.channel, self.midi_code, self.velocity)
+        elif self.ev_type == EV_NOTEOFF:
+            return SeqEvt.noteoff(when, self.channel, self.midi_code)
+        elif self.ev_type == EV_PITCH_WHEEL:
+            return SeqEvt.pitch_change(when, self.channel, self.value)
+        elif self.ev_type == EV_PITCH_RANGE:
+            return SeqEvt.pitch_range(when, self.channel, self.value)
+        return SeqEvt.progress(when, token)
+
+    def __repr__(self):
+        return f"TimelineEvent(when={self.when:.4f}, ev_type={self.ev_type}, " \
+            f"channel={self.channel}, midi_code={self.midi_code})"
+
+
+class MeasureMark:
+    """
+    Records where a measure starts in the timeline. Because repeats are
+    unrolled the same measure can have several marks.
+    """
+    __slots__ = ('when', 'track_idx', 'measure_idx', 'measure')
+
+    def __init__(self, when: float, track_idx: int, measure_idx: int, measure: Measure):
+        self.when = when
+        self.track_idx = track_idx
+        self.measure_idx = measure_idx
+        self.measure = measure
+
+
+class SongTimeline:
+    """
+    Result of compiling a song, a sorted list of events plus the
+    instruments that the channels in the events refer to.
+    """
+    def __init__(self, tracks: List[Track], instruments: List[Instrument]):
+        self.tracks = tracks
+        self.instruments = instruments
+        self.events: List[TimelineEvent] = []
+        # parallel array of event times used for bisect lookups
+        self.times: List[float] = []
+        self.measure_marks: List[MeasureMark] = []
+        self.duration = 0.0
+
+    def finalize(self):
+        # python's sort is stable so events generated in the same
+        # instant keep their generation order within the same type.
+        self.events.sort(key=TimelineEvent.sort_key)
+        self.times = [e.when for e in self.events]
+        self.measure_marks.sort(key=lambda mm: (mm.when, mm.track_idx))
+
+    def truncate(self, end: float):
+        """
+        Drop everything scheduled after 'end', notes still sounding at
+        'end' are turned off there so the timeline can be looped.
+        """
+        events = []
+        # (channel, midi_code) -> noteon still sounding
+        sounding: Dict[Tuple[int, int], TimelineEvent] = {}
+        for e in self.events:
+            # a noteoff or highlight off at 'end' closes the last tab event
+            if e.when > end or (e.when == end and \
+                    e.ev_type not in (EV_HIGHLIGHT_OFF, EV_NOTEOFF)):
+                continue
+            if e.ev_type == EV_NOTEON:
+                sounding[(e.channel, e.midi_code)] = e
+            elif e.ev_type == EV_NOTEOFF:
+                sounding.pop((e.channel, e.midi_code), None)
+            events.append(e)
+
+        for ((chan, midi_code), on) in sounding.items():
+            off = TimelineEvent(end, EV_NOTEOFF, on.track_idx)
+            off.channel = chan
+            off.midi_code = midi_code
+            off.gstring = on.gstring
+            events.append(off)
+
+        self.events = events
+        self.measure_marks = [mm for mm in self.measure_marks if mm.when < end]
+        self.duration = end
+        self.finalize()
+
+    def index_at(self, when: float) -> int:
+        "index of the first event scheduled at or after 'when'"
+        return bisect_left(self.times, when)
+
+    def measure_start(self, when: float, offset: int = 0) -> float:
+        """
+        Time of the start of the measure that is playing at 'when',
+        offset = 1 is the following measure, -1 the prior one.
+        """
+        starts = sorted(set(mm.when for mm in self.measure_marks))
+        if len(starts) == 0:
+            return 0.0
+        i = bisect_right(starts, when) - 1 + offset
+        i = max(0, min(i, len(starts) - 1))
+        return starts[i]
+
+
+class CompiledTrack:
+    """ 
+    Copy free view of a track with all repeat loops unravelled so that we
+    have a single vector that the player can walk through.
+
+    No tab events are copied, the view keeps references to the tab events
+    and measures of the track. Repeats are unrolled as (start, end) index
+    ranges into a flat array of the track's tab events and the dynamic, legato
+    and staccato settings resolved for each play position are kept in a
+    side table.
+
+    tab_events/measures -> flat arrays, one entry per tab event in the track
+    ranges              -> [(start, end),...] play order as slices of the flat arrays
+    dynamic/legato/staccato -> resolved values, one entry per play position
+    """
+    def __init__(self, track: Track, m_idx=0):
+        self.track = track
+        self.tab_events: List[TabEvent] = []
+        self.measures: List[Measure] = []
+        self.ranges: List[Tuple[int, int]] = []
+        # start play position of each range, used to bisect positions
+        self.range_pos: List[int] = []
+        self.length = 0
+
+        self._unroll(m_idx)
+        self._resolve()
+
+    @staticmethod
+    def _append_ranges(target: List[Tuple[int, int]], ranges: List[Tuple[int, int]]):
+        "append ranges merging contiguous ones"
+        for (start, end) in ranges:
+            if len(target) > 0 and target[-1][1] == start:
+                target[-1] = (target[-1][0], end)
+            else:
+                target.append((start, end))
+
+    def _unroll(self, m_idx):
+        result = []
+        # each item is the list of ranges within a repeat loop, innermost first.
+        repeat_stack: List[List[Tuple[int, int]]] = []
+
+        while m_idx < len(self.track.measures):
+            m = self.track.measures[m_idx]
+            start = len(self.tab_events)
+            self.tab_events += m.tab_events
+            self.measures += [m] * len(m.tab_events)
+
+            if m.start_repeat:
+                repeat_stack = [[]] + repeat_stack
+
+            target = repeat_stack[0] if len(repeat_stack) > 0 else result
+            self._append_ranges(target, [(start, len(self.tab_events))])
+
+            if m.end_repeat:
+                if len(repeat_stack) > 0:
+                    loop = repeat_stack[0]
+                    del repeat_stack[0]
+                else:
+                    # no start repeat, repeat from the beginning.
+                    loop = result
+                    result = []
+                loop = loop * (m.repeat_count + 1)
+                target = repeat_stack[0] if len(repeat_stack) > 0 else result
+                self._append_ranges(target, loop)
+
+            m_idx += 1
+
+        self.ranges = result
+        pos = 0
+        for (start, end) in self.ranges:
+            self.range_pos.append(pos)
+            pos += end - start
+        self.length = pos
+
+    def _resolve(self):
+        """
+        walk the track applying dynamics and articulations, when encountered they change
+        the settings for the current and all subsiquent tab events until a new one 
+        encountered.
+        """
+        self.dynamic = array('h', bytes(2 * self.length))
+        self.legato = array('b', bytes(self.length))
+        self.staccato = array('b', bytes(self.length))
+
+        dynamic = Dynamic.MF
+        legato = False 
+        staccato = False
+
+        for (pos, idx) in enumerate(self.indexes()):
+            te = self.tab_events[idx]
+            if te.dynamic is not None:
+                dynamic = te.dynamic
+            if te.legato is not None:
+                legato = te.legato 
+            if te.staccato is not None:
+                staccato = te.staccato 
+            self.dynamic[pos] = dynamic
+            self.legato[pos] = legato
+            self.staccato[pos] = staccato
+
+    def indexes(self):
+        "flat array index for each play position"
+        for (start, end) in self.ranges:
+            yield from range(start, end)
+
+    def index(self, pos: int) -> int:
+        "flat array index of play position 'pos'"
+        if pos < 0:
+            pos += self.length
+        if pos < 0 or pos >= self.length:
+            raise IndexError(pos)
+        r = bisect_right(self.range_pos, pos) - 1
+        return self.ranges[r][0] + pos - self.range_pos[r]
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, pos: int) -> Tuple[TabEvent, Measure]:
+        idx = self.index(pos)
+        return (self.tab_events[idx], self.measures[idx])
+
+    def __iter__(self):
+        for idx in self.indexes():
+            yield (self.tab_events[idx], self.measures[idx])
+
+    def resolved(self):
+        "yields (tab_event, measure, dynamic, legato, staccato) in play order"
+        for (pos, idx) in enumerate(self.indexes()):
+            yield (self.tab_events[idx], self.measures[idx],
+                self.dynamic[pos], bool(self.legato[pos]), bool(self.staccato[pos]))
+
+
+def compile_track(track: Track, m_idx=0) -> List[Tuple[TabEvent,Measure]]:
+    """ 
+    Walk through track and generate a list of tab events, unravel all repeat loops
+    so that we have a single vector that the player can walk through.
+
+    Return a List of (tab_event,measure), the tab events are shallow copies
+    with dynamic, legato and staccato resolved. Use CompiledTrack to avoid
+    copying.
+    """
+    result = []
+    for (_te, m, dynamic, legato, staccato) in CompiledTrack(track, m_idx).resolved():
+        te = copy.copy(_te)
+        te.dynamic = dynamic
+        te.legato = legato
+        te.staccato = staccato
+        result.append((te, m))
+    return result
+
+
+class _string_state:
+    "compile time book keeping for a single (channel, guitar string)"
+    def __init__(self):
+        self.midi_code = None
+        # events that would be cancelled if a new note is played
+        # on this string.
+        self.pending: List[TimelineEvent] = []
+
+
+class SongCompiler:
+    """
+    Converts tracks into a SongTimeline. This mirrors what
+    Instrument.tab_event does at play time except that instead of
+    calling the synth and starting timers events are appended to
+    the timeline.
+    """
+
+    def __init__(self, tracks: List[Track], instruments: List[Instrument]):
+        assert len(tracks) == len(instruments)
+        self.timeline = SongTimeline(tracks, instruments)
+        # events cancelled by a later note on the same string
+        self.cancelled = set()
+
+    def _event(self, when: float, ev_type: int, track_idx: int) -> TimelineEvent:
+        evt = TimelineEvent(when, ev_type, track_idx)
+        self.timeline.events.append(evt)
+        return evt
+
+    def _cancel_pending(self, state: _string_state, when: float):
+        for evt in state.pending:
+            if evt.when >= when:
+                self.cancelled.add(id(evt))
+        state.pending = []
+
+    def _noteoff(self, when, track_idx, chan, gstring, state: _string_state):
+        evt = self._event(when, EV_NOTEOFF, track_idx)
+        evt.channel = chan
+        evt.midi_code = state.midi_code
+        evt.gstring = gstring
+        self._cancel_pending(state, when)
+        state.midi_code = None
+
+    def _note(self, when: float, track_idx: int, instr: Instrument,
+              strings: Dict[Tuple[int, int], _string_state],
+              te: TabEvent, gstring: int, midi_code: int, velocity: int,
+              start_offset: float, ev_dur: float, duration: float | None):
+
+        for (chan, velocity_mul) in instr.string_map[gstring]:
+            state = strings.setdefault((chan, gstring), _string_state())
+
+            # If we are already playing a note on this string
+            # then perform a noteoff.
+            if instr.one_note_per_string and state.midi_code is not None:
+                self._noteoff(when, track_idx, chan, gstring, state)
+
+            v = min(int(velocity * velocity_mul), 128)
+            evt = self._event(when + start_offset, EV_NOTEON, track_idx)
+            evt.channel = chan
+            evt.midi_code = midi_code
+            evt.velocity = v
+            evt.gstring = gstring
+            state.midi_code = midi_code
+            if start_offset > 0.0:
+                state.pending.append(evt)
+
+            # is there a pitch bend?
+            if len(te.pitch_changes) > 0:
+                evt = self._event(when, EV_PITCH_RANGE, track_idx)
+                evt.channel = chan
+                evt.value = te.pitch_range if te.pitch_bend_active \
+                    else Note.DEFAULT_PITCH_RANGE
+                for (when_r, semitones) in te.pitch_changes:
+                    evt = self._event(when + when_r * ev_dur, EV_PITCH_WHEEL, track_idx)
+                    evt.channel = chan
+                    evt.value = semitones
+                    state.pending.append(evt)
+
+            if duration is not None and duration > 0:
+                # schedule a noteoff event in the future
+                evt = self._event(when + duration, EV_NOTEOFF, track_idx)
+                evt.channel = chan
+                evt.midi_code = midi_code
+                evt.gstring = gstring
+                state.pending.append(evt)
+
+    def _tie(self, when: float, instr: Instrument,
+             strings: Dict[Tuple[int, int], _string_state],
+             gstring: int, duration: float | None):
+        """
+        A tied note continues to sound, push the pending noteoff for the
+        string out to the end of this tab event.
+        """
+        for (chan, _) in instr.string_map[gstring]:
+            state = strings.get((chan, gstring))
+            if state is None or state.midi_code is None:
+                continue
+            for evt in state.pending:
+                if evt.ev_type == EV_NOTEOFF and evt.when >= when:
+                    if duration is None:
+                        self.cancelled.add(id(evt))
+                    else:
+                        evt.when = when + duration
+
+    def _tab_event(self, when: float, track_idx: int, track: Track,
+                   instr: Instrument, strings, te: TabEvent,
+                   dynamic: int, legato: bool, staccato: bool,
+                   bpm: int, beat_duration: float, override_velocity: int) -> float:
+        te_type = te.classify()
+        beats = te.beats(beat_duration)
+        ev_dur = beats * (60.0 / bpm)
+        no_stroke = not te.upstroke and not te.downstroke
+
+        if te.effects is not None:
+            evt = self._event(when, EV_EFFECTS, track_idx)
+            evt.effects = te.effects
+
+        if te_type == te.REST:
+            for ((chan, gstring), state) in strings.items():
+                if state.midi_code is not None:
+                    self._noteoff(when, track_idx, chan, gstring, state)
+            return ev_dur
+
+        # see Note.set_duration
+        if legato:
+            duration = None
+        elif staccato:
+            duration = ev_dur * 0.5
+        else:
+            duration = ev_dur
+
+        fret_data = list(enumerate(te.fret))
+        start_offset = 0.0
+        start_offset_inc = 0.0
+        velocity = dynamic if override_velocity == -1 else override_velocity
+        if te_type == te.CHORD and not no_stroke:
+            # strum, spread the notes over the stroke duration.
+            if te.downstroke:
+                fret_data.reverse()
+            start_offset_inc = (te.stroke_duration / len(te.fret)) / beat_duration * (60.0 / bpm)
+            # slightly decay velocity as we pick through the strings
+            velocity -= 2
+
+        for (gstring, fret_val) in fret_data:
+            if fret_val == -1:
+                continue
+            if te.tied_notes[gstring]:
+                self._tie(when, instr, strings, gstring, duration)
+                continue
+            if track.drum_track:
+                midi_code = fret_val
+            else:
+                midi_code = instr.tuning[gstring] + fret_val
+            self._note(when, track_idx, instr, strings, te, gstring,
+                midi_code, velocity, start_offset, ev_dur, duration)
+            start_offset += start_offset_inc
+
+        return ev_dur
+
+    def _compile_track(self, track_idx: int, start_measure: int):
+        track = self.timeline.tracks[track_idx]
+        instr = self.timeline.instruments[track_idx]
+        strings: Dict[Tuple[int, int], _string_state] = {}
+        current_dynamic_variance: DynamicVariance | None = None
+        params = {}
+        measure_index = {id(m): i for (i, m) in enumerate(track.measures)}
+        prev_evt = None
+        prev_measure = None
+        # number of tab events played in the current pass of prev_measure
+        measure_pos = 0
+        when = 0.0
+
+        for (te, measure, dynamic, legato, staccato) in \
+                CompiledTrack(track, start_measure).resolved():
+            if id(measure) not in params:
+                params[id(measure)] = track.getMeasureParams(measure)
+            (ts, bpm, _, _) = params[id(measure)]
+            beat_duration = ts.beat_duration()
+
+            # a repeated measure starts over once all its tab events played.
+            if measure is not prev_measure or measure_pos == len(measure.tab_events):
+                self.timeline.measure_marks.append(MeasureMark(
+                    when, track_idx, measure_index[id(measure)], measure))
+                prev_measure = measure
+                measure_pos = 0
+            measure_pos += 1
+
+            # cursor highlighting
+            if prev_evt is not None:
+                evt = self._event(when, EV_HIGHLIGHT_OFF, track_idx)
+                evt.tab_event = prev_evt.tab_event
+                evt.measure = prev_evt.measure
+            prev_evt = self._event(when, EV_HIGHLIGHT_ON, track_idx)
+            prev_evt.tab_event = te
+            prev_evt.measure = measure
+
+            override_velocity = -1
+            if te.dynamic_variance is not None:
+                if not te.dynamic_variance.enabled:
+                    current_dynamic_variance = None
+                elif current_dynamic_variance is None:
+                    # the variance keeps a beat count while playing, use a
+                    # copy so the model is left untouched.
+                    current_dynamic_variance = copy.copy(te.dynamic_variance)
+                    current_dynamic_variance.reset()
+            if current_dynamic_variance:
+                override_velocity = current_dynamic_variance.getDynamic(
+                    ts.beats_per_measure,
+                    te.duration,
+                    dynamic
+                )
+
+            when += self._tab_event(when, track_idx, track, instr, strings,
+                te, dynamic, legato, staccato, bpm, beat_duration, override_velocity)
+
+        if prev_evt is not None:
+            evt = self._event(when, EV_HIGHLIGHT_OFF, track_idx)
+            evt.tab_event = prev_evt.tab_event
+            evt.measure = prev_evt.measure
+
+        # silence anything still ringing at the end of the track.
+        for ((chan, gstring), state) in strings.items():
+            if state.midi_code is not None and \
+                not any(e.ev_type == EV_NOTEOFF and id(e) not in self.cancelled
+                        for e in state.pending):
+                self._noteoff(when, track_idx, chan, gstring, state)
+
+        self.timeline.duration = max(self.timeline.duration, when)
+
+    def compile(self, start_measure: int = 0) -> SongTimeline:
+        for track_idx in range(len(self.timeline.tracks)):
+            self._compile_track(track_idx, start_measure)
+
+        if len(self.cancelled) > 0:
+            self.timeline.events = [e for e in self.timeline.events
+                if id(e) not in self.cancelled]
+        self.timeline.finalize()
+        return self.timeline
+
+
+def compile_song(song: Song | List[Track],
+                 instruments: List[Instrument] | None = None,
+                 start_measure: int = 0) -> SongTimeline:
+    """
+    Compile all the tracks of a song into a single timeline. If instruments
+    are not supplied one is allocated per track.
+    """
+    tracks = song.tracks if isinstance(song, Song) else song
+    if instruments is None:
+        instruments = [Instrument(t.instrument_name, t.tuning) for t in tracks]
+    return SongCompiler(tracks, instruments).compile(start_measure)
+
+
+def compile_region(song: Song | List[Track],
+                   instruments: List[Instrument],
+                   start_measure: int, end_measure: int) -> SongTimeline:
+    """
+    Compile measures start_measure..end_measure (inclusive, repeats within 
+    the region are played) into a timeline that ends where the measure 
+    after end_measure would start, used for loop playback.
+    """
+    timeline = compile_song(song, instruments, start_measure)
+    ends = [mm.when for mm in timeline.measure_marks if mm.measure_idx > end_measure]
+    timeline.truncate(min(ends) if len(ends) > 0 else timeline.duration)
+    return timeline
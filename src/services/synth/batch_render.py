@@ -0,0 +1,120 @@
+"""
+Batch render a directory of .gc projects to audio files.
+
+Each song is rendered offline (see services.synth.bounce) in a worker
+process, every worker starts its own offline gcsynth so songs render in
+parallel.
+
+    python -m services.synth.batch_render ~/Documents/songs -o /tmp/tracks -j 8
+
+Per song throughput is reported as a multiple of real time.
+"""
+import argparse
+import glob
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+
+class render_result:
+    def __init__(self, src: str, dst: str):
+        self.src = src
+        self.dst = dst
+        # seconds of audio and seconds it took to render them
+        self.audio_seconds = 0.0
+        self.wall_seconds = 0.0
+        self.error = None
+
+    def realtime_multiple(self) -> float:
+        if self.wall_seconds <= 0.0:
+            return 0.0
+        return self.audio_seconds / self.wall_seconds
+
+    def __str__(self):
+        name = os.path.basename(self.src)
+        if self.error:
+            return f"{name}: FAILED {self.error}"
+        return f"{name}: {self.audio_seconds:.1f}s of audio in " \
+            f"{self.wall_seconds:.2f}s ({self.realtime_multiple():.1f}x real time)"
+
+
+def _init_worker(start_lock):
+    "runs once in each worker process"
+    from services.synth.synthservice import synthservice
+    # gcsynth.start rewrites sf_info/instruments.json which is then read
+    # back, one worker at a time.
+    with start_lock:
+        synthservice().start(offline=True)
+
+
+def render_one(src: str, dst: str, fmt: str, tail: float) -> render_result:
+    "render a single project, runs in a worker process"
+    from services.projectMngr import read_song
+    from services.synth.synthservice import synthservice
+
+    result = render_result(src, dst)
+    t0 = time.perf_counter()
+    try:
+        song = read_song(src)
+        result.audio_seconds = synthservice().render_to_file(song, dst, fmt, tail)
+    except Exception as e:
+        result.error = f"{e.__class__.__name__}: {e}"
+    result.wall_seconds = time.perf_counter() - t0
+    return result
+
+
+def batch_render(src_dir: str, out_dir: str, fmt: str = "wav",
+                 workers: int = None, tail: float = 2.0, report=print):
+    """
+    Render every .gc file in src_dir to out_dir/<name>.<fmt>, returns the
+    list of render_result in completion order.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    projects = sorted(glob.glob(os.path.join(src_dir, "*.gc")))
+    results = []
+
+    t0 = time.perf_counter()
+    start_lock = multiprocessing.Lock()
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(start_lock,)) as pool:
+        futures = []
+        for src in projects:
+            stem = os.path.splitext(os.path.basename(src))[0]
+            dst = os.path.join(out_dir, f"{stem}.{fmt}")
+            futures.append(pool.submit(render_one, src, dst, fmt, tail))
+
+        for f in as_completed(futures):
+            r = f.result()
+            report(str(r))
+            results.append(r)
+    wall = time.perf_counter() - t0
+
+    audio = sum(r.audio_seconds for r in results if not r.error)
+    failed = len([r for r in results if r.error])
+    report(f"{len(results) - failed} songs, {audio:.1f}s of audio in {wall:.2f}s "
+           f"({audio / wall if wall > 0 else 0.0:.1f}x real time), {failed} failed")
+    return results
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(
+        description="Render a directory of .gc projects to audio files")
+    parser.add_argument("src_dir", help="directory containing .gc project files")
+    parser.add_argument("-o", "--out-dir", default=".",
+                        help="where the audio files are written")
+    parser.add_argument("-f", "--format", default="wav", choices=["wav", "flac"])
+    parser.add_argument("-j", "--workers", type=int, default=os.cpu_count(),
+                        help="number of worker processes")
+    parser.add_argument("--tail", type=float, default=2.0,
+                        help="seconds rendered after the last note")
+    args = parser.parse_args(argv)
+
+    results = batch_render(args.src_dir, args.out_dir, args.format,
+                           args.workers, args.tail)
+    return 1 if any(r.error for r in results) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
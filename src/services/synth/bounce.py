@@ -0,0 +1,134 @@
+"""
+Offline bounce of a song to an audio file.
+
+gcsynth is started with synthservice().start(offline=True), no audio
+device is opened and the soundfonts, per channel LADSPA filters and
+filter graphs are rendered by gcsynth.render_offline as fast as the CPU
+allows. Audio is streamed to the file in chunks as it is rendered.
+
+    synth = synthservice()
+    synth.start(offline=True)
+    synth.render_to_file(song, "song.wav")
+"""
+import os
+import shutil
+import subprocess
+import wave
+
+import gcsynth
+
+
+class wav_writer:
+    "16 bit stereo wav file"
+
+    def __init__(self, path: str, sample_rate: int):
+        self.wav = wave.open(path, "wb")
+        self.wav.setnchannels(2)
+        self.wav.setsampwidth(2)
+        self.wav.setframerate(sample_rate)
+
+    def write(self, pcm: bytes):
+        self.wav.writeframesraw(pcm)
+
+    def close(self):
+        # patches the header with the final length
+        self.wav.close()
+
+
+class flac_writer:
+    """
+    16 bit stereo flac, pcm is piped through the reference 'flac' encoder
+    so it is streamed rather than buffered.
+    """
+
+    def __init__(self, path: str, sample_rate: int):
+        encoder = shutil.which("flac")
+        if encoder is None:
+            raise RuntimeError("flac output needs the 'flac' command line encoder")
+        self.proc = subprocess.Popen(
+            [encoder, "--silent", "--force", "--force-raw-format",
+             "--endian=little", "--sign=signed", "--channels=2", "--bps=16",
+             f"--sample-rate={sample_rate}", "-o", path, "-"],
+            stdin=subprocess.PIPE)
+
+    def write(self, pcm: bytes):
+        self.proc.stdin.write(pcm)
+
+    def close(self):
+        self.proc.stdin.close()
+        if self.proc.wait() != 0:
+            raise RuntimeError(f"flac encoder exited with {self.proc.returncode}")
+
+
+WRITERS = {
+    "wav": wav_writer,
+    "flac": flac_writer
+}
+
+
+class frame_limit:
+    """
+    passes at most 'frames' 16 bit stereo frames on to write, 
+    render_offline renders whole blocks
+    """
+
+    def __init__(self, write, frames: int):
+        self.write_to = write
+        self.left = frames * 4
+
+    def write(self, pcm: bytes):
+        pcm = pcm[:self.left]
+        self.left -= len(pcm)
+        if len(pcm) > 0:
+            self.write_to(pcm)
+
+
+def open_writer(path: str, sample_rate: int, fmt: str = None):
+    "fmt defaults to the file extension"
+    fmt = (fmt or os.path.splitext(path)[1][1:]).lower()
+    if fmt not in WRITERS:
+        raise ValueError(f"unsupported audio format '{fmt}', use one of {list(WRITERS)}")
+    return WRITERS[fmt](path, sample_rate)
+
+
+def render_song(song_or_tracks, path: str, fmt: str = None, tail: float = 2.0) -> float:
+    """
+    Render a song (or list of tracks) to path, 'tail' seconds are added
+    after the last event so notes can ring out. Returns the length of the
+    rendered audio in seconds, the last block is cut to it.
+    """
+    # deferred, the instrument module imports synthservice
+    from music.instrument import Instrument
+    from services.songCompiler import compile_song, EV_EFFECTS
+
+    tracks = song_or_tracks.tracks if hasattr(song_or_tracks, 'tracks') \
+        else song_or_tracks
+
+    # rewind before allocating channels, leftovers of a previous render
+    # would otherwise bleed into this one.
+    gcsynth.render_offline_reset()
+    instruments = [Instrument(t.instrument_name, t.tuning) for t in tracks]
+    try:
+        timeline = compile_song(tracks, instruments)
+        length = timeline.duration + tail
+        writer = open_writer(path, gcsynth.SAMPLE_RATE, fmt)
+        out = frame_limit(writer.write, round(length * gcsynth.SAMPLE_RATE))
+        try:
+            batch = []
+            for evt in timeline.events:
+                if evt.is_audio():
+                    batch.append(evt.timer_event().encode())
+                elif evt.ev_type == EV_EFFECTS:
+                    # effects are configured from python, render everything
+                    # up to this point first.
+                    gcsynth.render_offline(batch, evt.when, out.write)
+                    batch = []
+                    instruments[evt.track_idx].setup_effects(evt.effects)
+            gcsynth.render_offline(batch, length, out.write)
+        finally:
+            writer.close()
+    finally:
+        for instr in instruments:
+            instr.free_resources()
+
+    return length
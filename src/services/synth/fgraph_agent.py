@@ -7,6 +7,8 @@ the filter graph in gcsynth. When the agent is created a filter graph
 is created and when it is destroyed the filter graph is destroyed.
 
 """
+import uuid
+
 from PyQt6 import QtCore
 from models.filterGraph import *
 
@@ -26,14 +28,17 @@ class NodeAgent:
         self.model = model
         self.graph = graph
         self.handle = model.uuid
+        # set when the whole graph is destroyed, gcsynth frees the node with it
+        self.detached = False
 
         graph_id = graph.handle
 
 
-        gcsynth.fgraph_api(gcsynth.FG_API_ADD_NODE, graph_id, self.handle, typeid)
+        graph.api(gcsynth.FG_API_ADD_NODE, graph_id, self.handle, typeid)
 
     def __del__(self):
-        gcsynth.fgraph_api(gcsynth.FG_API_REMOVE_NODE, self.graph.handle, self.handle)
+        if not self.detached and self.graph.handle is not None:
+            gcsynth.fgraph_api(gcsynth.FG_API_REMOVE_NODE, self.graph.handle, self.handle)
 
 
 class InputNodeAgent(NodeAgent):
@@ -62,18 +67,18 @@ class EffectNodeAgent(NodeAgent):
         fg_uuid = self.graph.handle
         effect_uuid = self.handle          
         cmd = gcsynth.FG_API_EFFECT_SETUP
-        gcsynth.fgraph_api(cmd, fg_uuid, effect_uuid, path, label)
+        self.graph.api(cmd, fg_uuid, effect_uuid, path, label)
 
     def set_property(self, pname: str, value: float):
         fg_uuid = self.graph.handle
         effect_uuid = self.handle          
-        gcsynth.fgraph_api(gcsynth.FG_API_EFFECT_SET_PROPERTY, fg_uuid, effect_uuid, pname, value)
+        self.graph.api(gcsynth.FG_API_EFFECT_SET_PROPERTY, fg_uuid, effect_uuid, pname, value)
 
     def set_enabled(self, enabled : bool):
         fg_uuid = self.graph.handle
         effect_uuid = self.handle
         att_id = { True: gcsynth.AID_ENABLE, False: gcsynth.AID_DISABLE }[enabled]
-        gcsynth.fgraph_api(gcsynth.FG_API_SET_ATTR, fg_uuid, effect_uuid, att_id, int(enabled))
+        self.graph.api(gcsynth.FG_API_SET_ATTR, fg_uuid, effect_uuid, att_id, int(enabled))
 
     def __init__(self, graph: 'FilterGraphAgent', model : GraphNode):
         super().__init__(graph, model, gcsynth.FG_NODE_TYPE_EFFECT)
@@ -127,15 +132,119 @@ def agent_from_model(graph: 'FilterGraphAgent', model : GraphNode):
 class FilterGraphAgent(QtCore.QObject):
     updated = QtCore.pyqtSignal(FilterGraph)
 
+    def api(self, *args):
+        "Call gcsynth, or queue the call while a batch is built."
+        if self.batch is not None:
+            self.batch.append(args)
+        else:
+            gcsynth.fgraph_api(*args)
+
     def _add_node(self, gn_model: GraphNode):
         nagent = agent_from_model(self, gn_model)
-        self.node_agents[gn_model.uuid] = nagent
-
+        if isinstance(gn_model, InputNode):
+            self.input_node = nagent
+        elif isinstance(gn_model, OutputNode):
+            self.output_node = nagent
+        else:
+            self.node_agents[gn_model.uuid] = nagent
+
+            if isinstance(gn_model, EffectNode):
+                gn_model.onPropertyChange = self.onPropertyChange
+                gn_model.onEnabledChange = self.onEnabledChange
+
+    def _remove_node(self, gn_model: GraphNode):
+        nagent = self.node_agents.pop(gn_model.uuid, None)
+        if self.input_node is not None and self.input_node.handle == gn_model.uuid:
+            (nagent, self.input_node) = (self.input_node, None)
+        elif self.output_node is not None and self.output_node.handle == gn_model.uuid:
+            (nagent, self.output_node) = (self.output_node, None)
+        if nagent is not None:
+            # removed as part of the batch, not whenever it is collected
+            nagent.detached = True
+            self.api(gcsynth.FG_API_REMOVE_NODE, self.handle, nagent.handle)
+
+    def _connect(self, conn_model: GraphConnection):
+        self.api(
+            gcsynth.FG_API_ADD_CONNECTION, 
+            self.handle, 
+            conn_model.uuid, 
+            conn_model.in_uuid, 
+            conn_model.in_idx, 
+            conn_model.out_uuid, 
+            conn_model.out_idx)
+
+    def _send_settings(self, gn_model: GraphNode, past: GraphNode | None):
+        """
+        Send the settings of gn_model that differ from the past version
+        of the node, all of them for a node that was just added.
+        """
+        settings = gn_model.settings()
+        past_settings = past.settings() if past is not None else {}
+        node_uuid = gn_model.uuid
+
+        if isinstance(gn_model, EffectNode):
+            past_properties = past_settings.get('properties', {})
+            for (pname, value) in settings['properties'].items():
+                if past is None or past_properties.get(pname) != value:
+                    self.api(gcsynth.FG_API_EFFECT_SET_PROPERTY, 
+                        self.handle, node_uuid, pname, float(value))
+            # effects start enabled
+            if past_settings.get('enabled', True) != settings['enabled']:
+                att_id = { True: gcsynth.AID_ENABLE, False: gcsynth.AID_DISABLE }[settings['enabled']]
+                self.api(gcsynth.FG_API_SET_ATTR, self.handle, node_uuid, att_id, int(settings['enabled']))
+            return
+
+        if isinstance(gn_model, LowPassNode):
+            att_ids = { 'threshold': gcsynth.AID_LOW_PASS_FREQ }
+        elif isinstance(gn_model, HighPassNode):
+            att_ids = { 'threshold': gcsynth.AID_HIGH_PASS_FREQ }
+        elif isinstance(gn_model, BandPassNode):
+            att_ids = { 
+                'low_threshold': gcsynth.AID_BAND_PASS_LOW_FREQ,
+                'high_threshold': gcsynth.AID_BAND_PASS_HIGH_FREQ 
+            }
+        else:
+            att_ids = {}
+        for (key, att_id) in att_ids.items():
+            if past_settings.get(key) != settings[key]:
+                self.api(gcsynth.FG_API_SET_ATTR, self.handle, node_uuid, att_id, float(settings[key]))
 
     def on_update(self, new_model: FilterGraph):
+        """
+        Patch the gcsynth graph to match the edited model. Only what the
+        diff with the current model reports is sent, as one batch, so 
+        gcsynth compiles the graph once and the audio thread runs the 
+        old graph until then.
+        """
         report = new_model.diff(self.model)
         if report['change_occured']:
-            pass
+            self.batch = []
+            try:
+                # gcsynth needs a node's connections gone before the node
+                for conn_model in report['connections_removed']:
+                    self.api(gcsynth.FG_API_REMOVE_CONNECTION, self.handle, conn_model.uuid)
+                for gn_model in report['nodes_removed']:
+                    self._remove_node(gn_model)
+                for gn_model in report['nodes_added']:
+                    self._add_node(gn_model)
+                    self._send_settings(gn_model, None)
+                for gn_model in report['nodes_updated']:
+                    self._send_settings(gn_model, self.model.nodes[gn_model.uuid])
+                for conn_model in report['connections_added']:
+                    self._connect(conn_model)
+                batch = self.batch
+            finally:
+                self.batch = None
+            gcsynth.fgraph_api(gcsynth.FG_API_BATCH, self.handle, batch)
+
+        # the agents follow the new model's nodes
+        for (node_uuid, nagent) in self.node_agents.items():
+            gn_model = new_model.nodes[node_uuid]
+            nagent.model = gn_model
+            if isinstance(gn_model, EffectNode):
+                gn_model.onPropertyChange = self.onPropertyChange
+                gn_model.onEnabledChange = self.onEnabledChange
+        self.model = new_model
 
     def onPropertyChange(self, node_uuid, key, value):
         nagent = self.node_agents.get(node_uuid)
@@ -145,7 +254,7 @@ class FilterGraphAgent(QtCore.QObject):
     def onEnabledChange(self, node_uuid, enabled):
         nagent = self.node_agents.get(node_uuid)
         if isinstance(nagent, EffectNodeAgent):
-            pass
+            nagent.set_enabled(enabled)
 
     def setup(self):
         """ 
@@ -156,62 +265,14 @@ class FilterGraphAgent(QtCore.QObject):
 
         # setup nodes first.
         for gn_model in self.model.nodes.values():
-            nagent = agent_from_model(self, gn_model)
-            if isinstance(gn_model, InputNode):
-                self.input_node = nagent
-            elif isinstance(gn_model, OutputNode):
-                self.output_node = nagent
-            else:
-                self.node_agents[gn_model.uuid] = nagent
-
-                if isinstance(gn_model, EffectNode):
-                    gn_model.onPropertyChange = self.onPropertyChange
-                    gn_model.onEnabledChange = self.onEnabledChange
+            self._add_node(gn_model)
 
         for conn_model in self.model.connections.values():
-            in_idx = conn_model.in_idx
-            out_idx = conn_model.out_idx
-            in_uuid = conn_model.in_uuid
-            out_uuid = conn_model.out_uuid
-
-            # print(f"self.model.connections {self.model.connections}")
-            # conn_model.pretty_print(self.model)
-
-            gcsynth.fgraph_api(
-                gcsynth.FG_API_ADD_CONNECTION, 
-                self.handle, 
-                conn_model.uuid, 
-                in_uuid, 
-                in_idx, 
-                out_uuid, 
-                out_idx)
-            
-
-        # # setup connections.
-        # for gn_model in self.model.nodes.values():
-        #     for conn_model in gn_model.in_ports:
-        #         #KLUGE: why are these swapped?
-        #         # temp = conn_model.in_uuid 
-        #         # conn_model.in_uuid = conn_model.out_uuid
-        #         # conn_model.out_uuid = temp
-
-        #         in_idx = conn_model.in_idx
-        #         out_idx = conn_model.out_idx
-        #         in_uuid = conn_model.in_uuid
-        #         out_uuid = conn_model.out_uuid
-
-        #         conn_model.pretty_print(self.model)
-
-        #         gcsynth.fgraph_api(
-        #            gcsynth.FG_API_ADD_CONNECTION, 
-        #            self.handle, 
-        #            conn_model.uuid, 
-        #            in_uuid, 
-        #            in_idx, 
-        #            out_uuid, 
-        #            out_idx)
+            self._connect(conn_model)
         
-        # filter setup, now enable it.
+        # filter setup, order the nodes into the plan the audio thread
+        # runs, then enable it.
+        gcsynth.fgraph_api(gcsynth.FG_API_COMPILE, self.handle)
         gcsynth.fgraph_api(gcsynth.FG_API_ENABLE, self.handle)
 
 
@@ -222,6 +283,18 @@ class FilterGraphAgent(QtCore.QObject):
             channel
         )
 
+    def install_on_channel(self, channel: int):
+        """
+        Crossfade the channel from whatever graph it runs to this one 
+        while it plays. The graph is already built, the audio thread only
+        picks up the pointer.
+        """
+        gcsynth.fgraph_api(
+            gcsynth.FG_API_INSTALL_ON_CHANNEL,
+            self.handle,
+            channel
+        )
+
     def unassign_from_channel(self, channel):
         # I should have called it unassign from channel, nice English dave ;)
         gcsynth.fgraph_api(
@@ -234,9 +307,14 @@ class FilterGraphAgent(QtCore.QObject):
         super().__init__()
 
         self.node_agents = {}
+        # commands queued by on_update, see api()
+        self.batch = None
         self.model = model
         self.updated.connect(self.on_update)
-        self.handle = model.uuid
+        # the gcsynth graph belongs to the agent, not the model. An edited
+        # preset keeps its uuid and is built while the old graph still 
+        # plays, see swap_filter_graph.
+        self.handle = str(uuid.uuid4())
 
         gcsynth.fgraph_api(gcsynth.FG_API_CREATE, self.handle)
 
@@ -244,16 +322,30 @@ class FilterGraphAgent(QtCore.QObject):
 
     def __del__(self):
         if self.handle is not None:
-            # first disable this filter.
-            #TODO.
-            gcsynth.fgraph_api(gcsynth.FG_API_DISABLE, self.handle)
-
-            # remove the nodes 
-            for uuid in list(self.node_agents.keys()):
-                # cleanup resources.
-                del self.node_agents[uuid]
-           
+            # gcsynth keeps the graph, nodes and all, until no channel runs
+            # it or fades it out, tearing it down node by node here would 
+            # be heard.
+            for nagent in self.node_agents.values():
+                nagent.detached = True
+            for nagent in (getattr(self, "input_node", None), getattr(self, "output_node", None)):
+                if nagent is not None:
+                    nagent.detached = True
             gcsynth.fgraph_api(gcsynth.FG_API_DESTROY, self.handle)
+            self.handle = None
+            self.node_agents.clear()
+
+
+def swap_filter_graph(model: FilterGraph, channels) -> FilterGraphAgent:
+    """
+    Switch channels to a new preset while they play. The gcsynth graph
+    for model is built and compiled first, then each channel crossfades
+    to it. The caller drops the agent it replaces, its graph is freed once
+    the fades are over.
+    """
+    fga = FilterGraphAgent(model)
+    for chan in channels:
+        fga.install_on_channel(chan)
+    return fga
 
 
 def connect_nodes(gnode1 : GraphNode, out_idx : int, gnode2 : GraphNode, in_idx : int):
@@ -4,6 +4,15 @@ import re
 import json
 import sys
 
+# instrument data and groups of the soundfonts by file identity, see
+# instrument_info.load_cache
+SF_CACHE_VERSION = 1
+
+
+def _file_id(path):
+    st = os.stat(path)
+    return [path, st.st_size, st.st_mtime_ns]
+
 
 class instrument_spec:
     def __init__(self):
@@ -47,15 +56,66 @@ class instrument_info:
         
 
     def setup(self):
+        "read the instruments.json written by gcsynth.start"
         sf_info_file = os.environ['GC_DATA_DIR']+"/sf_info/instruments.json"
         if not os.access(sf_info_file,os.F_OK):
             raise RuntimeError("instrument info file missing is gcsyth running?")
         
+        sf_info_list = json.loads(open(sf_info_file).read())
+        self._load(sf_info_list)
+        self.save_cache()
+
+    def cache_key(self):
+        "the soundfonts and groupings the instrument data was built from"
+        return {
+            'version': SF_CACHE_VERSION,
+            'fonts': [_file_id(path) for path in self.sfpaths],
+            'groupings': _file_id(self.ins_group_file)
+        }
+
+    def load_cache(self) -> bool:
+        """
+        Use the instrument data of the last run if the soundfonts (and
+        groupings.json) are the same files, the presets aren't listed 
+        or classified again. Returns False if they need to be, setup()
+        after gcsynth.start.
+        """
+        try:
+            with open(self.sf_cache_file) as f:
+                cache = json.load(f)
+            if cache.get('key') != self.cache_key():
+                return False
+        except (OSError, ValueError):
+            return False
+        self._load(cache['instruments'], cache['groups'])
+        return True
+
+    def save_cache(self):
+        cache = {
+            'key': self.cache_key(),
+            'instruments': self.instruments,
+            'groups': self.groups
+        }
+        tmp = self.sf_cache_file + ".tmp"
+        try:
+            with open(tmp, "w") as f:
+                json.dump(cache, f)
+            os.replace(tmp, self.sf_cache_file)
+        except OSError as e:
+            print(f"unable to write {self.sf_cache_file}: {e}", file=sys.stderr)
+
+    def _load(self, sf_info_list, groups = None):
+        """
+        build the instrument tables, classify the instruments unless
+        the groups are known.
+        """
         gset = {
             'other': set()
         }
+        self.instruments = []
+        self.prefered = {}
+        self.default_data = {}
 
-        sf_info_list = json.loads(open(sf_info_file).read())
         for sf_info in sf_info_list:
             sf_filename = sf_info['sf_filename']
             sfont_id = sf_info['sfont_id']
@@ -73,10 +133,15 @@ class instrument_info:
                 table[spec.name] = spec
 
                 # find group classification
-                self.classify(gset, spec)
+                if groups is None:
+                    self.classify(gset, spec)
 
             self.instruments.append(sf_info)
 
+        if groups is not None:
+            self.groups = groups
+            return
+
         for gname, iset in gset.items():
             instr_list = list(iset)
             instr_list.sort() 
@@ -98,5 +163,6 @@ class instrument_info:
         self.default_data = {}
         self.groups = {}
 
-        ins_group_file = os.environ['GC_DATA_DIR']+"/instruments/groupings.json"
-        self.group_spec = json.loads(open(ins_group_file).read())
+        self.ins_group_file = os.environ['GC_DATA_DIR']+"/instruments/groupings.json"
+        self.group_spec = json.loads(open(self.ins_group_file).read())
+        self.sf_cache_file = os.environ['GC_DATA_DIR']+"/sf_info/sf_cache.json"
@@ -20,6 +20,9 @@ class timer_event:
         self.control_name = ""
         self.control_value = 0.0
         self.pitch_change = 0.0
+        # events sharing a group can be cancelled together with
+        # gcsynth.timer_cancel(group)
+        self.group = 0
 
     def encode(self) -> dict:
         return vars(self)
@@ -50,6 +53,29 @@ class pitch_change(timer_event):
         self.pitch_change = value
 
 
+class pitch_range(timer_event):
+    """
+    sets the pitch wheel range in semitones, scheduled with the
+    rest of the events so bends use the right range.
+    """
+
+    def __init__(self, when: int, channel: int, value: float):
+        super().__init__(when, channel, gcsynth.EV_PITCH_RANGE)
+        self.pitch_range = value
+
+
+class progress(timer_event):
+    """
+    no audio, when the dispatcher reaches this event the callback
+    registered with synthservice.set_progress_callback is called with
+    (group, token) from the progress thread.
+    """
+
+    def __init__(self, when: int, token: int):
+        super().__init__(when, -1, gcsynth.EV_PROGRESS)
+        self.token = token
+
+
 class filter_add(timer_event):
     def __init__(self, when: int, channel: int,
                  plugin_path: str, plugin_label: str):
@@ -98,17 +124,21 @@ class sequencer:
         items.append(te.encode())
         self.te_events[te.when] = items
 
-    def play(self):
+    def play(self, epoch=None):
+        """
+        epoch: gcsynth.monotonic() time that 'when' is relative to,
+        defaults to the time of the call.
+        """
         # flatten dictionary sorted by timer event
         play_list = []
         if len(self.te_events) > 0:
             for when in sorted(self.te_events):
                 play_list += self.te_events[when]
             try:
-                self.synth_service.timer_event(play_list)
+                self.synth_service.timer_event(play_list, epoch)
             except Exception:
                 print("error in sequence play, this is a dump of the playlist:")
                 for (i, item) in enumerate(play_list):
-                    print((i, item.__class__.__name__, vars(item)))
+                    print((i, item))
                 # reraise
                 raise
@@ -5,6 +5,7 @@ from services.synth.instrument_info import instrument_info
 from services.synth.sequencer import sequencer
 import atexit
 import signal
+import threading
 
 class midi_channel_manager:
     DRUM_CHANNEL = 9
@@ -70,6 +71,8 @@ class synthservice:
         # filenames, instrument data etc.
         self.db = instrument_info()
         self.cm = midi_channel_manager(self)
+        # calls the progress callback, see set_progress_callback
+        self.progress_thread = None
         
         # stop audio threads on exit
         atexit.register(self.shutdown)
@@ -102,13 +105,23 @@ class synthservice:
     def reset_channel(self, chan):
         return gcsynth.reset_channel(chan)
 
-    def start(self):
+    def start(self, offline=False):
         # start audio threads, load sound fonts, generates a file called instruments.json
         # which contains meta data for the various intruments.
-        gcsynth.start({"sfpaths": self.db.sfpaths})
-
-        # read instrument data generated by gcsynth
-        self.db.setup()
+        # offline: no audio device, used for render_to_file.
+        cfg = {"sfpaths": self.db.sfpaths}
+        if offline:
+            cfg["offline"] = 1
+        # the soundfonts haven't changed since the last run, gcsynth
+        # doesn't need to list their presets.
+        cached = self.db.load_cache()
+        if cached:
+            cfg["sf_info"] = 0
+        gcsynth.start(cfg)
+
+        if not cached:
+            # read instrument data generated by gcsynth
+            self.db.setup()
         #print(self.db.groups)
 
     def list_capture_devices(self):
@@ -174,9 +187,46 @@ class synthservice:
     def channel_gain(self, channel: int, change: float):
         return gcsynth.channel_gain( channel, change)
 
-    def timer_event(self, ev_or_ev_list):
-        print(f"timer event called {ev_or_ev_list}")
-        return gcsynth.timer_event( ev_or_ev_list)
+    def timer_event(self, ev_or_ev_list, epoch=None):
+        """
+        Schedule one or more events on the gcsynth dispatcher, 'when'
+        is in milliseconds relative to epoch (gcsynth.monotonic() seconds),
+        defaults to now.
+        """
+        if epoch is None:
+            return gcsynth.timer_event(ev_or_ev_list)
+        return gcsynth.timer_event(ev_or_ev_list, epoch)
+
+    def timer_cancel(self, group: int = -1):
+        """ cancel pending events of a group, -1 cancels everything """
+        return gcsynth.timer_cancel(group)
+
+    def render_to_file(self, song, path: str, fmt: str = None, tail: float = 2.0):
+        """
+        Render a song to a wav or flac file faster than real time, the
+        synth must have been started with offline=True. Returns the length
+        of the audio in seconds. See services.synth.bounce
+        """
+        from services.synth.bounce import render_song
+        return render_song(song, path, fmt, tail)
+
+    def set_progress_callback(self, callback):
+        """ 
+        callback(group, token) for EV_PROGRESS events, called from a
+        thread of its own so the dispatcher never waits for the GIL.
+        None stops the thread. 
+        """
+        gcsynth.set_progress_callback(callback)
+        if callback is None:
+            self.progress_thread = None
+        elif self.progress_thread is None:
+            self.progress_thread = threading.Thread(
+                target=self._progress_loop, name="gcsynth-progress", daemon=True)
+            self.progress_thread.start()
+
+    def _progress_loop(self):
+        while gcsynth.progress_dispatch():
+            pass
     
     def pitch_range(self, channel: int, semitones: float):
         return gcsynth.pitchrange(channel, semitones)
@@ -1,7 +1,11 @@
 """
-threading.Timer is more accurate that QTimer
+threading.Timer is more accurate that QTimer, but it creates an OS thread
+per timer. GcTimer runs a single scheduler thread that services a heap of
+deadlines, starting a timer is O(log n) and cancelling one is O(1) (the heap
+entry is discarded lazily when it reaches the top).
 """
 import atexit
+import heapq
 import threading
 from typing import Tuple
 from PyQt6.QtCore import QObject, QTimer, pyqtSignal, Qt
@@ -14,8 +18,10 @@ from singleton_decorator import singleton
 @singleton
 class GcTimer(QObject):
     expired = pyqtSignal(int)
-    timers = {}
-    id_counter = 0
+
+    # when more than this fraction of the heap are cancelled timers
+    # the heap is rebuilt.
+    COMPACT_RATIO = 0.5
 
     log = None 
     if os.environ.get('GCTIMER_LOG','') == 'on':
@@ -24,10 +30,10 @@ class GcTimer(QObject):
 
     def invoke(self, timer_id):
         #print("timer.invoke timer_id " + str(self.timers.get(timer_id)))
-        if timer_id in self.timers:                
-            (callback, args, t) = self.timers[timer_id]
-            if timer_id in self.timers:
-                del self.timers[timer_id]
+        with self.cv:
+            entry = self.timers.pop(timer_id, None)
+        if entry is not None:
+            (callback, args, _) = entry
             # invoke callback
             callback( *args )
             if self.log is not None and self.log_reftime is not None:
@@ -36,35 +42,96 @@ class GcTimer(QObject):
                 self.log.write(msg)
                 self.log.flush()
 
+    def _compact(self):
+        "remove cancelled timers from the heap, called with self.cv held"
+        self.heap = [item for item in self.heap if item[1] in self.timers]
+        heapq.heapify(self.heap)
+
+    def _scheduler_loop(self):
+        """
+        Wait for the earliest deadline then invoke every timer that is due.
+        Callbacks are invoked without the lock held so they may start or
+        cancel other timers.
+        """
+        while True:
+            due = []
+            with self.cv:
+                while self.running:
+                    # discard cancelled timers at the top of the heap
+                    while len(self.heap) > 0 and self.heap[0][1] not in self.timers:
+                        heapq.heappop(self.heap)
+                    if len(self.heap) == 0:
+                        self.cv.wait()
+                        continue
+                    remaining = self.heap[0][0] - time.perf_counter()
+                    if remaining > 0:
+                        self.cv.wait(remaining)
+                        continue
+                    break
+                if not self.running:
+                    return
+                now = time.perf_counter()
+                while len(self.heap) > 0 and self.heap[0][0] <= now:
+                    (_, timer_id) = heapq.heappop(self.heap)
+                    if timer_id in self.timers:
+                        due.append(timer_id)
+
+            for timer_id in due:
+                try:
+                    self.invoke(timer_id)
+                except Exception:
+                    # a failing callback must not stop the scheduler
+                    import traceback
+                    traceback.print_exc()
 
     def _on_shutdown(self):
-        for (callback, args, t) in self.timers.values():
-            t.cancel()
-        self.timers = {}
+        with self.cv:
+            self.running = False
+            self.timers = {}
+            self.heap = []
+            self.cv.notify()
 
     def __init__(self):
         super().__init__()
+        # timer_id -> (callback, args, deadline)
+        self.timers = {}
+        # heap of (deadline, timer_id)
+        self.heap = []
+        self.id_counter = 0
+        self.running = True
+        self.cv = threading.Condition()
+
+        self.thread = threading.Thread(target=self._scheduler_loop,
+            name="GcTimer", daemon=True)
+        self.thread.start()
         atexit.register(self._on_shutdown)
 
     def start(self, when : float, callback, args = ()):
-        timer_id = self.id_counter 
-        self.id_counter += 1
-
         if self.log is not None and self.log_reftime is None:
             self.log_reftime = time.time()
 
-        t = threading.Timer(when, self.invoke, (timer_id,))
-
-        self.timers[timer_id] = (callback, args, t)
-
-        t.start()
+        deadline = time.perf_counter() + when
+        with self.cv:
+            timer_id = self.id_counter 
+            self.id_counter += 1
+            self.timers[timer_id] = (callback, args, deadline)
+            heapq.heappush(self.heap, (deadline, timer_id))
+            # only wake the scheduler if the earliest deadline changed
+            if self.heap[0][1] == timer_id:
+                self.cv.notify()
         return timer_id
 
     def cancel(self, timer_id):
-        if timer_id in self.timers:
-            (callback, args, t) = self.timers[timer_id]
-            t.cancel()
-            del self.timers[timer_id]
+        with self.cv:
+            if timer_id in self.timers:
+                del self.timers[timer_id]
+                if len(self.heap) > 64 and \
+                    len(self.timers) < len(self.heap) * self.COMPACT_RATIO:
+                    self._compact()
+
+    def stat(self):
+        with self.cv:
+            print(f"GcTimer: {len(self.timers)} pending, heap size {len(self.heap)}")
 
 
 if __name__ == '__main__':
@@ -23,6 +23,7 @@ class KeyProcessor:
                     te.fret[te.string] = (te.fret[te.string]*10) + n 
                 else:
                     te.fret[te.string] = n
+                te.touch()
                 return
 
             if te.fret[te.string] == 1:
@@ -35,6 +36,9 @@ class KeyProcessor:
                 te.fret[te.string] = key - Qt.Key.Key_0
         elif key in (Qt.Key.Key_Space, Qt.Key.Key_Delete):
             te.fret[te.string] = -1
+        else:
+            return
+        te.touch()
  
 
     FFF = [ord('f'),ord('f'),ord('f')]
@@ -143,8 +147,10 @@ class KeyProcessor:
             else:
                 te.dotted = False
                 te.double_dotted = True
+            tm.invalidate_time_index(tm.current_moment()[1])
         elif key in km.dur_lookup:
             self.proc_duration(key, te)
+            tm.invalidate_time_index(tm.current_moment()[1])
         elif key == km.TIED_NOTE:
             te.toggle_tied()
         elif key == km.START_REPEAT:
@@ -183,6 +183,7 @@ class EditorToolbar(QToolBar):
             te.double_dotted = True
         elif n == "tied-note":
             te.tied_notes[te.string] = btn.isChecked()
+            te.touch()
         else:
             # not a dot selected event.
             return    
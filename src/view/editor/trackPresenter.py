@@ -79,16 +79,19 @@ class TrackPresenter(QWidget):
 
     def set_duration(self, d: float):
         self.current_tab_event.duration = d
+        self.track_model.invalidate_time_index(self.current_measure)
         self.setup() 
 
     def set_dotted(self, state: bool):
         self.current_tab_event.dotted = state
         self.current_tab_event.double_dotted = not state
+        self.track_model.invalidate_time_index(self.current_measure)
         self.setup() 
         
     def set_double_dotted(self, state: bool):
         self.current_tab_event.dotted = not state
         self.current_tab_event.double_dotted = state
+        self.track_model.invalidate_time_index(self.current_measure)
         self.setup()
 
     def set_articulation(self, articulation):
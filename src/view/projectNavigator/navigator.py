@@ -1,7 +1,7 @@
 from PyQt6.QtWidgets import QToolBar, QVBoxLayout, QTreeView, QWidget, QMenu, QPushButton, QStyle
 from PyQt6.QtGui import QStandardItemModel, QAction, QStandardItem, QIcon
 
-from models.song import Song
+from models.song import Song, load_track
 from models.track import Track
 
 from view.dialogs.TrackPropertiesDialog import TrackPropertiesDialog
@@ -62,13 +62,13 @@ class Navigator(QWidget):
         
         if isinstance(item, PropertiesItem):
             (track_model, track_qmodel_item) = item.data()
-            dialog = TrackPropertiesDialog(self, track_model)
+            dialog = TrackPropertiesDialog(self, load_track(track_model))
             dialog.show()
         elif isinstance(item, TrackItem):
             evt = EditorEvent()
             item = index.model().itemFromIndex(index) # type: ignore
             evt.ev_type = EditorEvent.ADD_MODEL  # type: ignore
-            evt.model = item.data()
+            evt.model = load_track(item.data())
 
             self.current_track = evt.model
             song_model = item.parent().data()
@@ -0,0 +1,128 @@
+import copy
+import os
+import tempfile
+import unittest
+
+from models.track import Track
+from services.autosave import (ENTRY, Autosave, journal_path, read_entries,
+                               recover, replay, song_journal)
+from services.projectFormat import read_song, write_song
+from test_project_format import dump, frets, make_song
+
+
+def state(track):
+    # the journal is pickled, unpickling adds actual_duration (-1)
+    return [[kv for kv in r if kv[0] != 'actual_duration'] if isinstance(r, list) else r
+            for r in dump(track)]
+
+
+def set_fret(te, fret):
+    te.fret[0] = fret
+    te.touch()
+
+
+class TestAutosave(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, "song.gc")
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def open(self, lazy=True):
+        write_song(make_song(2, 4), self.path)
+        song = read_song(self.path, lazy=lazy)
+        song.filename = self.path
+        return (song, song_journal(song, self.path))
+
+    def test_1_journal_replay(self):
+        (song, j) = self.open()
+        assert(j.collect() == [])
+
+        t0 = song.tracks[0]
+        set_fret(t0.measures[1].tab_events[2], 7)
+        records = j.collect()
+        # only the edited measure is written
+        assert(len(records) == 1 and list(records[0][4]) == [j.morder[0][1]])
+        assert(records[0][3] is None)
+        j.append(records)
+
+        # insert a measure, change the title, add a track
+        t0.measures.insert(1, copy.deepcopy(t0.measures[0]))
+        t0.measures_changed()
+        t0.touch()
+        song.title = "autosaved"
+        t = Track()
+        t.track_edit_id = "new"
+        song.tracks.append(t)
+        records = j.collect()
+        kinds = [r[0] for r in records]
+        assert(kinds == ['song', 'track', 'track', 'tracks'])
+        assert(len(records[1][4]) == 1)
+        j.append(records)
+
+        # the project file is untouched until compaction
+        assert(read_song(self.path).title == "test song")
+        song2 = recover(self.path)
+        assert(song2.title == "autosaved")
+        assert([x.track_edit_id for x in song2.tracks] == ["track-0", "track-1", "new"])
+        for (a, b) in zip(song.tracks[:2], song2.tracks):
+            assert(state(a) == state(b))
+        assert(frets(song2.tracks[2]) == frets(t))
+
+        # journal applied to the file, a new one started
+        j.compact(j.snapshot())
+        assert(read_song(self.path).title == "autosaved")
+        assert(len(read_entries(j.jpath)) == 1)
+        assert(recover(self.path) is None)
+
+        set_fret(song.tracks[2].measures[0].tab_events[0], 3)
+        del song.tracks[1]
+        j.append(j.collect())
+        song3 = recover(self.path)
+        assert(len(song3.tracks) == 2)
+        assert(song3.tracks[1].measures[0].tab_events[0].fret[0] == 3)
+
+    def test_2_torn_and_stale(self):
+        (song, j) = self.open()
+        set_fret(song.tracks[1].measures[0].tab_events[0], 5)
+        j.append(j.collect())
+        set_fret(song.tracks[1].measures[3].tab_events[0], 6)
+        j.append(j.collect())
+
+        # crash in the middle of the last append
+        size = os.path.getsize(j.jpath)
+        with open(j.jpath, 'r+b') as f:
+            f.truncate(size - ENTRY.size)
+        song2 = recover(self.path)
+        t = song2.tracks[1]
+        assert(t.measures[0].tab_events[0].fret[0] == 5)
+        assert(t.measures[3].tab_events[0].fret[0] != 6)
+
+        # the file was written by something else since
+        write_song(make_song(2, 4), self.path)
+        (_, changed) = replay(self.path)
+        assert(not changed)
+
+    def test_3_worker(self):
+        (song, _) = self.open(lazy=False)
+        a = Autosave()
+        a.watch(song)
+        assert(a.is_watched(song))
+        set_fret(song.tracks[0].measures[2].tab_events[1], 11)
+        a.flush(timeout=10.0)
+        assert(os.path.exists(journal_path(self.path)))
+        assert(recover(self.path).tracks[0].measures[2].tab_events[1].fret[0] == 11)
+
+        a.save(song)
+        a.flush(timeout=10.0)
+        assert(read_song(self.path).tracks[0].measures[2].tab_events[1].fret[0] == 11)
+        assert(recover(self.path) is None)
+
+        a.unwatch(song)
+        a.flush(timeout=10.0)
+        assert(not os.path.exists(journal_path(self.path)))
+
+
+if __name__ == '__main__':
+    unittest.main()
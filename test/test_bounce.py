@@ -0,0 +1,97 @@
+import math
+import os
+import tempfile
+import unittest
+import wave
+from unittest import mock
+
+import music.instrument
+import services.synth.bounce as bounce
+from models.effect import Effects
+from models.track import Track
+from services.synth.bounce import open_writer, wav_writer
+
+
+class fake_instrument:
+    "stand in for music.instrument.Instrument, one channel per string"
+    def __init__(self, calls, name, tuning):
+        self.calls = calls
+        self.tuning = [40 + i for i in range(len(tuning))]
+        self.string_map = [[(1, 1.0)] for _ in tuning]
+        self.one_note_per_string = True
+
+    def setup_effects(self, ef):
+        self.calls.append(("setup_effects", ef))
+
+    def free_resources(self):
+        self.calls.append(("free_resources",))
+
+
+class TestBounce(unittest.TestCase):
+
+    def test_wav_writer(self):
+        "pcm chunks are streamed into a 16 bit stereo wav"
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, "out.wav")
+            w = open_writer(path, 44100)
+            self.assertIsInstance(w, wav_writer)
+            for _ in range(3):
+                w.write(b"\x00\x01" * 2 * 100)
+            w.close()
+
+            with wave.open(path, "rb") as r:
+                self.assertEqual(r.getnchannels(), 2)
+                self.assertEqual(r.getsampwidth(), 2)
+                self.assertEqual(r.getframerate(), 44100)
+                self.assertEqual(r.getnframes(), 300)
+
+    def test_unknown_format(self):
+        with self.assertRaises(ValueError):
+            open_writer("out.mp3", 44100)
+
+    def test_render_song(self):
+        "rendering stops at effect changes, the last block is cut to the length"
+        calls = []
+        block = 64
+        rendered = [0]
+
+        def render_offline(batch, until, write):
+            calls.append(("render_offline", [e['when'] for e in batch], until))
+            # whole blocks, past 'until'
+            end = math.ceil(until * 1000 / block) * block
+            write(b"\x00" * 4 * (end - rendered[0]))
+            rendered[0] = end
+
+        t = Track()
+        for te in t.measures[0].tab_events:
+            te.fret[0] = 1
+        effects = Effects()
+        t.measures[0].tab_events[2].effects = effects
+
+        with tempfile.TemporaryDirectory() as d, \
+            mock.patch.object(bounce.gcsynth, "render_offline", render_offline, create=True), \
+            mock.patch.object(bounce.gcsynth, "render_offline_reset",
+                              lambda: calls.append(("render_offline_reset",)), create=True), \
+            mock.patch.object(bounce.gcsynth, "SAMPLE_RATE", 1000, create=True), \
+            mock.patch.object(music.instrument, "Instrument",
+                              lambda *args: fake_instrument(calls, *args)):
+            path = os.path.join(d, "out.wav")
+            self.assertEqual(bounce.render_song([t], path, tail=0.5), 2.5)
+
+            # quarter notes at 120 bpm, the effects of the third at 1.0s
+            self.assertEqual([c[0] for c in calls], [
+                "render_offline_reset", "render_offline", "setup_effects",
+                "render_offline", "free_resources"])
+            (_, first, until1), (_, second, until2) = calls[1], calls[3]
+            self.assertEqual(until1, 1.0)
+            self.assertTrue(first and all(when < 1000.0 for when in first))
+            self.assertIs(calls[2][1], effects)
+            self.assertEqual(until2, 2.5)
+            self.assertTrue(second and all(when >= 1000.0 for when in second))
+
+            with wave.open(path, "rb") as r:
+                self.assertEqual(r.getnframes(), 2500)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,72 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import services.effectRepo as effectRepo
+
+
+class TestEffectRepo(unittest.TestCase):
+    """
+    The plugin scan with the plugin files faked, only which files are
+    opened matters here.
+    """
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        d = self.dir.name
+        self.opened = []
+        for name in ("amp.so", "delay.so"):
+            with open(os.path.join(d, name), "wb") as f:
+                f.write(b"plugin")
+        self.patches = [
+            mock.patch.object(effectRepo, "EFFECT_CFG_FILE", os.path.join(d, "config.json")),
+            mock.patch.object(effectRepo, "PLUGIN_CACHE_FILE", os.path.join(d, "cache.json")),
+            mock.patch.object(effectRepo, "LADSPA_FILE_SPEC", os.path.join(d, "*.so")),
+            mock.patch.object(effectRepo.gcsynth, "ladspa_plugin_labels", self.labels, create=True),
+            mock.patch.object(effectRepo.gcsynth, "filter_query",
+                              lambda path, label: [{"name": "gain"}], create=True),
+        ]
+        for p in self.patches:
+            p.start()
+
+    def tearDown(self):
+        for p in self.patches:
+            p.stop()
+        self.dir.cleanup()
+
+    def labels(self, filepath):
+        self.opened.append(os.path.basename(filepath))
+        base = os.path.basename(filepath)[:-3]
+        return [f"{base}_{i}:{base} {i}" for i in range(2)]
+
+    def repo(self):
+        return effectRepo.EffectRepository.__wrapped__()
+
+    def test_1_cached_scan(self):
+        repo = self.repo()
+        assert(sorted(self.opened) == ["amp.so", "delay.so"])
+        assert(sorted(repo.getNames()) == ["amp_0", "amp_1", "delay_0", "delay_1"])
+
+        # next start up opens nothing
+        self.opened.clear()
+        repo = self.repo()
+        assert(self.opened == [] and len(repo.getNames()) == 4)
+        assert(repo.get("delay_1").path.endswith("delay.so"))
+        assert(not repo.scan())
+        assert(self.opened == [])
+
+        # only the changed plugin is reopened, removed ones are dropped
+        with open(os.path.join(self.dir.name, "amp.so"), "ab") as f:
+            f.write(b"v2")
+        os.remove(os.path.join(self.dir.name, "delay.so"))
+        repo.scan_in_background().join()
+        assert(self.opened == ["amp.so"])
+        assert(sorted(repo.getNames()) == ["amp_0", "amp_1"])
+
+        self.opened.clear()
+        repo.scan(full=True)
+        assert(self.opened == ["amp.so"])
+
+
+if __name__ == '__main__':
+    unittest.main()
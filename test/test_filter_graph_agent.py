@@ -0,0 +1,146 @@
+import gc
+import pickle
+import unittest
+from unittest import mock
+
+import services.synth.fgraph_agent as fgraph_agent
+from models.filterGraph import FilterGraph, GraphConnection, InputNode, OutputNode, \
+    LowPassNode, HighPassNode
+
+
+# the gcsynth constants the agent uses, named so the calls read back
+CONSTANTS = [
+    "FG_API_CREATE", "FG_API_DESTROY", "FG_API_ENABLE", "FG_API_COMPILE", "FG_API_BATCH",
+    "FG_API_ADD_NODE", "FG_API_REMOVE_NODE", "FG_API_ADD_CONNECTION", "FG_API_REMOVE_CONNECTION",
+    "FG_API_SET_ATTR", "FG_NODE_TYPE_INPUT", "FG_NODE_TYPE_OUTPUT", "FG_NODE_TYPE_LOWPASS",
+    "FG_NODE_TYPE_HIGHPASS", "AID_LOW_PASS_FREQ", "AID_HIGH_PASS_FREQ",
+    "FG_API_INSTALL_ON_CHANNEL",
+]
+
+
+def connect(fg, node1, out_idx, node2, in_idx):
+    conn = GraphConnection()
+    conn.in_uuid = node1.uuid
+    conn.in_idx = out_idx
+    conn.out_uuid = node2.uuid
+    conn.out_idx = in_idx
+    fg.add_connection(conn)
+    return conn
+
+
+class TestFilterGraphAgent(unittest.TestCase):
+    """
+    Edits of a FilterGraph are patched onto gcsynth, the gcsynth calls
+    are recorded.
+    """
+    def setUp(self):
+        self.calls = []
+        self.patches = [
+            mock.patch.object(fgraph_agent.gcsynth, "fgraph_api",
+                              lambda *args: self.calls.append(args), create=True),
+            mock.patch.multiple(fgraph_agent.gcsynth, create=True,
+                                **{name: name for name in CONSTANTS}),
+        ]
+        for p in self.patches:
+            p.start()
+
+        self.model = FilterGraph()
+        nodes = [InputNode()] + [LowPassNode() for _ in range(40)] + [OutputNode()]
+        for node in nodes:
+            self.model.add_node(node)
+        self.conns = [connect(self.model, a, 0, b, 0) for (a, b) in zip(nodes, nodes[1:])]
+        self.lp = nodes[1:-1]
+        self.agent = fgraph_agent.FilterGraphAgent(self.model)
+        self.calls.clear()
+
+    def tearDown(self):
+        # the agent is in a cycle with its signal, destroy it while gcsynth
+        # is still faked
+        del self.agent
+        gc.collect()
+        for p in self.patches:
+            p.stop()
+
+    def edit(self):
+        return pickle.loads(pickle.dumps(self.agent.model))
+
+    def batch(self):
+        assert(len(self.calls) == 1 and self.calls[0][0] == "FG_API_BATCH")
+        return self.calls.pop()[2]
+
+    def test_1_diff(self):
+        past = self.edit()
+        fg = self.edit()
+        assert(not fg.diff(past)['change_occured'])
+        # comparing doesn't touch the connections
+        assert(all(vars(c).get('uuid') for c in fg.connections.values()))
+
+        fg.nodes[self.lp[3].uuid].threshold = 300.0
+        fg.remove_connection(self.conns[5].uuid)
+        report = fg.diff(past)
+        assert([n.uuid for n in report['nodes_updated']] ==
+               [self.lp[3].uuid, self.lp[4].uuid, self.lp[5].uuid])
+        assert([c.uuid for c in report['connections_removed']] == [self.conns[5].uuid])
+        assert(report['nodes_added'] == report['connections_added'] == [])
+
+    def test_2_patch(self):
+        h = self.agent.handle
+        lp = [n.uuid for n in self.lp]
+
+        # one attribute, not the graph
+        fg = self.edit()
+        fg.nodes[lp[20]].threshold = 300.0
+        self.agent.updated.emit(fg)
+        assert(self.batch() == [("FG_API_SET_ATTR", h, lp[20], "AID_LOW_PASS_FREQ", 300.0)])
+        assert(self.agent.model is fg)
+
+        # a high pass between the first two
+        fg = self.edit()
+        hp = HighPassNode()
+        fg.remove_connection(self.conns[1].uuid)
+        fg.add_node(hp)
+        c1 = connect(fg, fg.nodes[lp[0]], 0, hp, 0)
+        c2 = connect(fg, hp, 0, fg.nodes[lp[1]], 0)
+        self.agent.updated.emit(fg)
+        assert(self.batch() == [
+            ("FG_API_REMOVE_CONNECTION", h, self.conns[1].uuid),
+            ("FG_API_ADD_NODE", h, hp.uuid, "FG_NODE_TYPE_HIGHPASS"),
+            ("FG_API_SET_ATTR", h, hp.uuid, "AID_HIGH_PASS_FREQ", hp.threshold),
+            ("FG_API_ADD_CONNECTION", h, c1.uuid, lp[0], 0, hp.uuid, 0),
+            ("FG_API_ADD_CONNECTION", h, c2.uuid, hp.uuid, 0, lp[1], 0),
+        ])
+
+        # and out again, the agent doesn't remove it a second time
+        fg = self.edit()
+        fg.remove_connection(c1.uuid)
+        fg.remove_connection(c2.uuid)
+        del fg.nodes[hp.uuid]
+        c3 = connect(fg, fg.nodes[lp[0]], 0, fg.nodes[lp[1]], 0)
+        self.agent.updated.emit(fg)
+        assert(self.batch() == [
+            ("FG_API_REMOVE_CONNECTION", h, c1.uuid),
+            ("FG_API_REMOVE_CONNECTION", h, c2.uuid),
+            ("FG_API_REMOVE_NODE", h, hp.uuid),
+            ("FG_API_ADD_CONNECTION", h, c3.uuid, lp[0], 0, lp[1], 0),
+        ])
+        assert(hp.uuid not in self.agent.node_agents and len(self.agent.node_agents) == 40)
+        self.agent.updated.emit(self.edit())
+        assert(self.calls == [])
+
+    def test_3_swap(self):
+        # the same preset edited, built next to the graph that is playing
+        old = self.agent.handle
+        fga = fgraph_agent.swap_filter_graph(self.edit(), [3, 4])
+        assert(fga.handle != old and fga.model.uuid == self.model.uuid)
+        assert(self.calls[0] == ("FG_API_CREATE", fga.handle))
+        assert(self.calls[-2:] == [("FG_API_INSTALL_ON_CHANNEL", fga.handle, 3),
+                                   ("FG_API_INSTALL_ON_CHANNEL", fga.handle, 4)])
+        self.calls.clear()
+        del self.agent
+        gc.collect()
+        assert(self.calls == [("FG_API_DESTROY", old)])
+        self.agent = fga
+
+
+if __name__ == '__main__':
+    unittest.main()
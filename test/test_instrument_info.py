@@ -0,0 +1,68 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from services.synth.instrument_info import instrument_info
+
+
+class TestInstrumentInfo(unittest.TestCase):
+    """
+    The soundfont metadata cache, instruments.json is written here the
+    way gcsynth.start writes it.
+    """
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        d = self.dir.name
+        for sub in ("sf", "sf_info", "instruments"):
+            os.mkdir(os.path.join(d, sub))
+        shutil.copy(os.path.join(os.environ['GC_DATA_DIR'], "instruments", "groupings.json"),
+                    os.path.join(d, "instruments"))
+        self.fonts = []
+        for name in ("a.sf2", "b.sf2"):
+            path = os.path.join(d, "sf", name)
+            with open(path, "wb") as f:
+                f.write(b"font")
+            self.fonts.append(path)
+        self.env = mock.patch.dict(os.environ, {'GC_DATA_DIR': d})
+        self.env.start()
+
+    def tearDown(self):
+        self.env.stop()
+        self.dir.cleanup()
+
+    def write_sf_info(self, db):
+        names = [["Nylon Guitar", "Steel Guitar"], ["Acoustic Bass", "Flute"]]
+        sf_info = []
+        for (i, path) in enumerate(db.sfpaths):
+            instruments = [{"bank_num": 0, "name": n, "preset_num": j}
+                           for (j, n) in enumerate(names[self.fonts.index(path)])]
+            sf_info.append({"instruments": instruments, "sf_filename": path, "sfont_id": i + 1})
+        with open(os.path.join(self.dir.name, "sf_info", "instruments.json"), "w") as f:
+            json.dump(sf_info, f)
+
+    def test_1_cache(self):
+        db = instrument_info()
+        assert(not db.load_cache())
+        self.write_sf_info(db)
+        db.setup()
+
+        # next start up, nothing listed or classified
+        db2 = instrument_info()
+        with mock.patch.object(instrument_info, "classify") as classify:
+            assert(db2.load_cache())
+            classify.assert_not_called()
+        assert(db2.instrumentGroups() == db.instrumentGroups())
+        spec = db2.find("Flute")
+        assert(spec.sfont_id == db.find("Flute").sfont_id and spec.preset_num == 1)
+
+        # a changed font invalidates it
+        with open(self.fonts[1], "ab") as f:
+            f.write(b"v2")
+        assert(not instrument_info().load_cache())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+import os
+import pickle
+import tempfile
+import unittest
+
+from models.filterGraph import FilterGraph
+from models.song import Song
+from services.modelManager import Manifest, ModelManager
+
+
+def preset(name):
+    fg = FilterGraph()
+    fg.preset = name
+    return fg
+
+
+class TestModelManager(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.model_dir = os.path.join(self.dir.name, "models")
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def store(self):
+        # not the singleton, a fresh store every time
+        return ModelManager.__wrapped__(self.model_dir)
+
+    def test_1_index(self):
+        m = Manifest()
+        for name in ("Clean", "crunch", "Chorus Lead", "Big Hall", "Crunchy Rhythm"):
+            m.add_model(preset(name))
+        s = Song()
+        s.title = "Crunch Time"
+        m.add_model(s)
+
+        assert(m.getPresets() == ["Big Hall", "Chorus Lead", "Clean", "crunch", "Crunchy Rhythm"])
+        assert(m.getSongTitles() == ["Crunch Time"])
+        assert(m.search("cr", "FilterGraph") == ["crunch", "Crunchy Rhythm"])
+        assert(m.search("x", "FilterGraph") == [])
+        assert(m.fuzzy_search("crnch", "FilterGraph")[0] == "crunch")
+        assert(m.fuzzy_search("hall", "FilterGraph") == ["Big Hall"])
+
+        # renamed and overwritten
+        fg = preset("Clean")
+        m.add_model(fg)
+        assert(m.getPresets().count("Clean") == 1)
+        fg.preset = "Clean 2"
+        m.update_name(fg)
+        assert("Clean" not in m.getPresets() and m.lookup("Clean 2").uuid == fg.uuid)
+
+        # indexes are rebuilt from an old pickle
+        m2 = pickle.loads(pickle.dumps(m))
+        assert(m2.getPresets() == m.getPresets())
+        m2.remove_model("crunch")
+        assert(m2.search("cr", "FilterGraph") == ["Crunchy Rhythm"])
+
+    def test_2_journal(self):
+        store = self.store()
+        for i in range(5):
+            store.add_model(preset(f"preset {i}"))
+        store.remove_model("preset 3")
+        assert(not os.path.exists(store.manifest_file))
+        assert(store.journal_records == 6)
+
+        store2 = self.store()
+        assert(store2.get_presets() == ["preset 0", "preset 1", "preset 2", "preset 4"])
+        assert(store2.get_model("preset 4").preset == "preset 4")
+
+        # overwriting a preset removes the old file
+        old = store2.manifest.lookup_filename("preset 1")
+        store2.add_model(preset("preset 1"))
+        assert(not os.path.exists(old))
+
+        store2.compact()
+        assert(not os.path.exists(store2.journal_file))
+        assert(self.store().get_presets() == store2.get_presets())
+
+
+if __name__ == '__main__':
+    unittest.main()
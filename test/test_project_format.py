@@ -0,0 +1,158 @@
+import os
+import pickle
+import tempfile
+import unittest
+
+from models.effect import Effect, Effects
+from models.song import Song
+from models.track import Track
+from models.song import TrackList, TrackStub, load_track
+from services.projectFormat import (ProjectFormatError, encode_song,
+                                    read_song, write_song)
+
+
+def make_song(n_tracks=2, n_measures=8):
+    song = Song()
+    song.title = "test song"
+    for ti in range(n_tracks):
+        t = Track()
+        t.track_edit_id = f"track-{ti}"
+        for _ in range(n_measures - 1):
+            t.append_measure()
+        for (mi, m) in enumerate(t.measures):
+            for (i, te) in enumerate(m.tab_events):
+                te.fret[i % 6] = (mi + i) % 24
+        song.tracks.append(t)
+    return song
+
+
+def frets(track):
+    return [te.fret for m in track.measures for te in m.tab_events]
+
+
+def dump(track):
+    "comparable state of a track, layout and cache attributes excluded"
+    r = []
+    for m in track.measures:
+        ts = m.timesig
+        r.append((m.bpm, m.key, ts and (ts.beats_per_measure, ts.beat_note_id),
+                  m.measure_number, m.start_repeat, bool(m.staff_changes)))
+        for te in m.tab_events:
+            state = te.__getstate__()
+            state.pop('note_ypos')
+            state['effects'] = te.effects and \
+                [(k, e.enabled, [p.current_value for p in e.params.values()])
+                 for (k, e) in te.effects.etable.items()]
+            r.append(sorted(state.items(), key=lambda kv: kv[0]))
+    return r
+
+
+class TestProjectFormat(unittest.TestCase):
+    def test_1_round_trip(self):
+        song = make_song()
+        t = song.tracks[1]
+        t.measures[2].bpm = 90
+        t.measures[3].key = "G"
+        t.measures[3].start_repeat = True
+        te = t.measures[1].tab_events[2]
+        te.dotted = True
+        te.legato = False
+        te.tied_notes[3] = True
+        te.pitch_changes = [(0.0, 0.5), (0.5, 1.0)]
+        te.tuplet_group_id = "g1"
+        te.actual_duration = 0.75
+
+        e = Effect("Gain", "amp", "/usr/lib/ladspa/amp.so",
+                   [{"name": "gain", "default_value": 1.0}])
+        e.enable()
+        e.params["gain"].current_value = 2.0
+        fx = Effects()
+        fx.add("amp", e)
+        # the same effect on many tab events is stored once
+        for m in t.measures:
+            m.tab_events[0].effects = fx
+
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, "song.gc")
+            write_song(song, path)
+            song2 = read_song(path)
+
+        assert(song2.title == song.title and song2.uuid == song.uuid)
+        assert(len(song2.tracks) == 2)
+        for (a, b) in zip(song.tracks, song2.tracks):
+            assert(a.track_edit_id == b.track_edit_id and a.tuning == b.tuning)
+            assert(dump(a) == dump(b))
+
+        t2 = song2.tracks[1]
+        assert(t2.getMeasureParams(t2.measures[4])[1:3] == (90, "G"))
+        te2 = t2.measures[1].tab_events[2]
+        assert(te2.actual_duration == 0.75)
+        fx2 = t2.measures[0].tab_events[0].effects
+        assert(fx2 is not t2.measures[1].tab_events[0].effects)
+        assert(fx2.etable["amp"].get_param_by_name("gain").current_value == 2.0)
+
+    def test_2_pickle_import(self):
+        song = make_song(1)
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, "old.gc")
+            with open(path, 'wb') as f:
+                pickle.dump(song, f)
+            old = read_song(path)
+            assert(frets(old.tracks[0]) == frets(song.tracks[0]))
+
+            # saved again in the new format, much smaller
+            write_song(old, path)
+            with open(path, 'rb') as f:
+                assert(f.read(4) == b"GCPF")
+            assert(os.path.getsize(path) < len(pickle.dumps(song)) / 4)
+            assert(dump(read_song(path).tracks[0]) == dump(old.tracks[0]))
+
+    def test_3_newer_version(self):
+        data = bytearray(encode_song(make_song(1, 1)))
+        data[4] = 99
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, "new.gc")
+            with open(path, 'wb') as f:
+                f.write(data)
+            with self.assertRaises(ProjectFormatError):
+                read_song(path)
+
+    def test_4_lazy_tracks(self):
+        song = make_song(3)
+        song.tracks[2].instrument_name = "Bass"
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, "song.gc")
+            write_song(song, path)
+            lazy = read_song(path, lazy=True)
+
+            # the navigator only needs the header
+            entries = lazy.track_entries()
+            assert(isinstance(lazy.tracks, TrackList))
+            assert(all(isinstance(e, TrackStub) for e in entries))
+            assert([e.instrument_name for e in entries] ==
+                   [t.instrument_name for t in song.tracks])
+            assert(entries[1].measure_count == 8)
+
+            # selected in the navigator
+            t1 = load_track(entries[1])
+            assert(dump(t1) == dump(song.tracks[1]))
+            assert(lazy.tracks.index(t1) == 1 and t1 in lazy.tracks)
+            assert(not lazy.tracks.is_loaded(0))
+            assert(lazy.tracks[0].track_edit_id == "track-0")
+            assert(lazy.tracks.is_loaded(0) and not lazy.tracks.is_loaded(2))
+
+            # an edited track is encoded, the one never loaded is copied
+            t1.measures[0].tab_events[0].fret[0] = 12
+            write_song(lazy, path)
+            assert(not entries[2].source.f.closed)
+            song2 = read_song(path)
+            assert(song2.tracks[1].measures[0].tab_events[0].fret[0] == 12)
+            assert(dump(song2.tracks[2]) == dump(song.tracks[2]))
+
+            # everything is loaded by iterating, e.g. the player
+            assert(len(list(lazy.tracks)) == 3)
+            assert(entries[2].source.f.closed)
+
+
+if __name__ == '__main__':
+    unittest.main()
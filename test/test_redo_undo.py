@@ -0,0 +1,139 @@
+import os
+import pickle
+import tempfile
+import unittest
+
+from models.track import Track
+from services.redoUndo import track_change_entry
+
+
+def frets(track):
+    return [[te.fret[0] for te in m.tab_events] for m in track.measures]
+
+
+def set_fret(te, fret):
+    # in place edit, see models.revision
+    te.fret[0] = fret
+    te.touch()
+
+
+class TestRedoUndo(unittest.TestCase):
+    def test_1_undo_redo_in_place(self):
+        t = Track()
+        for _ in range(5):
+            t.append_measure()
+        h = track_change_entry(t)
+        states = [frets(t)]
+
+        t.set_moment(3, 1)
+        set_fret(t.measures[3].tab_events[1], 5)
+        h.update(t)
+        states.append(frets(t))
+
+        # moving the cursor is not an edit
+        t.set_moment(0, 2)
+        h.update(t)
+        assert(len(h.history) == 1)
+
+        set_fret(t.measures[0].tab_events[2], 7)
+        t.measures[0].bpm = 90
+        h.update(t)
+        states.append(frets(t))
+        # only the edited measure is in the delta
+        assert(len(h._load(-1).changes) == 1)
+
+        t.set_moment(1, 0)
+        t.remove_measure()
+        h.update(t)
+        states.append(frets(t))
+        assert(h._load(-1).order_after is not None)
+
+        for i in range(len(states) - 1, 0, -1):
+            assert(h.undo(t) is t)
+            assert(frets(t) == states[i-1])
+        assert(h.undo(t) is None)
+        assert(t.getMeasureParams(t.measures[1])[1] == 120)
+
+        for i in range(1, len(states)):
+            assert(h.redo(t) is t)
+            assert(frets(t) == states[i])
+        assert(h.redo(t) is None)
+        assert(t.getMeasureParams(t.measures[0])[1] == 90)
+
+        # an edit after an undo drops the redo history
+        h.undo(t)
+        set_fret(t.measures[2].tab_events[0], 3)
+        h.update(t)
+        assert(h.redo(t) is None)
+        assert(len(h.history) == 3)
+
+    def test_2_keyframes(self):
+        t = Track()
+        t.append_measure()
+        h = track_change_entry(t)
+        h.KEYFRAME_INTERVAL = 4
+        for i in range(10):
+            set_fret(t.measures[i % 2].tab_events[0], i)
+            h.update(t)
+        assert(h.history[3].keyframe)
+
+        # a copy of the track, e.g. reloaded, is rebuilt from a keyframe
+        other = pickle.loads(pickle.dumps(t))
+        t2 = h.undo(other)
+        assert(t2 is not other and t2 is not t)
+        assert(frets(t2)[0][0] == 8 and frets(t2)[1][0] == 7)
+        t2 = h.undo(t2)
+        assert(frets(t2)[0][0] == 6 and frets(t2)[1][0] == 7)
+
+    def test_3_bounded_history(self):
+        t = Track()
+        for _ in range(7):
+            t.append_measure()
+        start = frets(t)
+        h = track_change_entry(t, memory_budget=2000, journal_budget=8000)
+        h.journal_path = os.path.join(tempfile.mkdtemp(), "undo.journal")
+        for i in range(200):
+            t.set_moment(i % 8, 0)
+            set_fret(t.measures[i % 8].tab_events[i % 4], i % 24)
+            h.update(t)
+        last = frets(t)
+
+        stats = h.stats()
+        assert(stats["spilled"] > 0 and stats["coalesced"] > 0)
+        assert(h.memory_bytes <= 2000)
+        assert(os.path.getsize(h.journal_path) == stats["journal_bytes"] <= 8000)
+
+        # the start is still reachable, in fewer steps
+        steps = 0
+        while h.undo(t) is not None:
+            steps += 1
+        assert(steps == stats["steps"] < 200)
+        assert(frets(t) == start)
+        while h.redo(t) is not None:
+            pass
+        assert(frets(t) == last)
+        assert(h.stats()["undo_ms_max"] > 0.0)
+
+        h.close()
+        assert(not os.path.exists(h.journal_path))
+
+    def test_4_untouched_edit(self):
+        t = Track()
+        t.append_measure()
+        h = track_change_entry(t)
+        # the delta is found by the revision stamps, not the cursor
+        t.set_moment(0, 0)
+        set_fret(t.measures[1].tab_events[3], 9)
+        h.update(t)
+        assert(len(h.history) == 1)
+        assert(list(h._load(-1).changes) == [h.order[1]])
+
+        # nothing stamped, nothing compared
+        seen = h.seen
+        t.set_moment(1, 2)
+        h.update(t)
+        assert(h.seen == seen and h.cursor == 1 and len(h.history) == 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
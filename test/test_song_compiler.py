@@ -0,0 +1,104 @@
+import unittest
+
+from models.track import Track
+from music.constants import Dynamic
+from services.songCompiler import *
+
+
+class test_instrument:
+    "stand in for music.instrument.Instrument, one channel per string"
+    def __init__(self, track: Track):
+        self.tuning = [40 + i for i in range(len(track.tuning))]
+        self.string_map = [[(1, 1.0)] for _ in track.tuning]
+        self.one_note_per_string = True
+
+    def setup_effects(self, ef):
+        pass
+
+
+def note_events(timeline, ev_type):
+    return [e for e in timeline.events if e.ev_type == ev_type]
+
+
+class TestSongCompiler(unittest.TestCase):
+    def test_1_sorted_absolute_times(self):
+        t = Track()
+        t.append_measure()
+        for m in t.measures:
+            for te in m.tab_events:
+                te.fret[0] = 1
+        tl = SongCompiler([t], [test_instrument(t)]).compile()
+        assert(tl.times == sorted(tl.times))
+        noteons = note_events(tl, EV_NOTEON)
+        assert(len(noteons) == 8)
+        # 120 bpm quarter notes are half a second apart
+        assert([e.when for e in noteons] == [i * 0.5 for i in range(8)])
+        assert(tl.duration == 4.0)
+
+    def test_2_repeats_and_measure_marks(self):
+        t = Track()
+        t.append_measure()
+        t.measures[0].start_repeat = True
+        t.measures[0].end_repeat = True
+        t.measures[0].repeat_count = 1
+        tl = SongCompiler([t], [test_instrument(t)]).compile()
+        assert([mm.when for mm in tl.measure_marks] == [0.0, 2.0, 4.0])
+        assert([mm.measure_idx for mm in tl.measure_marks] == [0, 0, 1])
+        assert(tl.measure_start(2.5, 1) == 4.0)
+        assert(tl.measure_start(2.5, -1) == 0.0)
+
+    def test_3_noteoff_before_replucking_string(self):
+        t = Track()
+        te1, te2 = t.measures[0].tab_events[:2]
+        te1.fret[0] = 1
+        te1.legato = True
+        te2.fret[0] = 3
+        tl = SongCompiler([t], [test_instrument(t)]).compile()
+        evts = [(e.ev_type, e.midi_code) for e in tl.events if e.when == 0.5
+                and e.ev_type in (EV_NOTEON, EV_NOTEOFF)]
+        assert(evts == [(EV_NOTEOFF, 41), (EV_NOTEON, 43)])
+
+    def test_4_compiled_track_is_copy_free(self):
+        t = Track()
+        t.append_measure()
+        t.append_measure()
+        t.measures[0].start_repeat = True
+        t.measures[1].start_repeat = True
+        t.measures[1].end_repeat = True
+        t.measures[1].repeat_count = 1
+        t.measures[2].end_repeat = True
+        t.measures[2].repeat_count = 1
+        t.measures[0].tab_events[0].dynamic = Dynamic.FF
+        t.measures[0].tab_events[1].dynamic = None
+        ct = CompiledTrack(t)
+        # (m1 m2 m2 m3) twice
+        assert(len(ct) == 32)
+        assert(ct.ranges == [(0, 8), (4, 12), (0, 8), (4, 12)])
+        te, m = ct[8]
+        assert(te is t.measures[1].tab_events[0] and m is t.measures[1])
+        assert(all(te is ct.tab_events[i] for (i, (te, _)) in enumerate(ct) if i < 8))
+        assert(ct.dynamic[1] == Dynamic.FF)
+        assert(ct.dynamic[2] == Dynamic.MP)
+        # the model is not altered by resolving dynamics.
+        assert(t.measures[0].tab_events[1].dynamic is None)
+
+    def test_5_loop_region(self):
+        t = Track()
+        for _ in range(3):
+            t.append_measure()
+        for m in t.measures:
+            for te in m.tab_events:
+                te.fret[0] = 1
+        # the last note of the region is tied into the next measure
+        t.measures[3].tab_events[0].tied_notes[0] = True
+        tl = compile_region([t], [test_instrument(t)], 1, 2)
+        assert(tl.duration == 4.0)
+        assert([mm.measure_idx for mm in tl.measure_marks] == [1, 2])
+        assert(all(e.when <= 4.0 for e in tl.events))
+        # every note is turned off within the region
+        assert(len(note_events(tl, EV_NOTEON)) == len(note_events(tl, EV_NOTEOFF)) == 8)
+        assert(note_events(tl, EV_NOTEOFF)[-1].when == 4.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -52,6 +52,126 @@ class TestTrackModel(unittest.TestCase):
         
         (tab_e,m) = t.next_moment()
         assert(not tab_e)
+
+    def test_4_measure_params(self):
+        t = Track()
+        for i in range(2, 7):
+            t.append_measure(measure_number=i)
+        ts34 = TimeSig()
+        ts34.beats_per_measure = 3
+
+        # a measure's own settings take effect at that measure
+        t.measures[2].bpm = 90
+        assert(t.getMeasureParams(t.measures[1])[1] == 120)
+        assert(t.getMeasureParams(t.measures[2])[1] == 90)
+        assert(t.getMeasureParams(t.measures[5])[1] == 90)
+
+        # editing a measure invalidates the index from there onward
+        t.measures[4].timesig = ts34
+        t.measures[4].key = "G"
+        (ts, bpm, key, cleff) = t.getMeasureParams(t.measures[5])
+        assert(ts is ts34 and bpm == 90 and key == "G")
+        assert(cleff == t.cleff)
+        assert(t.getMeasureParams(t.measures[3])[0] is t.measures[0].timesig)
+
+        # measures removed/inserted are picked up
+        t.set_moment(2, 0)
+        t.remove_measure()
+        assert(t.getMeasureParams(t.measures[4])[1] == 120)
+        m = t.blank_measure(bpm=60)
+        t.measures.insert(1, m)
+        assert(t.getMeasureParams(t.measures[5])[1] == 60)
+        assert(t.getMeasureParams(t.measures[0])[1] == 120)
+
+    def test_5_measure_params_pickle(self):
+        import copy
+        import pickle
+        t = Track()
+        t.append_measure(bpm=100)
+        assert(t.getMeasureParams(t.measures[1])[1] == 100)
+
+        t2 = pickle.loads(pickle.dumps(t))
+        t2.measures[1].bpm = 80
+        assert(t2.getMeasureParams(t2.measures[1])[1] == 80)
+        # the original is not affected
+        assert(t.getMeasureParams(t.measures[1])[1] == 100)
+
+        t3 = copy.deepcopy(t)
+        t3.measures[0].bpm = 70
+        assert(t3.getMeasureParams(t3.measures[1])[1] == 100)
+        assert(t3.getMeasureParams(t3.measures[0])[1] == 70)
+
+    def test_6_time_index(self):
+        t = Track()
+        t.append_measure(bpm=60)
+        t.append_measure()
+        # 4 quarter notes at 120 then 60 bpm
+        assert(t.length() == (12.0, 2.0 + 4.0 + 4.0))
+        assert(t.moment_start(1, 2) == (6.0, 4.0))
+        assert(t.moment_at_time(4.5) == (1, 2))
+        assert(t.moment_at_beat(4.0) == (1, 0))
+        assert(t.moment_at_time(-1.0) == (0, 0))
+        assert(t.moment_at_time(100.0) == (2, 3))
+
+        # dotted notes and tuplets
+        te = t.measures[0].tab_events[0]
+        te.dotted = True
+        t.invalidate_time_index(t.measures[0])
+        assert(t.moment_start(0, 1) == (1.5, 0.75))
+        te.dotted = False
+        te.tuplet_code = 3
+        t.invalidate_time_index(t.measures[0])
+        assert(t.moment_start(0, 1)[0] == round(2.0 / 3.0, 4))
+
+        # insert/remove update the index, a bpm change moves everything after
+        te.tuplet_code = -1
+        t.invalidate_time_index(t.measures[0])
+        t.set_moment(1, 0)
+        ins = TabEvent(len(t.tuning))
+        t.insert_tab_events([ins])
+        assert(t.length()[0] == 13.0)
+        assert(t.moment_at_beat(12.5) == (3, 0))
+        t.remove_tab_events([t.measures[1].tab_events[0]])
+        assert(t.moment_start(2, 0) == (8.0, 6.0))
+        t.measures[2].bpm = 120
+        assert(t.moment_start(3, 0) == (12.0, 8.0))
+
+        t.seek_time(5.0)
+        (te, m) = t.current_moment()
+        assert(m is t.measures[1] and te is m.tab_events[3])
+
+    def test_7_revisions(self):
+        import pickle
+        from models.revision import model_revision
+        t = Track()
+        t.append_measure()
+        rev = model_revision()
+        assert(not t.modified_since(rev))
+
+        # cursors are not edits
+        t.set_moment(1, 2)
+        t.measures[1].tab_events[2].string = 3
+        assert(not t.modified_since(rev))
+
+        te = t.measures[1].tab_events[2]
+        te.fret[3] = 5
+        te.touch()
+        assert(t.modified_since(rev))
+        assert(t.measures[1].revision() > rev)
+        assert(not t.measures[0].modified_since(rev))
+        assert(not t.modified_since(model_revision()))
+
+        # the time index notices duration edits it wasn't told about
+        assert(t.length()[0] == 8.0)
+        te.dotted = True
+        assert(t.length()[0] == 8.5)
+        te.dotted = False
+        te.tuplet_code = 3
+        assert(t.length()[0] == round(7.0 + te.beats(1.0), 4))
+
+        # stamps are not saved
+        assert('_rev' not in pickle.loads(pickle.dumps(t)).__dict__)
+        assert('_rev' not in te.__getstate__())
         
 
 
@@ -9,6 +9,9 @@ EV_FILTER_REMOVE: int
 EV_NOTEOFF: int
 EV_NOTEON: int
 EV_PITCH_WHEEL: int
+EV_PITCH_RANGE: int
+EV_PROGRESS: int
+SAMPLE_RATE: int
 NUM_CHANNELS: int
 LIVE_CAPTURE_CHANNEL: int
 
@@ -69,7 +72,12 @@ def select(chan, sfont_id, bank, preset) -> Any: ...
 def start(*args, **kwargs): ...
 def stop(*args, **kwargs): ...
 def test_filter(path: str, plugin_label: str): ...
-def timer_event(*args, **kwargs): ...
+def timer_event(ev_or_ev_list, epoch: float = ...): ...
+def timer_cancel(group: int = -1): ...
+def set_progress_callback(callback): ...
+def monotonic() -> float: ...
+def render_offline(ev_list, until: float, writer): ...
+def render_offline_reset(): ...
 def pitchrange(chan: int, semitones: float): ...
 def pitchwheel(chan: int, semitones: float): ...
 def ladspa_plugin_labels(filepath: str): ...